@@ -9,5 +9,8 @@ tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True)
 model = AutoModelForSequenceClassification.from_pretrained(model_id)
 explainer = KernelShap(model, tokenizer)
 
-attributions = explainer(model_inputs='McTeer: Lonesome Dove to be an Aggie NEW YORK (CNN/Money) - A New Economy champion, a lover of the Texas picker poets who write lovesick country songs...and, oh, by the way, a member of the Federal Reserve system for 36 years.', targets=torch.arange(len(classes_names)))
+attributions = explainer(
+    model_inputs='McTeer: Lonesome Dove to be an Aggie NEW YORK (CNN/Money) - A New Economy champion, a lover of the Texas picker poets who write lovesick country songs...and, oh, by the way, a member of the Federal Reserve system for 36 years.',
+    targets=torch.arange(len(classes_names))
+)
 plot_attributions(attributions[0], classes_names=classes_names)
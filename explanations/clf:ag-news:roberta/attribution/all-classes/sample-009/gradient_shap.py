@@ -9,5 +9,8 @@ tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True)
 model = AutoModelForSequenceClassification.from_pretrained(model_id)
 explainer = GradientShap(model, tokenizer)
 
-attributions = explainer(model_inputs='Dollar Stabilizes Above Recent Lows (Reuters) Reuters - The dollar edged up against the yen and\\steadied against the euro on Friday, but kept within sight of\\multi-month lows hit this week on worries about the U.S.\\economy and its ability to attract global investors.', targets=torch.arange(len(classes_names)))
+attributions = explainer(
+    model_inputs='Dollar Stabilizes Above Recent Lows (Reuters) Reuters - The dollar edged up against the yen and\\steadied against the euro on Friday, but kept within sight of\\multi-month lows hit this week on worries about the U.S.\\economy and its ability to attract global investors.',
+    targets=torch.arange(len(classes_names))
+)
 plot_attributions(attributions[0], classes_names=classes_names)
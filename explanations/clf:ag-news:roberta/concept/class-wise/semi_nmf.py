@@ -2,7 +2,7 @@ import torch
 from datasets import load_dataset
 from transformers import AutoModelForSequenceClassification
 from interpreto import ModelWithSplitPoints, plot_concepts
-from interpreto.concepts import SemiNMFConcepts, NeuronsAsConcepts
+from interpreto.concepts import SemiNMFConcepts
 from interpreto.concepts.interpretations import TopKInputs
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -34,12 +34,7 @@ for target, class_name in enumerate(['World', 'Sports', 'Business', 'Sci/Tech'])
     class_inputs = [inputs[i] for i in indices]
     class_activations = {k: v[indices] for k, v in activations.items()}
 
-    concept_explainer = SemiNMFConcepts(
-        model_with_split_points,
-        nb_concepts=20,
-        device=device,
-    )
-
+    concept_explainer = SemiNMFConcepts(model_with_split_points, nb_concepts=20, device=device)
     concept_explainer.fit(class_activations)
 
     topk_inputs_method = TopKInputs(
@@ -60,15 +55,18 @@ for target, class_name in enumerate(['World', 'Sports', 'Business', 'Sci/Tech'])
     )
     concepts_labels[target] = {k: list(v.keys()) for k, v in topk_words.items() if v}
 
-    gradients = concept_explainer.concept_output_gradient(
-        inputs=class_inputs,
-        targets=[target],
-        activation_granularity=granularity,
-        concepts_x_gradients=True,
-        batch_size=64,
-    )
-
-    concepts_importances[target] = torch.stack(gradients).abs().squeeze().mean(0)
+    # Mean absolute concept gradient, accumulated batch by batch.
+    gradient_sum = 0
+    for start in range(0, len(class_inputs), 64):
+        gradients = concept_explainer.concept_output_gradient(
+            inputs=class_inputs[start : start + 64],
+            targets=[target],
+            activation_granularity=granularity,
+            concepts_x_gradients=True,
+            batch_size=64,
+        )
+        gradient_sum += torch.cat(gradients, dim=1).abs().sum(1)
+    concepts_importances[target] = gradient_sum[0] / len(class_inputs)
 
 plot_concepts(
     classes_names=['World', 'Sports', 'Business', 'Sci/Tech'],
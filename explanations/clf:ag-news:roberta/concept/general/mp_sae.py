@@ -2,9 +2,9 @@ import torch
 from datasets import load_dataset
 from transformers import AutoModelForSequenceClassification
 from interpreto import ModelWithSplitPoints, plot_concepts
-from interpreto.concepts import MpSAEConcepts, NeuronsAsConcepts
-from interpreto.concepts.interpretations import TopKInputs
+from interpreto.concepts import MpSAEConcepts
 from interpreto.concepts.methods.overcomplete import MSELoss
+from interpreto.concepts.interpretations import TopKInputs
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
@@ -25,12 +25,7 @@ activations = model_with_split_points.get_activations(
     include_predicted_classes=True,
 )
 
-concept_explainer = MpSAEConcepts(
-    model_with_split_points,
-    nb_concepts=30,
-    device=device,
-)
-
+concept_explainer = MpSAEConcepts(model_with_split_points, nb_concepts=30, device=device)
 concept_explainer.fit(
     activations,
     criterion=MSELoss,
@@ -60,16 +55,19 @@ topk_words = topk_inputs_method.interpret(
     concepts_indices="all",
 )
 
-gradients = concept_explainer.concept_output_gradient(
-    inputs=inputs,
-    targets=None,
-    activation_granularity=granularity,
-    concepts_x_gradients=True,
-    batch_size=64,
-)
-
-mean_gradients = torch.stack(gradients).abs().squeeze().mean(0)
-labels = {k: list(v.keys()) for k, v in topk_words.items()}
+# Mean absolute concept gradient per class, accumulated batch by batch.
+gradient_sum = 0
+for start in range(0, len(inputs), 64):
+    gradients = concept_explainer.concept_output_gradient(
+        inputs=inputs[start : start + 64],
+        targets=None,
+        activation_granularity=granularity,
+        concepts_x_gradients=True,
+        batch_size=64,
+    )
+    gradient_sum += torch.cat(gradients, dim=1).abs().sum(1)
+mean_gradients = gradient_sum / len(inputs)
+labels = {k: list(v.keys()) for k, v in topk_words.items() if v}
 
 plot_concepts(
     classes_names=['World', 'Sports', 'Business', 'Sci/Tech'],
@@ -24,9 +24,7 @@ activations = model_with_split_points.get_activations(
     include_predicted_classes=True,
 )
 
-concept_explainer = NeuronsAsConcepts(
-    model_with_split_points,
-)
+concept_explainer = NeuronsAsConcepts(model_with_split_points)
 
 topk_inputs_method = TopKInputs(
     concept_explainer=concept_explainer,
@@ -45,16 +43,19 @@ topk_words = topk_inputs_method.interpret(
     concepts_indices="all",
 )
 
-gradients = concept_explainer.concept_output_gradient(
-    inputs=inputs,
-    targets=None,
-    activation_granularity=granularity,
-    concepts_x_gradients=True,
-    batch_size=64,
-)
-
-mean_gradients = torch.stack(gradients).abs().squeeze().mean(0)
-labels = {k: list(v.keys()) for k, v in topk_words.items()}
+# Mean absolute concept gradient per class, accumulated batch by batch.
+gradient_sum = 0
+for start in range(0, len(inputs), 64):
+    gradients = concept_explainer.concept_output_gradient(
+        inputs=inputs[start : start + 64],
+        targets=None,
+        activation_granularity=granularity,
+        concepts_x_gradients=True,
+        batch_size=64,
+    )
+    gradient_sum += torch.cat(gradients, dim=1).abs().sum(1)
+mean_gradients = gradient_sum / len(inputs)
+labels = {k: list(v.keys()) for k, v in topk_words.items() if v}
 
 plot_concepts(
     classes_names=['World', 'Sports', 'Business', 'Sci/Tech'],
@@ -15,7 +15,7 @@ model_with_split_points = ModelWithSplitPoints(
     batch_size=64,
 )
 
-inputs = load_dataset('stanfordnlp/imdb')['train'].shuffle(seed=SEED)["text"][:1000]
+inputs = load_dataset('stanfordnlp/imdb')['train'].shuffle(seed=0)["text"][:1000]
 
 granularity = ModelWithSplitPoints.activation_granularities.CLS_TOKEN
 activations = model_with_split_points.get_activations(
@@ -44,16 +44,19 @@ topk_words = topk_inputs_method.interpret(
     concepts_indices="all",
 )
 
-gradients = concept_explainer.concept_output_gradient(
-    inputs=inputs,
-    targets=None,
-    activation_granularity=granularity,
-    concepts_x_gradients=True,
-    batch_size=64,
-)
-
-mean_gradients = torch.stack(gradients).abs().squeeze().mean(0)
-labels = {k: list(v.keys()) for k, v in topk_words.items()}
+# Mean absolute concept gradient per class, accumulated batch by batch.
+gradient_sum = 0
+for start in range(0, len(inputs), 64):
+    gradients = concept_explainer.concept_output_gradient(
+        inputs=inputs[start : start + 64],
+        targets=None,
+        activation_granularity=granularity,
+        concepts_x_gradients=True,
+        batch_size=64,
+    )
+    gradient_sum += torch.cat(gradients, dim=1).abs().sum(1)
+mean_gradients = gradient_sum / len(inputs)
+labels = {k: list(v.keys()) for k, v in topk_words.items() if v}
 
 plot_concepts(
     classes_names=['negative', 'positive'],
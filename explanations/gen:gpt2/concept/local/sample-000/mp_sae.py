@@ -2,7 +2,7 @@ import torch
 from datasets import load_dataset
 from transformers import AutoModelForCausalLM
 from interpreto import ModelWithSplitPoints, plot_concepts
-from interpreto.concepts import MpSAEConcepts, NeuronsAsConcepts
+from interpreto.concepts import MpSAEConcepts
 from interpreto.concepts.interpretations import TopKInputs
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -15,7 +15,7 @@ mwsp = ModelWithSplitPoints(
     batch_size=8,
 )
 
-dataset = load_dataset(wikimedia/wikipedia, 20231101.en).shuffle(seed=0)
+dataset = load_dataset('wikimedia/wikipedia', '20231101.en').shuffle(seed=0)
 inputs = dataset["train"]["text"][:10000]
 
 TOKEN = ModelWithSplitPoints.activation_granularities.TOKEN
@@ -25,7 +25,12 @@ activations_dict = mwsp.get_activations(
 )
 activations = mwsp.get_split_activations(activations_dict)
 
-concept_explainer = MpSAEConcepts(mwsp, nb_concepts=5000, device=device)
+concept_explainer = MpSAEConcepts(
+    mwsp,
+    nb_concepts=5000,
+    device=device,
+)
+
 concept_explainer.fit(activations)
 
 WORD = ModelWithSplitPoints.activation_granularities.WORD
@@ -2,7 +2,7 @@ import torch
 from datasets import load_dataset
 from transformers import AutoModelForCausalLM
 from interpreto import ModelWithSplitPoints, plot_concepts
-from interpreto.concepts import NeuronsAsConcepts, NeuronsAsConcepts
+from interpreto.concepts import NeuronsAsConcepts
 from interpreto.concepts.interpretations import TopKInputs
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -15,7 +15,7 @@ mwsp = ModelWithSplitPoints(
     batch_size=8,
 )
 
-dataset = load_dataset(wikimedia/wikipedia, 20231101.en).shuffle(seed=0)
+dataset = load_dataset('wikimedia/wikipedia', '20231101.en').shuffle(seed=0)
 inputs = dataset["train"]["text"][:10000]
 
 TOKEN = ModelWithSplitPoints.activation_granularities.TOKEN
@@ -25,7 +25,9 @@ activations_dict = mwsp.get_activations(
 )
 activations = mwsp.get_split_activations(activations_dict)
 
-concept_explainer = NeuronsAsConcepts(mwsp)
+concept_explainer = NeuronsAsConcepts(
+    mwsp,
+)
 
 WORD = ModelWithSplitPoints.activation_granularities.WORD
 topk_inputs_method = TopKInputs(
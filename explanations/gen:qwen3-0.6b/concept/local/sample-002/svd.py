@@ -2,7 +2,7 @@ import torch
 from datasets import load_dataset
 from transformers import AutoModelForCausalLM
 from interpreto import ModelWithSplitPoints, plot_concepts
-from interpreto.concepts import SVDConcepts, NeuronsAsConcepts
+from interpreto.concepts import SVDConcepts
 from interpreto.concepts.interpretations import TopKInputs
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -27,7 +27,7 @@ activations = mwsp.get_split_activations(activations_dict)
 
 concept_explainer = SVDConcepts(
     mwsp,
-    nb_concepts=5000,
+    nb_concepts=1024,
     device=device,
 )
 
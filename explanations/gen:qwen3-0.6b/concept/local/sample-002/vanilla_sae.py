@@ -2,7 +2,7 @@ import torch
 from datasets import load_dataset
 from transformers import AutoModelForCausalLM
 from interpreto import ModelWithSplitPoints, plot_concepts
-from interpreto.concepts import VanillaSAEConcepts, NeuronsAsConcepts
+from interpreto.concepts import VanillaSAEConcepts
 from interpreto.concepts.interpretations import TopKInputs
 from interpreto.concepts.methods.overcomplete import DeadNeuronsReanimationLoss
 
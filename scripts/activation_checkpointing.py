@@ -0,0 +1,137 @@
+"""Activation checkpointing for gradient-based explainers on causal LMs.
+
+Only the input of each decoder layer is kept for the backward pass; the layer
+is run a second time during backward to rebuild its activations. Memory then
+grows with the sequence length times one layer instead of all layers, at the
+cost of roughly one extra forward pass.
+
+transformers' own `gradient_checkpointing_enable()` is only active in training
+mode, which would also turn on dropout, so the decoder layers are wrapped
+directly and the model stays in eval mode.
+"""
+
+import functools
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+from memory_usage import PeakRSSMonitor, format_bytes, release_free_memory
+
+
+def decoder_layers(model: torch.nn.Module) -> torch.nn.ModuleList:
+    """The list of transformer blocks (`model.layers`, `transformer.h`, ...)."""
+    n_layers = model.config.num_hidden_layers
+    for module in model.modules():
+        if isinstance(module, torch.nn.ModuleList) and len(module) == n_layers:
+            return module
+    raise ValueError(f"No list of {n_layers} decoder layers found in {type(model).__name__}.")
+
+
+def _checkpointed(forward: Callable) -> Callable:
+    @functools.wraps(forward)
+    def wrapper(*args, **kwargs):
+        # Forward-only explainers run under no_grad, and a KV cache would be
+        # updated a second time by the recomputation: run those normally.
+        cache = kwargs.get("past_key_values", kwargs.get("past_key_value"))
+        if not torch.is_grad_enabled() or cache is not None:
+            return forward(*args, **kwargs)
+        return checkpoint(forward, *args, use_reentrant=False, **kwargs)
+
+    return wrapper
+
+
+def enable_activation_checkpointing(model: torch.nn.Module) -> None:
+    if getattr(model, "_activation_checkpointing", None) is not None:
+        return
+    # An instance-level forward (e.g. accelerate's offloading hook) is wrapped
+    # as is and put back by disable_activation_checkpointing.
+    originals = [layer.__dict__.get("forward") for layer in decoder_layers(model)]
+    for layer in decoder_layers(model):
+        layer.forward = _checkpointed(layer.forward)
+    model._activation_checkpointing = (originals, model.config.use_cache)
+    # Without an explicit cache argument, the model would build one per forward.
+    model.config.use_cache = False
+
+
+def disable_activation_checkpointing(model: torch.nn.Module) -> None:
+    state = getattr(model, "_activation_checkpointing", None)
+    if state is None:
+        return
+    originals, use_cache = state
+    for layer, forward in zip(decoder_layers(model), originals, strict=True):
+        if forward is None:
+            del layer.forward
+        else:
+            layer.forward = forward
+    model.config.use_cache = use_cache
+    model._activation_checkpointing = None
+
+
+@contextmanager
+def activation_checkpointing(model: torch.nn.Module, enabled: bool = True):
+    if not enabled:
+        yield
+        return
+    enable_activation_checkpointing(model)
+    try:
+        yield
+    finally:
+        disable_activation_checkpointing(model)
+
+
+@dataclass
+class CheckpointingTradeoff:
+    method_name: str
+    seconds: float
+    checkpointed_seconds: float
+    memory: int
+    checkpointed_memory: int
+    max_abs_difference: float
+
+
+def _measure(run: Callable[[], list], seed: int) -> tuple[list, float, int]:
+    release_free_memory()
+    # Same noise and baselines in both runs for SmoothGrad and GradientShap.
+    torch.manual_seed(seed)
+    with PeakRSSMonitor() as monitor:
+        start = time.perf_counter()
+        outputs = run()
+        seconds = time.perf_counter() - start
+    return outputs, seconds, monitor.increase
+
+
+def checkpointing_tradeoff(
+    model: torch.nn.Module, method_name: str, run: Callable[[], list], seed: int = 0
+) -> CheckpointingTradeoff:
+    """Run `run()` (an explainer call) with and without checkpointing.
+
+    Memory is the peak RSS increase over the call. The checkpointed run goes
+    first, so that any memory still held after it can only understate the
+    saving, never inflate it.
+    """
+    with activation_checkpointing(model):
+        checkpointed, checkpointed_seconds, checkpointed_memory = _measure(run, seed)
+    outputs, seconds, memory = _measure(run, seed)
+
+    difference = max(
+        (a.attributions.float() - b.attributions.float()).nan_to_num().abs().max().item()
+        for a, b in zip(outputs, checkpointed, strict=True)
+    )
+    return CheckpointingTradeoff(
+        method_name, seconds, checkpointed_seconds, memory, checkpointed_memory, difference
+    )
+
+
+def print_checkpointing_report(tradeoffs: list[CheckpointingTradeoff]) -> None:
+    for tradeoff in tradeoffs:
+        print(
+            f"{tradeoff.method_name}: memory {format_bytes(tradeoff.memory)} -> "
+            f"{format_bytes(tradeoff.checkpointed_memory)}, time "
+            f"{tradeoff.seconds:.1f}s -> {tradeoff.checkpointed_seconds:.1f}s "
+            f"({tradeoff.checkpointed_seconds / tradeoff.seconds:.2f}x), "
+            f"max abs difference {tradeoff.max_abs_difference:.2e}"
+        )
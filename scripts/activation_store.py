@@ -0,0 +1,201 @@
+"""Disk-backed store of split-point activations for the concept pipelines.
+
+Each entry is a directory under activation_store/ named after a hash of what
+produced the activations (model, split points, granularity, dataset id,
+split, seed and count). Every tensor returned by `get_activations` is kept in
+one raw file that is appended chunk by chunk while the activations are
+computed, so only one chunk of inputs is ever held in RAM. meta.json records
+dtypes and shapes and is written last: an interrupted run leaves no valid
+entry and is simply recomputed.
+
+Later runs memory-map the files, so loading costs no model forward and no
+copy. Activations can be stored in float32, float16 or bfloat16: the half
+precision entries take half the disk and page cache, and are only upcast to
+float32 a chunk at a time, by the fits and encoders that read them (see
+`float32_chunks`). Asking for a float32 entry in half precision converts
+it, chunk by chunk, without recomputing it. The other way round, or between
+float16 and bfloat16, the entry is computed again: a converted entry would
+keep the rounding of its stored dtype under the name of the requested one.
+"""
+
+import hashlib
+import json
+import shutil
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+import torch
+
+
+ROOT = Path(__file__).resolve().parents[1]
+STORE_ROOT = ROOT / "activation_store"
+
+# Name recorded in meta.json for each stored dtype.
+STORAGE_DTYPES = {
+    torch.float32: "float32",
+    torch.float16: "float16",
+    torch.bfloat16: "bfloat16",
+    torch.int64: "int64",
+}
+FLOAT_DTYPES = (torch.float32, torch.float16, torch.bfloat16)
+# numpy has no bfloat16: its bits are written and memory-mapped as int16.
+_FILE_DTYPES = {"bfloat16": np.int16}
+
+CHUNK_ROWS = 8192
+
+
+def activation_key(**fields) -> str:
+    payload = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _entry_dir(fields: dict, root: Path) -> Path:
+    return Path(root) / activation_key(**fields)
+
+
+def _file_name(name: str) -> str:
+    # Split point names are module paths such as "bert.encoder.layer.11".
+    return name.replace("/", "_") + ".bin"
+
+
+def _float_dtype(activations: dict[str, torch.Tensor]) -> torch.dtype | None:
+    return next(
+        (tensor.dtype for tensor in activations.values() if tensor.is_floating_point()), None
+    )
+
+
+def read_activations(
+    fields: dict, root: Path = STORE_ROOT, dtype: torch.dtype | None = None
+) -> dict[str, torch.Tensor] | None:
+    """Memory-map a stored entry, or return None if there is none.
+
+    With `dtype`, a float32 entry is first rewritten in `dtype`, chunk by
+    chunk; an entry stored in half precision and asked for in another dtype
+    counts as missing.
+    """
+    entry = _entry_dir(fields, root)
+    meta_path = entry / "meta.json"
+    if not meta_path.exists():
+        return None
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    activations = {}
+    for name, info in meta["tensors"].items():
+        # Copy-on-write mapping: reads come straight from the page cache and
+        # in-place operations by a concept method never reach the file.
+        array = np.memmap(
+            entry / info["file"],
+            dtype=_FILE_DTYPES.get(info["dtype"], info["dtype"]),
+            mode="c",
+            shape=tuple(info["shape"]),
+        )
+        activations[name] = torch.from_numpy(array)
+        if info["dtype"] == "bfloat16":
+            activations[name] = activations[name].view(torch.bfloat16)
+
+    stored_dtype = _float_dtype(activations)
+    if dtype is None or stored_dtype in (None, dtype):
+        return activations
+    if stored_dtype != torch.float32:
+        print(f"{entry} is stored in {stored_dtype}, not {dtype}: it is computed again")
+        return None
+    print(f"Converting {entry} from {stored_dtype} to {dtype}")
+    n_rows = next(iter(activations.values())).shape[0]
+    chunks = (
+        {name: tensor[start : start + CHUNK_ROWS] for name, tensor in activations.items()}
+        for start in range(0, n_rows, CHUNK_ROWS)
+    )
+    write_activations(fields, chunks, dtype=dtype, root=root)
+    return read_activations(fields, root)
+
+
+def write_activations(
+    fields: dict,
+    chunks,
+    dtype: torch.dtype = torch.float32,
+    root: Path = STORE_ROOT,
+) -> None:
+    """Append each `{name: tensor}` chunk to the entry's files, then seal it.
+
+    Floating-point tensors are stored as `dtype` (float32, float16 or
+    bfloat16); integer tensors such as the predictions are stored as int64.
+    The entry is written next to its final place and only replaces an
+    existing one once complete.
+    """
+    if dtype not in FLOAT_DTYPES:
+        raise ValueError(
+            f"Activations can be stored as float32, float16 or bfloat16, not {dtype}."
+        )
+    final_entry = _entry_dir(fields, root)
+    entry = final_entry.with_name(final_entry.name + ".partial")
+    if entry.exists():
+        shutil.rmtree(entry)
+    entry.mkdir(parents=True)
+
+    tensors: dict[str, dict] = {}
+    for chunk in chunks:
+        for name, tensor in chunk.items():
+            tensor = tensor.detach().cpu()
+            tensor = tensor.to(dtype if tensor.is_floating_point() else torch.int64)
+            info = tensors.setdefault(
+                name,
+                {
+                    "file": _file_name(name),
+                    "dtype": STORAGE_DTYPES[tensor.dtype],
+                    "shape": [0, *tensor.shape[1:]],
+                },
+            )
+            if list(tensor.shape[1:]) != info["shape"][1:]:
+                raise ValueError(
+                    f"Chunk of {name!r} has shape {tuple(tensor.shape)}, "
+                    f"expected rows of shape {tuple(info['shape'][1:])}."
+                )
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.view(torch.int16)
+            with open(entry / info["file"], "ab") as file:
+                file.write(tensor.contiguous().numpy().tobytes())
+            info["shape"][0] += tensor.shape[0]
+
+    meta = {"fields": fields, "tensors": tensors}
+    (entry / "meta.json").write_text(
+        json.dumps(meta, indent=2, sort_keys=True, default=str), encoding="utf-8"
+    )
+    # Replacing an entry that is still memory-mapped is fine on POSIX: the
+    # mappings keep the old files alive until they are closed.
+    if final_entry.exists():
+        shutil.rmtree(final_entry)
+    entry.rename(final_entry)
+
+
+def load_or_compute_activations(
+    fields: dict,
+    inputs: list,
+    compute: Callable[[list], dict[str, torch.Tensor]],
+    chunk_size: int = 250,
+    dtype: torch.dtype = torch.float32,
+    root: Path = STORE_ROOT,
+) -> dict[str, torch.Tensor]:
+    """Return the stored activations for `fields`, computing them if needed.
+
+    `compute(chunk)` is called on successive slices of `chunk_size` inputs
+    and must return flattened `(rows, ...)` tensors, as `get_activations`
+    does. The entry is then re-read through memory maps, so the caller gets
+    the same tensors on the first and on later runs.
+    """
+    activations = read_activations(fields, root, dtype=dtype)
+    if activations is not None:
+        print(f"Loaded activations from {_entry_dir(fields, root)}")
+        return activations
+
+    chunks = (compute(inputs[i : i + chunk_size]) for i in range(0, len(inputs), chunk_size))
+    write_activations(fields, chunks, dtype=dtype, root=root)
+    print(f"Stored activations in {_entry_dir(fields, root)}")
+    return read_activations(fields, root)  # type: ignore
+
+
+def float32_chunks(activations: torch.Tensor, chunk_rows: int = CHUNK_ROWS):
+    """float32 copies of successive `chunk_rows` row slices of `activations`,
+    so that half-precision activations are never upcast in full."""
+    for start in range(0, activations.shape[0], chunk_rows):
+        yield activations[start : start + chunk_rows].float()
+
@@ -0,0 +1,284 @@
+"""Adaptive Gauss-Legendre quadrature for IntegratedGradients and GradientShap."""
+
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import torch
+
+from interpreto.attributions.aggregations.base import Aggregator
+from interpreto.attributions.perturbations.base import Perturbator
+from interpreto.attributions.perturbations.gradient_shap_perturbation import (
+    GradientShapPerturbator,
+)
+from interpreto.attributions.perturbations.linear_interpolation_perturbation import (
+    LinearInterpolationPerturbator,
+)
+
+
+# Path parameter convention: t = 0 is the baseline and t = 1 is the input.
+
+
+@dataclass
+class QuadratureReport:
+    steps: int
+    nodes: int
+    gap: float
+    converged: bool
+    # Bounds of the final intervals along the path and the error estimate of
+    # each (None for an interval that was never split).
+    intervals: list[tuple[float, float]]
+    errors: list[float | None]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class _Interval:
+    start: float
+    end: float
+    nodes: torch.Tensor
+    weights: torch.Tensor
+    integral: torch.Tensor
+    scores: torch.Tensor
+    error: float = float("inf")
+
+
+def gauss_legendre(
+    order: int, start: float = 0.0, end: float = 1.0
+) -> tuple[torch.Tensor, torch.Tensor]:
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+    half_width = (end - start) / 2
+    nodes = start + half_width * (nodes + 1)
+    weights = half_width * weights
+    return torch.from_numpy(nodes).float(), torch.from_numpy(weights).float()
+
+
+class WeightedSumAggregator(Aggregator):
+    def __init__(self, weights: torch.Tensor):
+        self.weights = weights
+
+    def aggregate(self, results: torch.Tensor, mask=None) -> torch.Tensor:
+        weights = self.weights.to(device=results.device, dtype=results.dtype)
+        return torch.einsum("p,ptl->tl", weights, results)
+
+
+def _path_values(
+    explainer,
+    embeddings: torch.Tensor,
+    baseline: torch.Tensor,
+    attention_mask: torch.Tensor,
+    target: torch.Tensor,
+    nodes: torch.Tensor,
+) -> torch.Tensor:
+    wrapper = explainer.inference_wrapper
+    values = []
+    with torch.no_grad():
+        for chunk in nodes.split(wrapper.batch_size):
+            t = chunk.to(embeddings).view(-1, 1, 1)
+            values.append(
+                wrapper.get_targeted_logits(
+                    {
+                        "inputs_embeds": baseline + t * (embeddings - baseline),
+                        "attention_mask": attention_mask.expand(len(chunk), -1),
+                    },
+                    target,
+                )
+            )
+    return torch.cat(values).float().cpu()
+
+
+def _node_gradients(
+    explainer,
+    embeddings: torch.Tensor,
+    baseline: torch.Tensor,
+    attention_mask: torch.Tensor,
+    target: torch.Tensor,
+    nodes: torch.Tensor,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Embedding gradients at the path nodes, reduced two ways:
+    - d/dt f(baseline + t * (x - baseline)), one column per target, which the
+      adaptive rule integrates;
+    - the explainer's per-token scores, as `InferenceWrapper.get_gradients`
+      computes them, which the final rule sums into the attributions.
+    """
+    wrapper = explainer.inference_wrapper
+    derivatives = []
+    scores = []
+    for chunk in nodes.split(wrapper.batch_size):
+        t = chunk.to(embeddings).view(-1, 1, 1)
+        inputs_embeds = (baseline + t * (embeddings - baseline)).detach().requires_grad_(True)
+        logits = wrapper.get_targeted_logits(
+            {
+                "inputs_embeds": inputs_embeds,
+                "attention_mask": attention_mask.expand(len(chunk), -1),
+            },
+            target,
+        )
+        n_targets = logits.shape[-1]
+        chunk_derivatives = []
+        chunk_scores = []
+        for k in range(n_targets):
+            gradients = torch.autograd.grad(
+                logits[:, k].sum(), inputs_embeds, retain_graph=k < n_targets - 1
+            )[0]
+            chunk_derivatives.append((gradients * (embeddings - baseline)).sum(dim=(1, 2)))
+            if explainer.input_x_gradient:
+                gradients = gradients * inputs_embeds
+            chunk_scores.append(gradients.abs().mean(dim=-1))
+        derivatives.append(torch.stack(chunk_derivatives, dim=1).detach())
+        scores.append(torch.stack(chunk_scores, dim=1).detach())
+    return torch.cat(derivatives).float().cpu(), torch.cat(scores).float().cpu()
+
+
+def adaptive_rule(
+    evaluate,
+    delta: torch.Tensor,
+    tolerance: float,
+    max_steps: int,
+    order: int,
+) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, QuadratureReport]:
+    """Split the path where the Gauss-Legendre estimate is least stable until
+    the integral closes the completeness gap f(x) - f(baseline).
+
+    `evaluate(nodes)` returns the path derivatives and the scores at `nodes`;
+    the scores at the nodes of the final rule are returned with it.
+    """
+
+    def estimate(start: float, end: float) -> _Interval:
+        nodes, weights = gauss_legendre(order, start, end)
+        derivatives, scores = evaluate(nodes)
+        integral = (weights[:, None] * derivatives).sum(dim=0)
+        return _Interval(start, end, nodes, weights, integral, scores)
+
+    leaves = [estimate(0.0, 1.0)]
+    steps = order
+    scale = max(delta.abs().max().item(), 1e-8)
+
+    while True:
+        total = torch.stack([leaf.integral for leaf in leaves]).sum(dim=0)
+        gap = (total - delta).abs().max().item() / scale
+        if gap <= tolerance or steps + 2 * order > max_steps:
+            break
+
+        worst = max(range(len(leaves)), key=lambda i: leaves[i].error)
+        interval = leaves.pop(worst)
+        middle = (interval.start + interval.end) / 2
+        left, right = estimate(interval.start, middle), estimate(middle, interval.end)
+        steps += 2 * order
+
+        error = (interval.integral - left.integral - right.integral).abs().max().item()
+        left.error = right.error = error / 2
+        leaves[worst:worst] = [left, right]
+
+    nodes = torch.cat([leaf.nodes for leaf in leaves])
+    weights = torch.cat([leaf.weights for leaf in leaves])
+    scores = torch.cat([leaf.scores for leaf in leaves])
+    report = QuadratureReport(
+        steps=steps,
+        nodes=len(nodes),
+        gap=gap,
+        converged=gap <= tolerance,
+        intervals=[(leaf.start, leaf.end) for leaf in leaves],
+        errors=[None if leaf.error == float("inf") else leaf.error for leaf in leaves],
+    )
+    return nodes, weights, scores, report
+
+
+def _split_targets(targets, n: int) -> list:
+    if targets is None:
+        return [None] * n
+    if isinstance(targets, str):
+        return [targets]
+    if isinstance(targets, torch.Tensor):
+        return [targets[i : i + 1] for i in range(n)]
+    return [[target] for target in targets]
+
+
+def explain_adaptive(
+    explainer,
+    model_inputs: list[str],
+    targets=None,
+    tolerance: float = 0.05,
+    max_steps: int = 256,
+    order: int = 4,
+) -> tuple[list, list[QuadratureReport]]:
+    """Explain each sample with its own adaptive quadrature rule.
+
+    Works for explainers built on a `LinearInterpolationPerturbator`
+    (IntegratedGradients and GradientShap). The gradients computed at the
+    nodes while choosing the rule are also those of the attributions: the
+    explainer only sums and formats them. Its perturbator, aggregator and
+    `get_scores` are swapped for each sample and restored afterwards.
+    """
+    perturbator = explainer.perturbator
+    aggregator = explainer.aggregator
+    # An instance attribute (e.g. set by a caller) is restored as is; otherwise
+    # the class method is used again.
+    own_get_scores = vars(explainer).get("get_scores")
+    if not isinstance(perturbator, LinearInterpolationPerturbator):
+        raise TypeError(
+            f"{explainer.__class__.__name__} does not integrate along a path, "
+            "adaptive quadrature only applies to IntegratedGradients and GradientShap."
+        )
+
+    sanitized_inputs = explainer.process_model_inputs(model_inputs)
+    inputs_to_explain, sanitized_targets = explainer.process_inputs_to_explain_and_targets(
+        sanitized_inputs, targets
+    )
+    raw_targets = _split_targets(targets, len(model_inputs))
+    embedder = explainer.inference_wrapper.model.get_input_embeddings()
+
+    attributions = []
+    reports = []
+    try:
+        for text, raw_target, inputs, target in zip(
+            model_inputs, raw_targets, inputs_to_explain, list(sanitized_targets), strict=True
+        ):
+            device = explainer.device
+            target = target.to(device)
+            attention_mask = inputs["attention_mask"].to(device)
+            with torch.no_grad():
+                embeddings = embedder(inputs["input_ids"].to(device))
+            baseline = perturbator.adjust_baseline(perturbator.baseline, embeddings)
+            baseline = baseline.to(device).unsqueeze(0)
+            if isinstance(perturbator, GradientShapPerturbator):
+                # One noisy baseline per sample keeps the path straight, so
+                # that the completeness gap is that of the integral along it.
+                baseline = baseline + torch.randn_like(baseline) * perturbator.std
+
+            path = (embeddings, baseline, attention_mask, target)
+            endpoints = _path_values(explainer, *path, torch.tensor([0.0, 1.0]))
+            _, weights, scores, report = adaptive_rule(
+                evaluate=lambda nodes: _node_gradients(explainer, *path, nodes),
+                delta=endpoints[1] - endpoints[0],
+                tolerance=tolerance,
+                max_steps=max_steps,
+                order=order,
+            )
+
+            # The explainer aggregates the node scores with the rule's weights
+            # and turns them into an AttributionOutput, without a forward pass.
+            explainer.perturbator = Perturbator()
+            explainer.aggregator = WeightedSumAggregator(weights)
+            explainer.get_scores = lambda model_inputs, targets, scores=scores: [scores]
+            attributions.extend(explainer(model_inputs=[text], targets=raw_target))
+            reports.append(report)
+    finally:
+        explainer.perturbator = perturbator
+        explainer.aggregator = aggregator
+        if own_get_scores is None:
+            vars(explainer).pop("get_scores", None)
+        else:
+            explainer.get_scores = own_get_scores
+
+    return attributions, reports
+
+
+def print_quadrature_report(method_name: str, reports: list[QuadratureReport]) -> None:
+    for i, report in enumerate(reports):
+        status = "converged" if report.converged else "budget exhausted"
+        print(
+            f"{method_name} sample-{i:03d}: {report.steps} steps, "
+            f"{report.nodes} nodes, gap={report.gap:.4f} ({status})"
+        )
@@ -0,0 +1,152 @@
+"""Anytime mode for sampling-based explainers (KernelShap, Lime, Sobol)."""
+
+import time
+from dataclasses import asdict, dataclass, replace
+
+import torch
+
+
+@dataclass
+class StabilityReport:
+    rounds: int
+    topk_overlap: float
+    rank_correlation: float
+    stable: bool
+    seconds: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _ranks(scores: torch.Tensor) -> torch.Tensor:
+    """Ranks along the last dimension, tied scores sharing their mean rank."""
+    below = (scores.unsqueeze(-2) < scores.unsqueeze(-1)).sum(dim=-1)
+    tied = (scores.unsqueeze(-2) == scores.unsqueeze(-1)).sum(dim=-1)
+    return below + (tied - 1) / 2
+
+
+def ranking_stability(
+    previous: torch.Tensor, current: torch.Tensor, topk: int
+) -> tuple[float, float]:
+    """Top-k overlap and Spearman correlation of the importance rankings,
+    taking the worst row when there are several targets.
+
+    A row that is constant in both rankings (e.g. all zeros) has no ranking
+    to change and counts as stable; the correlation is undefined for it.
+    """
+    length = current.shape[-1]
+    # Generation outputs hold NaN for tokens after the target position; rank
+    # them below every real score.
+    previous = previous.reshape(-1, length).abs().nan_to_num(nan=-1.0)
+    current = current.reshape(-1, length).abs().nan_to_num(nan=-1.0)
+    if length < 2:
+        return 1.0, 1.0
+
+    prev_ranks = _ranks(previous)
+    cur_ranks = _ranks(current)
+    prev_ranks = prev_ranks - prev_ranks.mean(dim=-1, keepdim=True)
+    cur_ranks = cur_ranks - cur_ranks.mean(dim=-1, keepdim=True)
+    prev_norm = prev_ranks.norm(dim=-1)
+    cur_norm = cur_ranks.norm(dim=-1)
+    constant = (prev_norm == 0) & (cur_norm == 0)
+    # Against a constant row the covariance is 0, and so is the correlation.
+    correlation = (prev_ranks * cur_ranks).sum(dim=-1) / (prev_norm * cur_norm).clamp_min(1e-12)
+    correlation = torch.where(constant, torch.ones_like(correlation), correlation)
+
+    k = min(topk, length)
+    overlaps = []
+    for prev_row, cur_row, is_constant in zip(previous, current, constant):
+        if is_constant:
+            overlaps.append(1.0)
+            continue
+        prev_top = set(prev_row.topk(k).indices.tolist())
+        cur_top = set(cur_row.topk(k).indices.tolist())
+        overlaps.append(len(prev_top & cur_top) / k)
+    return min(overlaps), correlation.min().item()
+
+
+def _select_targets(targets, indices: list[int]):
+    if targets is None:
+        return None
+    if isinstance(targets, str):
+        return targets
+    if isinstance(targets, torch.Tensor):
+        return targets[indices]
+    return [targets[i] for i in indices]
+
+
+def explain_anytime(
+    explainer,
+    model_inputs: list[str],
+    targets=None,
+    topk: int = 5,
+    min_overlap: float = 0.8,
+    min_correlation: float = 0.9,
+    patience: int = 2,
+    max_rounds: int = 20,
+    time_budget: float | None = None,
+) -> tuple[list, list[StabilityReport]]:
+    """Average independent rounds of the explainer until the ranking settles.
+
+    Each round calls the explainer with its own perturbation budget and folds
+    the result into a running mean. A sample stops once its ranking has met
+    both thresholds for `patience` consecutive rounds; all samples stop when
+    `max_rounds` or `time_budget` (seconds) is reached.
+    """
+    n = len(model_inputs)
+    sums: list[torch.Tensor | None] = [None] * n
+    outputs: list = [None] * n
+    rounds = [0] * n
+    streaks = [0] * n
+    stability = [(0.0, 0.0)] * n
+    seconds = [0.0] * n
+
+    active = list(range(n))
+    start = time.perf_counter()
+    for _ in range(max_rounds):
+        round_outputs = explainer(
+            model_inputs=[model_inputs[i] for i in active],
+            targets=_select_targets(targets, active),
+        )
+        for i, output in zip(active, round_outputs, strict=True):
+            scores = output.attributions.float()
+            previous = None if sums[i] is None else sums[i] / rounds[i]
+            sums[i] = scores if sums[i] is None else sums[i] + scores
+            rounds[i] += 1
+            mean = sums[i] / rounds[i]
+
+            if previous is not None:
+                stability[i] = ranking_stability(previous, mean, topk)
+                overlap, correlation = stability[i]
+                settled = overlap >= min_overlap and correlation >= min_correlation
+                streaks[i] = streaks[i] + 1 if settled else 0
+            outputs[i] = replace(output, attributions=mean)
+            seconds[i] = time.perf_counter() - start
+
+        active = [i for i in active if streaks[i] < patience]
+        if not active:
+            break
+        if time_budget is not None and time.perf_counter() - start >= time_budget:
+            break
+
+    reports = [
+        StabilityReport(
+            rounds=rounds[i],
+            topk_overlap=stability[i][0],
+            rank_correlation=stability[i][1],
+            stable=streaks[i] >= patience,
+            seconds=seconds[i],
+        )
+        for i in range(n)
+    ]
+    return outputs, reports
+
+
+def print_stability_report(method_name: str, reports: list[StabilityReport]) -> None:
+    for i, report in enumerate(reports):
+        status = "stable" if report.stable else "budget exhausted"
+        print(
+            f"{method_name} sample-{i:03d}: {report.rounds} rounds in "
+            f"{report.seconds:.1f}s, top-k overlap={report.topk_overlap:.2f}, "
+            f"rank correlation={report.rank_correlation:.3f} ({status})"
+        )
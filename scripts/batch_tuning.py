@@ -0,0 +1,186 @@
+"""Pick explainer batch sizes from measured throughput and peak memory.
+
+The probes explain one short input (see `shortest_input`) and stop at a time
+limit and a peak RSS ceiling. Results are cached per (model, method, host) in
+batch_sizes.json at the repository root, so the probe only runs once per
+machine.
+"""
+
+import gc
+import json
+import os
+import platform
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import torch
+
+from memory_usage import (
+    PeakRSSMonitor,
+    available_memory,
+    current_rss,
+    format_bytes,
+    total_memory,
+)
+
+
+ROOT = Path(__file__).resolve().parents[1]
+CACHE_PATH = ROOT / "batch_sizes.json"
+
+# Fraction of the memory available at startup that a probe may use.
+MEMORY_FRACTION = 0.8
+# Seconds the probes of one method may take, warm-up included; the sizes
+# measured by then are compared.
+PROBE_TIME_LIMIT = 60.0
+
+
+@dataclass
+class BatchProbe:
+    batch_size: int
+    seconds: float
+    peak_rss: int
+    within_limit: bool
+
+
+def host_key() -> str:
+    memory = total_memory()
+    memory_gib = f"{memory / 2**30:.0f}gib" if memory else "unknown"
+    return (
+        f"{platform.node()}-{platform.machine()}-{os.cpu_count()}cpu-"
+        f"{torch.get_num_threads()}threads-{memory_gib}"
+    )
+
+
+def _cache_key(model_id: str, method_name: str) -> str:
+    return f"{model_id}|{method_name}|{host_key()}"
+
+
+def _read_cache() -> dict:
+    if not CACHE_PATH.exists():
+        return {}
+    return json.loads(CACHE_PATH.read_text(encoding="utf-8"))
+
+
+def cached_batch_size(model_id: str, method_name: str) -> int | None:
+    entry = _read_cache().get(_cache_key(model_id, method_name))
+    return None if entry is None else entry["batch_size"]
+
+
+def store_batch_size(
+    model_id: str, method_name: str, batch_size: int, probes: list[BatchProbe]
+) -> None:
+    cache = _read_cache()
+    cache[_cache_key(model_id, method_name)] = {
+        "batch_size": batch_size,
+        "probes": [asdict(probe) for probe in probes],
+    }
+    CACHE_PATH.write_text(json.dumps(cache, indent=2, sort_keys=True), encoding="utf-8")
+
+
+def shortest_input(texts: list[str]) -> int:
+    """Index of the shortest text, the fixed input the probes explain."""
+    return min(range(len(texts)), key=lambda i: len(texts[i]))
+
+
+def default_memory_ceiling() -> int | None:
+    """Peak RSS allowed during a probe: current usage plus a share of what is free."""
+    available = available_memory()
+    if available is None:
+        return None
+    return current_rss() + int(MEMORY_FRACTION * available)
+
+
+def probe_batch_sizes(
+    run: Callable[[int], object],
+    max_batch_size: int = 256,
+    memory_ceiling: int | None = None,
+    time_limit: float | None = PROBE_TIME_LIMIT,
+) -> list[BatchProbe]:
+    """Time `run(batch_size)` at doubling batch sizes.
+
+    `run` must process the same workload whatever the batch size, so that the
+    measured times are comparable. Probing stops at the first size that goes
+    over `memory_ceiling`, runs out of memory, or is slower than the previous
+    size, and once `time_limit` seconds have been spent.
+    """
+    if memory_ceiling is None:
+        memory_ceiling = default_memory_ceiling()
+    start_time = time.perf_counter()
+
+    # Warm-up so that one-time costs (lazy imports, allocator growth) are not
+    # charged to the smallest batch size.
+    run(1)
+
+    probes: list[BatchProbe] = []
+    batch_size = 1
+    while batch_size <= max_batch_size:
+        gc.collect()
+        try:
+            with PeakRSSMonitor() as monitor:
+                start = time.perf_counter()
+                run(batch_size)
+                seconds = time.perf_counter() - start
+        except (MemoryError, RuntimeError) as error:
+            # The CPU allocator reports exhaustion as a RuntimeError.
+            if isinstance(error, RuntimeError) and "memory" not in str(error):
+                raise
+            break
+
+        within_limit = memory_ceiling is None or monitor.peak <= memory_ceiling
+        probes.append(BatchProbe(batch_size, seconds, monitor.peak, within_limit))
+        if not within_limit:
+            break
+        if len(probes) > 1 and seconds > probes[-2].seconds:
+            break
+        if time_limit is not None and time.perf_counter() - start_time > time_limit:
+            print(f"Batch size probe stopped after {time_limit:g}s at batch_size={batch_size}")
+            break
+        batch_size *= 2
+    return probes
+
+
+def select_batch_size(probes: list[BatchProbe], default: int) -> int:
+    safe = [probe for probe in probes if probe.within_limit]
+    if not safe:
+        return default
+    return min(safe, key=lambda probe: probe.seconds).batch_size
+
+
+def print_probes(model_id: str, method_name: str, probes: list[BatchProbe]) -> None:
+    for probe in probes:
+        status = "" if probe.within_limit else " (over memory ceiling)"
+        print(
+            f"{model_id} {method_name} batch_size={probe.batch_size}: "
+            f"{probe.seconds:.2f}s, peak RSS {format_bytes(probe.peak_rss)}{status}"
+        )
+
+
+def resolve_batch_size(
+    model_id: str,
+    method_name: str,
+    run: Callable[[int], object],
+    default: int,
+    tune: bool = True,
+    max_batch_size: int = 256,
+    memory_ceiling: int | None = None,
+    time_limit: float | None = PROBE_TIME_LIMIT,
+) -> int:
+    """Return the cached batch size, probing and caching it first if needed.
+
+    With `tune=False` the cache is still consulted but `default` is used when
+    there is no entry for this host.
+    """
+    batch_size = cached_batch_size(model_id, method_name)
+    if batch_size is not None:
+        return batch_size
+    if not tune:
+        return default
+
+    probes = probe_batch_sizes(run, max_batch_size, memory_ceiling, time_limit)
+    print_probes(model_id, method_name, probes)
+    batch_size = select_batch_size(probes, default)
+    store_batch_size(model_id, method_name, batch_size, probes)
+    print(f"{model_id} {method_name}: using batch_size={batch_size}")
+    return batch_size
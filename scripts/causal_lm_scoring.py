@@ -0,0 +1,426 @@
+"""Padded multi-sample batching for causal-LM attribution scores.
+
+Interpreto scores the perturbations of each generation sample separately, and
+when it does mix samples it left-pads without position ids, which shifts the
+positions of the shorter sequences. The scorer below packs perturbations from
+consecutive samples into the same forward pass, left-pads them, and gives
+every row the position ids it would have had on its own.
+"""
+
+import copy
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from functools import partial
+
+import numpy as np
+import torch
+from transformers import Cache
+
+from interpreto.model_wrapping.generation_inference_wrapper import (
+    GenerationInferenceWrapper,
+)
+
+
+@dataclass
+class _Row:
+    sample: int
+    index: int
+    inputs_key: str
+    values: torch.Tensor  # (l,) token ids or (l, d) embeddings
+    mask: torch.Tensor  # (l,)
+    target: torch.Tensor  # (t,)
+    prefix: int = 0  # tokens shared with the sample's reference sequence
+
+
+class PaddedCausalLMScorer:
+    def __init__(self, inference_wrapper: GenerationInferenceWrapper):
+        if not isinstance(inference_wrapper, GenerationInferenceWrapper):
+            raise TypeError(
+                "Padded batching only applies to generation explainers, got "
+                f"{inference_wrapper.__class__.__name__}."
+            )
+        self.wrapper = inference_wrapper
+        self._inverse: dict[int, torch.Tensor] = {}
+
+    @property
+    def batch_size(self) -> int:
+        return self.wrapper.batch_size
+
+    def _split_rows(self, sample: int, model_inputs, target: torch.Tensor) -> list[_Row]:
+        inputs_key = "inputs_embeds" if "inputs_embeds" in model_inputs else "input_ids"
+        non_batch_dims = 2 if inputs_key == "inputs_embeds" else 1
+        values = model_inputs[inputs_key]
+        values = values.reshape(-1, *values.shape[-non_batch_dims:])
+        mask = model_inputs["attention_mask"].reshape(-1, values.shape[1])
+        targets = target.reshape(-1, target.shape[-1]).expand(len(values), -1)
+
+        if inputs_key == "input_ids":
+            # Sampled masks often repeat (KernelShap, Sobol), and a repeated
+            # token sequence has the same score: only score each one once.
+            keys = torch.cat([values, mask, targets.to(values)], dim=1)
+            _, inverse = torch.unique(keys, dim=0, return_inverse=True)
+            first = torch.full((int(inverse.max()) + 1,), len(values)).scatter_reduce(
+                0, inverse, torch.arange(len(values)), reduce="amin"
+            )
+            self._inverse[sample] = inverse
+            values, mask, targets = values[first], mask[first], targets[first]
+
+        return [
+            _Row(sample, index, inputs_key, row_values, row_mask, row_target)
+            for index, (row_values, row_mask, row_target) in enumerate(
+                zip(values, mask, targets, strict=True)
+            )
+        ]
+
+    def _release(self, sample: int) -> None:
+        """Called once every row of `sample` has been scored."""
+
+    def _forward(self, sequences: list[torch.Tensor], masks: list[torch.Tensor]):
+        """Left-pad `sequences` into one batch and return the logits."""
+        device = self.wrapper.device
+        length = max(len(sequence) for sequence in sequences)
+        batch, batch_mask, positions = [], [], []
+        for sequence, mask in zip(sequences, masks, strict=True):
+            pad = length - len(sequence)
+            # Padding is masked out, so any valid token id or a zero embedding works.
+            padding = sequence.new_zeros((pad, *sequence.shape[1:]))
+            batch.append(torch.cat([padding, sequence]))
+            batch_mask.append(torch.cat([mask.new_zeros(pad), mask]))
+            # Same positions as the unpadded sequence, starting at 0 after the padding.
+            positions.append((torch.arange(length) - pad).clamp(min=0))
+
+        batch = torch.stack(batch).to(device)
+        inputs_key = "inputs_embeds" if batch.dim() == 3 else "input_ids"
+        if inputs_key == "inputs_embeds":
+            batch = batch.to(dtype=self.wrapper.dtype)
+        return self.wrapper.model(
+            **{inputs_key: batch},
+            attention_mask=torch.stack(batch_mask).to(device),
+            position_ids=torch.stack(positions).to(device),
+        ).logits
+
+    def _select(self, logits: torch.Tensor, rows: list[_Row]) -> list[torch.Tensor]:
+        selected = []
+        for row_logits, row in zip(logits, rows, strict=True):
+            target = row.target.to(row_logits.device)
+            target_logits = self.wrapper.mode(row_logits[-len(target) :])
+            selected.append(target_logits.gather(-1, target.unsqueeze(-1)).squeeze(-1))
+        return selected
+
+    def _row_logits(self, rows: list[_Row]) -> list[torch.Tensor]:
+        # The last token is only a target, it is never fed to the model.
+        with torch.no_grad():
+            logits = self._forward(
+                [row.values[:-1] for row in rows], [row.mask[:-1] for row in rows]
+            )
+            return self._select(logits, rows)
+
+    def _row_gradients(
+        self, rows: list[_Row], input_x_gradient: bool
+    ) -> list[torch.Tensor]:
+        embedder = self.wrapper.model.get_input_embeddings()
+        leaves = []
+        for row in rows:
+            values = row.values.to(self.wrapper.device)
+            if row.inputs_key == "input_ids":
+                with torch.no_grad():
+                    values = embedder(values)
+            leaves.append(values.detach().requires_grad_(True))
+
+        logits = self._forward(
+            [leaf[:-1] for leaf in leaves], [row.mask[:-1] for row in rows]
+        )
+        selected = self._select(logits, rows)
+        n_targets = max(len(row_selected) for row_selected in selected)
+        selected = torch.stack(
+            [
+                torch.nn.functional.pad(row_selected, (0, n_targets - len(row_selected)))
+                for row_selected in selected
+            ]
+        )  # (b, t)
+
+        # One backward pass per target position, as in the unbatched wrapper.
+        gradients: list[list[torch.Tensor]] = [[] for _ in rows]
+        for k in range(n_targets):
+            grad_outputs = torch.zeros_like(selected)
+            grad_outputs[:, k] = 1.0
+            target_wise_grads = torch.autograd.grad(
+                outputs=selected,
+                inputs=leaves,
+                grad_outputs=grad_outputs,
+                retain_graph=k != n_targets - 1,
+            )
+            for i, (row, leaf, grad) in enumerate(
+                zip(rows, leaves, target_wise_grads, strict=True)
+            ):
+                if k >= len(row.target):
+                    continue
+                if input_x_gradient:
+                    grad = grad * leaf
+                gradients[i].append(grad.abs().mean(dim=-1).detach().cpu())
+        return [torch.stack(row_gradients) for row_gradients in gradients]  # (t, l)
+
+    def _stream(
+        self,
+        model_inputs: Iterable,
+        targets: Iterable[torch.Tensor],
+        score_rows: Callable[[list[_Row]], list[torch.Tensor]],
+    ) -> Iterator[torch.Tensor]:
+        """Score rows `batch_size` at a time across samples and yield one
+        stacked tensor per sample, in input order."""
+        samples = iter(zip(model_inputs, targets, strict=True))
+        pending: deque[_Row] = deque()
+        results: dict[int, list[torch.Tensor | None]] = {}
+        remaining: dict[int, int] = {}
+        n_samples = next_sample = 0
+        exhausted = False
+
+        while True:
+            while not exhausted and len(pending) < self.batch_size:
+                try:
+                    mapping, target = next(samples)
+                except StopIteration:
+                    exhausted = True
+                    break
+                rows = self._split_rows(n_samples, mapping, target)
+                results[n_samples] = [None] * len(rows)
+                remaining[n_samples] = len(rows)
+                pending.extend(rows)
+                n_samples += 1
+
+            if pending:
+                batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+                for row, score in zip(batch, score_rows(batch), strict=True):
+                    results[row.sample][row.index] = score
+                    remaining[row.sample] -= 1
+
+            while remaining.get(next_sample) == 0:
+                self._release(next_sample)
+                del remaining[next_sample]
+                scores = torch.stack(results.pop(next_sample))
+                inverse = self._inverse.pop(next_sample, None)
+                yield scores if inverse is None else scores[inverse.to(scores.device)]
+                next_sample += 1
+
+            if exhausted and not pending:
+                return
+
+    def get_scores(
+        self,
+        model_inputs: Iterable,
+        targets: Iterable[torch.Tensor],
+        use_gradient: bool,
+        input_x_gradient: bool,
+    ) -> Iterator[torch.Tensor]:
+        if use_gradient:
+            score_rows = partial(self._row_gradients, input_x_gradient=input_x_gradient)
+        else:
+            score_rows = self._row_logits
+        return self._stream(model_inputs, targets, score_rows)
+
+
+@dataclass
+class _Reference:
+    input_ids: torch.Tensor  # (l,)
+    logits: torch.Tensor | None = None  # (1, l, v)
+    cache: Cache | None = None
+
+
+class PrefixSharingScorer(PaddedCausalLMScorer):
+    """Reuse the unperturbed prompt's KV cache for token-masking methods.
+
+    Perturbations of a sample only differ from the original sequence from
+    their first masked token on. Rows are sorted by that position so that a
+    batch holds rows with similar shared prefixes. The reference sequence is
+    run once per sample with the cache enabled. Each batch then branches a
+    copy of the cache cropped to the shortest prefix in the batch and only
+    runs the suffixes.
+    """
+
+    def __init__(
+        self,
+        inference_wrapper: GenerationInferenceWrapper,
+        replace_token_id: int | None = None,
+        min_prefix: int = 1,
+    ):
+        super().__init__(inference_wrapper)
+        self.replace_token_id = replace_token_id
+        self.min_prefix = min_prefix
+        self._references: dict[int, _Reference] = {}
+
+    def _reference_sequence(self, sequences: torch.Tensor) -> torch.Tensor:
+        if self.replace_token_id is None:
+            return sequences.mode(dim=0).values
+        # Masking methods only ever write the replacement token, so any other
+        # value in a column is the original token.
+        kept = sequences.masked_fill(sequences == self.replace_token_id, -1)
+        reference = kept.max(dim=0).values
+        return torch.where(reference < 0, self.replace_token_id, reference)
+
+    def _split_rows(self, sample: int, model_inputs, target: torch.Tensor) -> list[_Row]:
+        rows = super()._split_rows(sample, model_inputs, target)
+        if rows[0].inputs_key != "input_ids":
+            return rows
+        sequences = torch.stack([row.values[:-1] for row in rows])
+        if not bool(torch.stack([row.mask[:-1] for row in rows]).all()):
+            return rows
+
+        reference = self._reference_sequence(sequences)
+        differs = sequences != reference
+        prefixes = torch.where(
+            differs.any(dim=1), differs.int().argmax(dim=1), sequences.shape[1]
+        )
+        for row, prefix in zip(rows, prefixes.tolist(), strict=True):
+            row.prefix = prefix
+        self._references[sample] = _Reference(reference)
+        return sorted(rows, key=lambda row: row.prefix)
+
+    def _release(self, sample: int) -> None:
+        self._references.pop(sample, None)
+
+    def _reference_forward(self, sample: int) -> _Reference:
+        reference = self._references[sample]
+        if reference.cache is None:
+            output = self.wrapper.model(
+                input_ids=reference.input_ids.to(self.wrapper.device).unsqueeze(0),
+                use_cache=True,
+            )
+            reference.logits, reference.cache = output.logits, output.past_key_values
+        return reference
+
+    def _shared_prefix_logits(self, sample: int, rows: list[_Row]) -> list[torch.Tensor]:
+        device = self.wrapper.device
+        reference = self._reference_forward(sample)
+        prefix = min(row.prefix for row in rows)
+        sequences = torch.stack([row.values[:-1] for row in rows]).to(device)
+        n, length = sequences.shape
+
+        if prefix == length:
+            logits = reference.logits.expand(n, -1, -1)
+        else:
+            cache = copy.deepcopy(reference.cache)
+            cache.crop(prefix - length)
+            cache.batch_repeat_interleave(n)
+            suffix_logits = self.wrapper.model(
+                input_ids=sequences[:, prefix:],
+                attention_mask=torch.ones_like(sequences),
+                position_ids=torch.arange(prefix, length, device=device).expand(n, -1),
+                past_key_values=cache,
+                use_cache=True,
+            ).logits
+            logits = torch.cat(
+                [reference.logits[:, :prefix].expand(n, -1, -1), suffix_logits], dim=1
+            )
+        return self._select(logits, rows)
+
+    def _row_logits(self, rows: list[_Row]) -> list[torch.Tensor]:
+        shared: dict[int, list[int]] = defaultdict(list)
+        plain: list[int] = []
+        for position, row in enumerate(rows):
+            if row.sample in self._references and row.prefix >= self.min_prefix:
+                shared[row.sample].append(position)
+            else:
+                plain.append(position)
+
+        scores: list[torch.Tensor | None] = [None] * len(rows)
+        if plain:
+            plain_scores = super()._row_logits([rows[position] for position in plain])
+            for position, score in zip(plain, plain_scores, strict=True):
+                scores[position] = score
+        with torch.no_grad():
+            for sample, positions in shared.items():
+                group = [rows[position] for position in positions]
+                for position, score in zip(
+                    positions, self._shared_prefix_logits(sample, group), strict=True
+                ):
+                    scores[position] = score
+        return scores
+
+
+def enable_padded_batching(explainer, prefix_sharing: bool = False):
+    """Route the explainer's scoring through `PaddedCausalLMScorer`, or through
+    `PrefixSharingScorer` for the token-masking methods if `prefix_sharing`.
+
+    Interpreto has no hook for the scoring step, so this sets a `get_scores`
+    attribute on this explainer instance, which shadows the class method.
+    Other explainers are untouched, and `disable_padded_batching` removes it.
+    """
+    if prefix_sharing:
+        scorer = PrefixSharingScorer(
+            explainer.inference_wrapper,
+            replace_token_id=getattr(explainer.perturbator, "replace_token_id", None),
+        )
+    else:
+        scorer = PaddedCausalLMScorer(explainer.inference_wrapper)
+    explainer.get_scores = lambda model_inputs, targets: scorer.get_scores(
+        model_inputs, targets, explainer.use_gradient, explainer.input_x_gradient
+    )
+    return explainer
+
+
+def disable_padded_batching(explainer):
+    """Restore interpreto's own scoring on an explainer patched by
+    `enable_padded_batching`."""
+    vars(explainer).pop("get_scores", None)
+    return explainer
+
+
+def _seeded_attributions(build_explainer, inputs, targets, seed: int) -> list[torch.Tensor]:
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    explainer = build_explainer()
+    return [output.attributions for output in explainer(model_inputs=inputs, targets=targets)]
+
+
+def _max_difference(reference: list[torch.Tensor], other: list[torch.Tensor]) -> float:
+    difference = 0.0
+    for ref, oth in zip(reference, other, strict=True):
+        if ref.shape != oth.shape or not torch.equal(ref.isnan(), oth.isnan()):
+            return float("inf")
+        difference = max(difference, (ref - oth).abs().nan_to_num().max().item())
+    return difference
+
+
+def verify_padded_batching(
+    model,
+    tokenizer,
+    explainers: dict[str, tuple[type, dict]],
+    inputs: list[str],
+    targets: list[str],
+    batch_size: int,
+    prefix_sharing: bool = False,
+    atol: float = 1e-4,
+    seed: int = 0,
+) -> bool:
+    """Check that padded multi-sample batching reproduces the unbatched path.
+
+    Every explainer runs once with `batch_size=1` and interpreto's own scoring,
+    and once with padded batching across samples (and prefix sharing if
+    requested), under the same seed.
+    Explainers whose unbatched runs are not reproducible are reported and
+    skipped.
+    """
+    ok = True
+    for name, (explainer_cls, parameters) in explainers.items():
+
+        def unbatched():
+            return explainer_cls(model, tokenizer, batch_size=1, **parameters)
+
+        def batched():
+            return enable_padded_batching(
+                explainer_cls(model, tokenizer, batch_size=batch_size, **parameters),
+                prefix_sharing=prefix_sharing,
+            )
+
+        reference = _seeded_attributions(unbatched, inputs, targets, seed)
+        if _max_difference(reference, _seeded_attributions(unbatched, inputs, targets, seed)) > 0:
+            print(f"{name}: skipped, unbatched attributions are not reproducible")
+            continue
+        difference = _max_difference(
+            reference, _seeded_attributions(batched, inputs, targets, seed)
+        )
+        matches = difference <= atol
+        ok &= matches
+        print(f"{name}: max abs difference {difference:.2e} ({'ok' if matches else 'MISMATCH'})")
+    return ok
@@ -0,0 +1,155 @@
+"""Fit one concept explainer per predicted class, in parallel.
+
+The activations are sorted by predicted class once, into a matrix allocated
+in shared memory, so every class is a contiguous slice of it: no per-class
+`v[indices]` copy is made, and worker processes map the same pages instead
+of receiving a pickled copy of their rows. The pool (see fit_scheduler.py)
+is started once and reused by every concept method; each worker fits an
+explainer on the slice of its class.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import torch
+
+from fit_scheduler import (
+    seeded_fit,
+    fit_explainer,
+    shared_activations_pool,
+    without_model,
+    worker_activations,
+)
+
+
+@dataclass
+class ClassPartition:
+    # Rows sorted by predicted class, in shared memory.
+    activations: torch.Tensor
+    # Original row index of each sorted row.
+    order: torch.Tensor
+    slices: list[slice]
+
+    def rows(self, target: int) -> torch.Tensor:
+        return self.activations[self.slices[target]]
+
+    def indices(self, target: int) -> list[int]:
+        return self.order[self.slices[target]].tolist()
+
+    def size(self, target: int) -> int:
+        return self.slices[target].stop - self.slices[target].start
+
+
+def partition_by_class(
+    activations: torch.Tensor, predictions: torch.Tensor, n_classes: int
+) -> ClassPartition:
+    predictions = torch.as_tensor(predictions).flatten()
+    order = torch.argsort(predictions, stable=True)
+    counts = torch.bincount(predictions, minlength=n_classes).tolist()
+    activations = torch.as_tensor(activations)
+    # The one copy of the activations: gathered straight into shared memory.
+    sorted_rows = torch.empty(activations.shape, dtype=activations.dtype).share_memory_()
+    torch.index_select(activations, 0, order, out=sorted_rows)
+
+    slices, start = [], 0
+    for count in counts:
+        slices.append(slice(start, start + count))
+        start += count
+    return ClassPartition(sorted_rows, order, slices)
+
+
+def _fit_rows_in_worker(explainer, rows: slice, fit_kwargs: dict, seed: int):
+    return seeded_fit(explainer, fit_explainer, worker_activations()[rows], fit_kwargs, seed)
+
+
+@contextmanager
+def class_fit_pool(partition: ClassPartition, workers: int):
+    """Worker processes sharing `partition.activations`, or None if
+    `workers <= 1` (serial fits)."""
+    with shared_activations_pool(partition.activations, workers) as pool:
+        yield pool
+
+
+def fit_class_explainers(
+    explainers: dict[int, object],
+    partition: ClassPartition,
+    fit_kwargs: dict,
+    seed: int,
+    pool: ProcessPoolExecutor | None = None,
+) -> tuple[dict[int, object], float]:
+    """Fit `explainers[target]` on the rows of each class.
+
+    Returns the fitted explainers and the wall-clock time of the fits.
+    Explainers that need no fitting (e.g. NeuronsAsConcepts) are returned as
+    is. Without a `pool` (see `class_fit_pool`), the fits run serially in
+    this process.
+    """
+    to_fit = {target: e for target, e in explainers.items() if not e.is_fitted}
+    fitted = dict(explainers)
+    start = time.perf_counter()
+    if pool is None:
+        for target, explainer in to_fit.items():
+            fitted[target], _ = seeded_fit(
+                explainer, fit_explainer, partition.rows(target), fit_kwargs, seed + target
+            )
+        return fitted, time.perf_counter() - start
+
+    futures = {
+        target: pool.submit(
+            _fit_rows_in_worker,
+            without_model(explainer),
+            partition.slices[target],
+            fit_kwargs,
+            seed + target,
+        )
+        for target, explainer in to_fit.items()
+    }
+    for target, future in futures.items():
+        explainer, _ = future.result()
+        explainer.model_with_split_points = explainers[target].model_with_split_points
+        fitted[target] = explainer
+    return fitted, time.perf_counter() - start
+
+
+@dataclass
+class ClassWiseFitTiming:
+    method_name: str
+    workers: int
+    serial_seconds: float
+    parallel_seconds: float
+    max_dictionary_difference: float
+
+
+def compare_fits(
+    method_name: str,
+    workers: int,
+    serial: tuple[dict[int, object], float],
+    parallel: tuple[dict[int, object], float],
+) -> ClassWiseFitTiming:
+    serial_explainers, serial_seconds = serial
+    parallel_explainers, parallel_seconds = parallel
+    differences = [
+        (
+            serial_explainers[target].get_dictionary().float().cpu()
+            - parallel_explainers[target].get_dictionary().float().cpu()
+        )
+        .abs()
+        .max()
+        .item()
+        for target in serial_explainers
+    ]
+    return ClassWiseFitTiming(
+        method_name, workers, serial_seconds, parallel_seconds, max(differences, default=0.0)
+    )
+
+
+def print_fit_timings(timings: list[ClassWiseFitTiming]) -> None:
+    for timing in timings:
+        print(
+            f"{timing.method_name}: serial {timing.serial_seconds:.1f}s, "
+            f"{timing.workers} workers {timing.parallel_seconds:.1f}s "
+            f"({timing.serial_seconds / max(timing.parallel_seconds, 1e-9):.2f}x), "
+            f"max dictionary difference {timing.max_dictionary_difference:.2e}"
+        )
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Generate classification attribution HTML files and minimal .py snippets."""
 
+import argparse
 from pathlib import Path
 
 import torch
@@ -9,6 +10,7 @@ from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
 from interpreto import (
     GradientShap,
+    Granularity,
     IntegratedGradients,
     KernelShap,
     Lime,
@@ -21,6 +23,14 @@ from interpreto import (
     plot_attributions,
 )
 
+from adaptive_quadrature import explain_adaptive, print_quadrature_report
+from anytime_sampling import explain_anytime, print_stability_report
+from batch_tuning import resolve_batch_size, shortest_input
+from explanation_metadata import write_metadata
+from render_only import render_in_parallel, stored_attribution, stored_methods
+from results_store import attribution_record, read_results, write_results
+from snippets import classification_attribution_snippet
+
 
 # ----------------------------
 # Configuration (edit these)
@@ -47,6 +57,8 @@ MODEL_CONFIGS = {
             "negative",
             "positive",
         ],
+        # Reviews are long: attribute whole sentences (a Granularity name).
+        "granularity": "SENTENCE",
     },
     "clf:ag-news:roberta": {
         "hf_model_id": "arman1o1/roberta_ag_news_model",
@@ -63,8 +75,19 @@ MODEL_CONFIGS = {
 NUM_SAMPLES = 10
 SEED = 0
 
+# Fallback when no tuned batch size is cached for this host (see batch_tuning.py).
+BATCH_SIZE = 4
+TUNE_BATCH_SIZE = True
+
 OUTPUT_ROOT = Path("explanations")
 
+# Also keep the raw attributions, tokens and targets of every method and scope
+# in results/ (see results_store.py), for metrics and re-rendering.
+WRITE_RESULTS = True
+# Processes re-rendering the stored tables with --render-only; None uses one
+# per table, up to the number of cores.
+RENDER_WORKERS = None
+
 METHODS = {
     "kernel_shap": KernelShap,
     "lime": Lime,
@@ -78,36 +101,27 @@ METHODS = {
     "vargrad": VarGrad,
 }
 
+# Adaptive Gauss-Legendre quadrature for path-integral methods: steps are added
+# per sample until the completeness gap falls under QUADRATURE_TOLERANCE. The
+# chosen steps and the remaining errors are written to <method>.json next to
+# the HTML.
+ADAPTIVE_QUADRATURE = False
+ADAPTIVE_METHODS = ("gradient_shap", "integrated_gradients")
+QUADRATURE_TOLERANCE = 0.05
+QUADRATURE_MAX_STEPS = 256
+QUADRATURE_ORDER = 4
 
-def render_code_snippet(
-    explainer_cls: type,
-    sample_text: str,
-    model_hf_id: str,
-    classes_names: list[str],
-    scope: str,
-) -> str:
-    if scope == "all-classes":
-        targets = "torch.arange(len(classes_names))"
-    else:
-        targets = "None"
-
-    return f"""import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from interpreto import {explainer_cls.__name__}, plot_attributions
-
-model_id = {model_hf_id!r}
-classes_names = {classes_names!r}
-
-tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True)
-model = AutoModelForSequenceClassification.from_pretrained(model_id)
-explainer = {explainer_cls.__name__}(model, tokenizer)
-
-attributions = explainer(
-    model_inputs={sample_text!r},
-    targets={targets}
-)
-plot_attributions(attributions[0], classes_names=classes_names)
-"""
+# Anytime mode for sampling-based methods: perturbations are drawn in rounds
+# until the attribution ranking is stable or the time budget (seconds) is spent.
+# The achieved stability is written to <method>.json next to the HTML.
+ANYTIME_SAMPLING = False
+ANYTIME_METHODS = ("kernel_shap", "lime", "sobol")
+STABILITY_TOPK = 5
+STABILITY_MIN_OVERLAP = 0.8
+STABILITY_MIN_CORRELATION = 0.9
+STABILITY_PATIENCE = 2
+ANYTIME_MAX_ROUNDS = 20
+ANYTIME_TIME_BUDGET = 600
 
 
 def plot_and_snippet_save(
@@ -120,6 +134,8 @@ def plot_and_snippet_save(
     explainer_cls,
     sample,
     config,
+    stability=None,
+    quadrature=None,
 ):
     if scope == "all-classes":
         sample_dir = output_root / "all-classes" / f"sample-{i:03d}"
@@ -139,20 +155,72 @@ def plot_and_snippet_save(
     # Write a code snippet for the attributions.
     code_path = html_path.with_suffix(".py")
     code_path.write_text(
-        render_code_snippet(
-            explainer_cls=explainer_cls,
+        classification_attribution_snippet(
+            explainer_name=explainer_cls.__name__,
             sample_text=sample,
             model_hf_id=config["hf_model_id"],
             classes_names=classes_names,
             scope=scope,
+            granularity=config.get("granularity"),
         ),
         encoding="utf-8",
     )
 
+    if stability is not None:
+        write_metadata(html_path, stability=stability.to_dict())
+    if quadrature is not None:
+        write_metadata(html_path, quadrature=quadrature.to_dict())
+
+
+def render_stored(scope, output_root, method_name, classes_names, config):
+    """Re-render the HTML files and snippets of a stored results table."""
+    table = read_results(model_id, "attribution", scope, method_name)
+    for i in table.samples:
+        record = table.record(i)
+        plot_and_snippet_save(
+            scope=scope,
+            output_root=output_root,
+            i=i,
+            attribution=stored_attribution(record),
+            method_name=method_name,
+            classes_names=classes_names,
+            explainer_cls=METHODS[method_name],
+            sample=record["metadata"]["input"],
+            config=config,
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--render-only",
+        action="store_true",
+        help="Rebuild the HTML files and snippets from results/ without loading the model.",
+    )
+    return parser.parse_args()
+
 
 def main() -> None:
+    args = parse_args()
     config = MODEL_CONFIGS[model_id]
     classes_names = config["classes_names"]
+    output_root = OUTPUT_ROOT / model_id / "attribution"
+
+    if args.render_only:
+        jobs = [
+            {
+                "scope": scope,
+                "output_root": output_root,
+                "method_name": method_name,
+                "classes_names": classes_names,
+                "config": config,
+            }
+            for scope in ("all-classes", "single-class")
+            for method_name in stored_methods(model_id, "attribution", scope, METHODS)
+        ]
+        render_in_parallel(render_stored, jobs, RENDER_WORKERS)
+        return
+
     torch.manual_seed(0)
 
     # Load a fixed set of samples so outputs are reproducible.
@@ -166,17 +234,72 @@ def main() -> None:
     tokenizer = AutoTokenizer.from_pretrained(config["hf_model_id"], use_fast=True)
     model = AutoModelForSequenceClassification.from_pretrained(config["hf_model_id"])
     model.eval()
-
-    output_root = OUTPUT_ROOT / model_id / "attribution"
+    explainer_kwargs = {}
+    if "granularity" in config:
+        explainer_kwargs["granularity"] = Granularity[config["granularity"]]
+    # The batch size probes explain the shortest sample only.
+    probe = shortest_input(batch_inputs)
 
     for method_name, explainer_cls in METHODS.items():
         # Compute attributions for all samples in a batch.
-        explainer = explainer_cls(model, tokenizer)
-        all_attributions = explainer(model_inputs=batch_inputs, targets=all_targets)
-        single_attributions = explainer(model_inputs=batch_inputs)
+        batch_size = resolve_batch_size(
+            model_id,
+            method_name,
+            run=lambda size: explainer_cls(model, tokenizer, batch_size=size, **explainer_kwargs)(
+                model_inputs=[batch_inputs[probe]], targets=all_targets[probe : probe + 1]
+            ),
+            default=BATCH_SIZE,
+            tune=TUNE_BATCH_SIZE,
+        )
+        explainer = explainer_cls(model, tokenizer, batch_size=batch_size, **explainer_kwargs)
+        all_stability = single_stability = [None] * len(batch_inputs)
+        all_reports = single_reports = [None] * len(batch_inputs)
+        if ADAPTIVE_QUADRATURE and method_name in ADAPTIVE_METHODS:
+            quadrature = {
+                "tolerance": QUADRATURE_TOLERANCE,
+                "max_steps": QUADRATURE_MAX_STEPS,
+                "order": QUADRATURE_ORDER,
+            }
+            all_attributions, all_reports = explain_adaptive(
+                explainer, batch_inputs, all_targets, **quadrature
+            )
+            single_attributions, single_reports = explain_adaptive(
+                explainer, batch_inputs, None, **quadrature
+            )
+            print_quadrature_report(f"{method_name} all-classes", all_reports)
+            print_quadrature_report(f"{method_name} single-class", single_reports)
+        elif ANYTIME_SAMPLING and method_name in ANYTIME_METHODS:
+            anytime = {
+                "topk": STABILITY_TOPK,
+                "min_overlap": STABILITY_MIN_OVERLAP,
+                "min_correlation": STABILITY_MIN_CORRELATION,
+                "patience": STABILITY_PATIENCE,
+                "max_rounds": ANYTIME_MAX_ROUNDS,
+                "time_budget": ANYTIME_TIME_BUDGET,
+            }
+            all_attributions, all_stability = explain_anytime(
+                explainer, batch_inputs, all_targets, **anytime
+            )
+            single_attributions, single_stability = explain_anytime(
+                explainer, batch_inputs, None, **anytime
+            )
+            print_stability_report(f"{method_name} all-classes", all_stability)
+            print_stability_report(f"{method_name} single-class", single_stability)
+        else:
+            all_attributions = explainer(model_inputs=batch_inputs, targets=all_targets)
+            single_attributions = explainer(model_inputs=batch_inputs)
 
-        for i, (sample, aa, sa) in enumerate(
-            zip(batch_inputs, all_attributions, single_attributions)
+        records = {"all-classes": [], "single-class": []}
+        for i, (sample, aa, sa, a_stab, s_stab, a_quad, s_quad) in enumerate(
+            zip(
+                batch_inputs,
+                all_attributions,
+                single_attributions,
+                all_stability,
+                single_stability,
+                all_reports,
+                single_reports,
+            )
         ):
             plot_and_snippet_save(
                 scope="all-classes",
@@ -188,6 +311,8 @@ def main() -> None:
                 explainer_cls=explainer_cls,
                 sample=sample,
                 config=config,
+                stability=a_stab,
+                quadrature=a_quad,
             )
             plot_and_snippet_save(
                 scope="single-class",
@@ -199,7 +324,33 @@ def main() -> None:
                 explainer_cls=explainer_cls,
                 sample=sample,
                 config=config,
+                stability=s_stab,
+                quadrature=s_quad,
             )
+            for scope, attribution, stability, quadrature in (
+                ("all-classes", aa, a_stab, a_quad),
+                ("single-class", sa, s_stab, s_quad),
+            ):
+                records[scope].append(
+                    attribution_record(
+                        i,
+                        attribution,
+                        input=sample,
+                        stability=None if stability is None else stability.to_dict(),
+                        quadrature=None if quadrature is None else quadrature.to_dict(),
+                    )
+                )
+
+        if WRITE_RESULTS:
+            for scope, scope_records in records.items():
+                write_results(
+                    model_id,
+                    "attribution",
+                    scope,
+                    method_name,
+                    scope_records,
+                    {"hf_model_id": config["hf_model_id"], "classes_names": classes_names},
+                )
 
 
 if __name__ == "__main__":
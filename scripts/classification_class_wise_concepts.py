@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""Generate class-wise classification concept HTML files and .py snippets.
+
+One concept explainer is fitted per predicted class. The per-class fits run
+concurrently over a shared-memory copy of the activations sorted by class
+(see class_wise_fitting.py); run with --compare-serial to also time the
+serial loop and print the speedup.
+"""
+
+import argparse
+from pathlib import Path
+
+import torch
+from datasets import load_dataset
+from transformers import AutoModelForSequenceClassification
+
+from interpreto import ModelWithSplitPoints, plot_concepts
+from interpreto.concepts import (
+    ICAConcepts,
+    MpSAEConcepts,
+    NeuronsAsConcepts,
+    PCAConcepts,
+    SemiNMFConcepts,
+    SVDConcepts,
+    VanillaSAEConcepts,
+)
+from interpreto.concepts.methods.overcomplete import DeadNeuronsReanimationLoss, MSELoss
+
+import concept_pipeline
+from class_wise_fitting import (
+    class_fit_pool,
+    compare_fits,
+    fit_class_explainers,
+    partition_by_class,
+    print_fit_timings,
+)
+from concept_gradients import concept_importances, per_method_gradient_chunks
+from concept_pipeline import StoredActivations, dataset_fields
+from fit_scheduler import default_workers
+from render_only import render_in_parallel, stored_labels, stored_methods
+from results_store import DATASET, read_results, write_results
+from snippets import python_source
+from streaming_topk import topk_inputs
+from vocabulary_cache import unique_words
+
+
+# ----------------------------
+# Configuration (edit these)
+# ----------------------------
+model_id = "clf:imdb:distilbert"
+
+DATASET_SPLIT = "test"
+NUM_SAMPLES = 10000
+SEED = 0
+
+NB_CONCEPTS = 20
+TOP_K = 10
+TOPK_WORDS = 5
+
+BATCH_SIZE = 64
+GRADIENT_BATCH_SIZE = 64
+
+# Number of processes fitting the per-class explainers; None uses one per
+# class, up to the number of cores.
+FIT_WORKERS = None
+
+ACTIVATION_STORE = True
+ACTIVATION_STORE_DTYPE = torch.float32
+ACTIVATION_CHUNK_SIZE = 250
+
+OUTPUT_ROOT = Path("explanations")
+
+# Also keep the raw (classes, concepts) importances and the top-k words of
+# every class's concepts in results/ (see results_store.py).
+WRITE_RESULTS = True
+# Processes re-rendering the stored tables with --render-only; None uses one
+# per table, up to the number of cores.
+RENDER_WORKERS = None
+
+METHODS = {
+    "ica": ICAConcepts,
+    "mp_sae": MpSAEConcepts,
+    "neurons_as_concepts": NeuronsAsConcepts,
+    "pca": PCAConcepts,
+    "semi_nmf": SemiNMFConcepts,
+    "svd": SVDConcepts,
+    "vanilla_sae": VanillaSAEConcepts,
+}
+
+SAES_TRAIN_PARAMETERS = {
+    "optimizer_class": torch.optim.Adam,
+    "scheduler_class": torch.optim.lr_scheduler.CosineAnnealingLR,
+    "scheduler_kwargs": {"T_max": 20, "eta_min": 1e-6},
+    "lr": 1e-3,
+    "nb_epochs": 30,
+    "batch_size": 32 * BATCH_SIZE,
+    "monitoring": 0,
+}
+
+# The models, datasets and split points of concept_pipeline.MODEL_CONFIGS,
+# with the settings of each model's published class-wise explanations, which
+# the snippets are rendered from:
+# - "fit_parameters": keyword arguments of each method's fit;
+# - "unfitted_methods": methods built without nb_concepts and never fitted.
+MODEL_CONFIGS = {
+    "clf:emotion:bert": {
+        **concept_pipeline.MODEL_CONFIGS["clf:emotion:bert"],
+        "fit_parameters": {},
+        "unfitted_methods": (),
+    },
+    "clf:imdb:distilbert": {
+        **concept_pipeline.MODEL_CONFIGS["clf:imdb:distilbert"],
+        "fit_parameters": {},
+        "unfitted_methods": (),
+    },
+    "clf:ag-news:roberta": {
+        **concept_pipeline.MODEL_CONFIGS["clf:ag-news:roberta"],
+        "fit_parameters": {
+            "ica": {"max_iter": 5000},
+            "mp_sae": {"criterion": MSELoss, **SAES_TRAIN_PARAMETERS},
+            "vanilla_sae": {"criterion": DeadNeuronsReanimationLoss, **SAES_TRAIN_PARAMETERS},
+        },
+        # NeuronsAsConcepts has one concept per neuron and nothing to fit.
+        "unfitted_methods": ("neurons_as_concepts",),
+    },
+}
+
+
+def render_code_snippet(
+    method_name: str,
+    explainer_cls: type,
+    model_hf_id: str,
+    dataset_hf_id: str,
+    classes_names: list[str],
+    split_points: int | str,
+    fit_parameters: dict,
+    fitted: bool = True,
+) -> str:
+    imports = [
+        f"from interpreto.concepts import {explainer_cls.__name__}",
+        *(
+            f"from interpreto.concepts.methods.overcomplete import {value.__name__}"
+            for value in fit_parameters.values()
+            if isinstance(value, type) and value.__module__.startswith("interpreto")
+        ),
+    ]
+    if not fitted:
+        explainer = f"""    concept_explainer = {explainer_cls.__name__}(model_with_split_points)
+"""
+    else:
+        fit_arguments = "".join(
+            f"        {name}={python_source(value)},\n" for name, value in fit_parameters.items()
+        )
+        fit_call = (
+            f"concept_explainer.fit(\n        class_activations,\n{fit_arguments}    )"
+            if fit_arguments
+            else "concept_explainer.fit(class_activations)"
+        )
+        explainer = f"""    concept_explainer = {explainer_cls.__name__}(model_with_split_points, nb_concepts={NB_CONCEPTS}, device=device)
+    {fit_call}
+"""
+    import_lines = "\n".join(imports)
+    return f"""import torch
+from datasets import load_dataset
+from transformers import AutoModelForSequenceClassification
+from interpreto import ModelWithSplitPoints, plot_concepts
+{import_lines}
+from interpreto.concepts.interpretations import TopKInputs
+
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+model_with_split_points = ModelWithSplitPoints(
+    {model_hf_id!r},
+    automodel=AutoModelForSequenceClassification,
+    split_points={split_points!r},
+    device_map=device,
+    batch_size={BATCH_SIZE},
+)
+
+dataset = load_dataset({dataset_hf_id!r})[{DATASET_SPLIT!r}].shuffle(seed={SEED})
+inputs = dataset["text"][:{NUM_SAMPLES}]
+
+granularity = ModelWithSplitPoints.activation_granularities.CLS_TOKEN
+activations = model_with_split_points.get_activations(
+    inputs=inputs,
+    activation_granularity=granularity,
+    include_predicted_classes=True,
+)
+
+concepts_importances = {{}}
+concepts_labels = {{}}
+
+for target, class_name in enumerate({classes_names!r}):
+    indices = (activations["predictions"] == target).nonzero(as_tuple=True)[0].tolist()
+
+    class_inputs = [inputs[i] for i in indices]
+    class_activations = {{k: v[indices] for k, v in activations.items()}}
+
+{explainer}
+    topk_inputs_method = TopKInputs(
+        concept_explainer=concept_explainer,
+        k={TOPK_WORDS},
+        activation_granularity=granularity,
+        use_unique_words=True,
+        unique_words_kwargs={{
+            "count_min_threshold": max(1, round(len(class_inputs) * 0.002)),
+            "lemmatize": True,
+            "words_to_ignore": [],
+        }},
+    )
+
+    topk_words = topk_inputs_method.interpret(
+        inputs=class_inputs,
+        concepts_indices="all",
+    )
+    concepts_labels[target] = {{k: list(v.keys()) for k, v in topk_words.items() if v}}
+
+    # Mean absolute concept gradient, accumulated batch by batch.
+    gradient_sum = 0
+    for start in range(0, len(class_inputs), {GRADIENT_BATCH_SIZE}):
+        gradients = concept_explainer.concept_output_gradient(
+            inputs=class_inputs[start : start + {GRADIENT_BATCH_SIZE}],
+            targets=[target],
+            activation_granularity=granularity,
+            concepts_x_gradients=True,
+            batch_size={GRADIENT_BATCH_SIZE},
+        )
+        gradient_sum += torch.cat(gradients, dim=1).abs().sum(1)
+    concepts_importances[target] = gradient_sum[0] / len(class_inputs)
+
+plot_concepts(
+    classes_names={classes_names!r},
+    concepts_importances=concepts_importances,
+    concepts_labels=concepts_labels,
+    top_k={TOP_K},
+)
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Generate class-wise classification concept HTML files and snippets."
+    )
+    parser.add_argument(
+        "--compare-serial",
+        action="store_true",
+        help="Also fit every method in a serial loop and report the speedup of the process pool.",
+    )
+    parser.add_argument(
+        "--render-only",
+        action="store_true",
+        help="Rebuild the HTML files and snippets from results/ without loading the model.",
+    )
+    return parser.parse_args()
+
+
+def plot_and_snippet_save(output_root, method_name, concepts_importances, concepts_labels, config):
+    html_path = output_root / f"{method_name}.html"
+    plot_concepts(
+        classes_names=config["classes_names"],
+        concepts_importances=concepts_importances,
+        concepts_labels=concepts_labels,
+        top_k=TOP_K,
+        save_path=str(html_path),
+    )
+
+    code_path = html_path.with_suffix(".py")
+    code_path.write_text(
+        render_code_snippet(
+            method_name=method_name,
+            explainer_cls=METHODS[method_name],
+            model_hf_id=config["hf_model_id"],
+            dataset_hf_id=config["hf_dataset_id"],
+            classes_names=config["classes_names"],
+            split_points=config["split_points"],
+            fit_parameters=config["fit_parameters"].get(method_name, {}),
+            fitted=method_name not in config["unfitted_methods"],
+        ),
+        encoding="utf-8",
+    )
+
+
+def render_stored(output_root, method_name, config):
+    """Re-render the HTML file and snippet of a stored results table."""
+    record = read_results(model_id, "concept", "class-wise", method_name).record(DATASET)
+    targets = record["targets"].tolist()
+    plot_and_snippet_save(
+        output_root,
+        method_name,
+        {target: torch.tensor(row) for target, row in zip(targets, record["importances"])},
+        {
+            target: stored_labels(record["metadata"]["labels"][str(target)])
+            for target in targets
+        },
+        config,
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    config = MODEL_CONFIGS[model_id]
+    classes_names = config["classes_names"]
+    split_points = config["split_points"]
+    output_root = OUTPUT_ROOT / model_id / "concept" / "class-wise"
+
+    if args.render_only:
+        jobs = [
+            {"output_root": output_root, "method_name": method_name, "config": config}
+            for method_name in stored_methods(model_id, "concept", "class-wise", METHODS)
+        ]
+        render_in_parallel(render_stored, jobs, RENDER_WORKERS)
+        return
+
+    torch.manual_seed(SEED)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    dataset = load_dataset(config["hf_dataset_id"])[DATASET_SPLIT].shuffle(seed=SEED)["text"]
+    inputs: list[str] = dataset[:NUM_SAMPLES]  # type: ignore
+
+    model_with_split_points = ModelWithSplitPoints(
+        config["hf_model_id"],
+        automodel=AutoModelForSequenceClassification,  # type: ignore
+        split_points=split_points,
+        device_map=device,
+        batch_size=BATCH_SIZE,
+    )
+    granularity = ModelWithSplitPoints.activation_granularities.CLS_TOKEN
+
+    store_fields = dataset_fields(
+        config, model_with_split_points, granularity, DATASET_SPLIT, SEED, len(inputs)
+    )
+    stored_activations = StoredActivations(
+        model_with_split_points,
+        granularity,
+        store=ACTIVATION_STORE,
+        chunk_size=ACTIVATION_CHUNK_SIZE,
+        dtype=ACTIVATION_STORE_DTYPE,
+    )
+
+    activations = stored_activations.get(inputs, store_fields, include_predicted_classes=True)
+    split_point = model_with_split_points.split_points[0]
+    partition = partition_by_class(
+        activations[split_point], activations["predictions"], len(classes_names)
+    )
+    del activations
+
+    targets = [target for target in range(len(classes_names)) if partition.size(target) > 0]
+    for target in sorted(set(range(len(classes_names))) - set(targets)):
+        print(f"No input is predicted as {classes_names[target]!r}: skipping the class.")
+    class_inputs = {
+        target: [inputs[i] for i in partition.indices(target)] for target in targets
+    }
+
+    # Each class is labelled with its own unique words, whose activations do
+    # not depend on the concept method.
+    class_words, class_word_activations = {}, {}
+    for target in targets:
+        unique_words_kwargs = {
+            "count_min_threshold": max(1, round(len(class_inputs[target]) * 0.002)),
+            "lemmatize": True,
+            "words_to_ignore": [],
+        }
+        class_words[target] = unique_words(class_inputs[target], **unique_words_kwargs)
+        class_word_activations[target] = stored_activations.get(
+            class_words[target],
+            {**store_fields, "class": target, "unique_words": unique_words_kwargs},
+        )
+    if not model_with_split_points.dispatched:
+        model_with_split_points.dispatch()
+
+    workers = FIT_WORKERS or default_workers(len(targets))
+    timings = []
+
+    output_root.mkdir(parents=True, exist_ok=True)
+
+    def new_explainers(method_name: str, explainer_cls: type) -> dict[int, object]:
+        explainers = {}
+        for target in targets:
+            if method_name in config["unfitted_methods"]:
+                explainers[target] = explainer_cls(model_with_split_points)
+                continue
+            # SAEs are initialised here: seed per class, as for the fits.
+            torch.manual_seed(SEED + target)
+            explainers[target] = explainer_cls(
+                model_with_split_points, nb_concepts=NB_CONCEPTS, device=device
+            )
+        return explainers
+
+    with class_fit_pool(partition, workers) as pool:
+        for method_name, explainer_cls in METHODS.items():
+            fit_parameters = config["fit_parameters"].get(method_name, {})
+            pooled = fit_class_explainers(
+                new_explainers(method_name, explainer_cls),
+                partition,
+                fit_parameters,
+                seed=SEED,
+                pool=pool,
+            )
+            explainers, fit_seconds = pooled
+            print(f"{method_name}: fitted {len(targets)} classes in {fit_seconds:.1f}s")
+            if args.compare_serial and method_name not in config["unfitted_methods"]:
+                serial = fit_class_explainers(
+                    new_explainers(method_name, explainer_cls), partition, fit_parameters, seed=SEED
+                )
+                timings.append(compare_fits(method_name, workers, serial, pooled))
+
+            concepts_importances = {}
+            concepts_labels = {}
+            concepts_words = {}
+            for target in targets:
+                concept_explainer = explainers[target]
+                # One CLS_TOKEN row per word (see streaming_topk.py).
+                topk_words = topk_inputs(
+                    concept_explainer,
+                    class_word_activations[target][split_point],
+                    class_words[target],
+                    k=TOPK_WORDS,
+                )
+                concepts_labels[target] = {k: list(v.keys()) for k, v in topk_words.items() if v}
+                concepts_words[target] = topk_words
+
+                gradients = per_method_gradient_chunks(
+                    concept_explainer,
+                    class_inputs[target],
+                    granularity,
+                    batch_size=GRADIENT_BATCH_SIZE,
+                    targets=[target],
+                )
+                concepts_importances[target] = concept_importances(gradients).mean[0]
+
+            plot_and_snippet_save(
+                output_root, method_name, concepts_importances, concepts_labels, config
+            )
+            if WRITE_RESULTS:
+                write_results(
+                    model_id,
+                    "concept",
+                    "class-wise",
+                    method_name,
+                    [
+                        {
+                            "sample": DATASET,
+                            "targets": torch.tensor(targets),
+                            "importances": torch.stack(
+                                [concepts_importances[target] for target in targets]
+                            ),
+                            "metadata": {"labels": concepts_words},
+                        }
+                    ],
+                    {
+                        "hf_model_id": config["hf_model_id"],
+                        "classes_names": classes_names,
+                        "split_points": split_points,
+                        "nb_concepts": NB_CONCEPTS,
+                    },
+                )
+            del explainers, concepts_importances, concepts_labels, concepts_words
+
+    if timings:
+        print_fit_timings(timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Generate classification concept HTML files and minimal .py snippets."""
 
+import argparse
 from pathlib import Path
 
 import torch
@@ -9,17 +10,44 @@ from transformers import AutoModelForSequenceClassification
 
 from interpreto import ModelWithSplitPoints, plot_concepts
 from interpreto.concepts import (
-    BatchTopKSAEConcepts,
     ICAConcepts,
     MpSAEConcepts,
     NeuronsAsConcepts,
+    PCAConcepts,
     SemiNMFConcepts,
-    SparsePCAConcepts,
     SVDConcepts,
     VanillaSAEConcepts,
 )
-from interpreto.concepts.methods.overcomplete import DeadNeuronsReanimationLoss
-from interpreto.concepts.interpretations import TopKInputs
+from interpreto.concepts.methods.overcomplete import DeadNeuronsReanimationLoss, MSELoss
+
+import concept_pipeline
+from batch_tuning import resolve_batch_size
+from concept_gradients import (
+    activation_output_gradients,
+    compare_concept_gradients,
+    concept_importances,
+    per_method_gradient_chunks,
+    print_gradient_comparisons,
+    project_concept_gradients,
+    projected_gradient_chunks,
+)
+from concept_pipeline import StoredActivations, dataset_fields
+from explainer_cache import explainer_fields, load_into, save_concept_model
+from fit_scheduler import (
+    FitJob,
+    FitSchedule,
+    default_workers,
+    fit_explainer,
+    shared_activations_pool,
+)
+from minibatch_ica import fit_ica
+from out_of_core_sae import fit_sae_out_of_core
+from render_only import render_in_parallel, stored_labels, stored_methods
+from results_store import DATASET, read_results, write_results
+from snippets import python_source
+from streaming_decompositions import fit_decomposition
+from streaming_topk import topk_inputs
+from vocabulary_cache import unique_words
 
 
 # ----------------------------
@@ -27,42 +55,8 @@ from interpreto.concepts.interpretations import TopKInputs
 # ----------------------------
 model_id = "clf:imdb:distilbert"
 
-MODEL_CONFIGS = {
-    "clf:emotion:bert": {
-        "hf_model_id": "nateraw/bert-base-uncased-emotion",
-        "hf_dataset_id": "dair-ai/emotion",
-        "classes_names": [
-            "sadness",
-            "joy",
-            "love",
-            "anger",
-            "fear",
-            "surprise",
-        ],
-        "split_points": 11,
-    },
-    "clf:imdb:distilbert": {
-        "hf_model_id": "lvwerra/distilbert-imdb",
-        "hf_dataset_id": "stanfordnlp/imdb",
-        "classes_names": [
-            "negative",
-            "positive",
-        ],
-        "split_points": 5,
-    },
-    "clf:ag-news:roberta": {
-        "hf_model_id": "arman1o1/roberta_ag_news_model",
-        "hf_dataset_id": "fancyzhx/ag_news",
-        "classes_names": [
-            "World",
-            "Sports",
-            "Business",
-            "Sci/Tech",
-        ],
-        "split_points": 11,
-    },
-}
-
+# Split the concepts are fitted and labelled on, in the pipeline, the activation
+# store key and the published snippets alike.
 DATASET_SPLIT = "train"
 NUM_SAMPLES = 1000
 SEED = 0
@@ -74,54 +68,206 @@ TOPK_WORDS = 5
 BATCH_SIZE = 64
 GRADIENT_BATCH_SIZE = 64
 
+# The forward and gradient batch sizes are tuned once per host (see
+# batch_tuning.py) on PROBE_SAMPLES inputs; the values above are the fallbacks.
+# BATCH_SIZE also scales the SAE training parameters, which are left as is.
+TUNE_BATCH_SIZE = True
+PROBE_SAMPLES = 128
+
+# Activations are computed once per (model, split point, granularity, dataset)
+# and memory-mapped from activation_store/ on later runs (see
+# activation_store.py). float16 or bfloat16 halve the disk and page cache
+# footprint; fits and encoders upcast them to float32 a chunk at a time (the
+# in-memory fits, for the duration of the fit). Switching from float32 to half
+# precision converts the stored entries; switching back computes them again.
+# Run storage_precision.py --report to compare the fits.
+ACTIVATION_STORE = True
+ACTIVATION_STORE_DTYPE = torch.float32
+ACTIVATION_CHUNK_SIZE = 250
+
+# Methods with a linear decoder get their concept gradients by projecting one
+# shared gradient with respect to the split-point activations on their
+# dictionary (see concept_gradients.py), instead of one backward pass over the
+# dataset each. That gradient is taken at the original activations rather
+# than at each method's reconstruction: run with --verify-gradients to compare
+# both on a model before enabling it.
+SHARED_OUTPUT_GRADIENTS = False
+LINEAR_DECODER_METHODS = ("ica", "neurons_as_concepts", "pca", "semi_nmf", "svd")
+
+# Reduce the concept gradients to importances one gradient batch at a time
+# (see running_stats.py) instead of stacking the gradients of every input.
+STREAMING_IMPORTANCES = True
+
+# Fitted concept models are cached in explainer_cache/ (see
+# explainer_cache.py) and reused while the activations and the method
+# parameters are unchanged; pass --refit to fit them again anyway.
+EXPLAINER_CACHE = True
+
 OUTPUT_ROOT = Path("explanations")
 
+# Also keep the raw (classes, concepts) importances and the top-k words of
+# every concept in results/ (see results_store.py).
+WRITE_RESULTS = True
+# Processes re-rendering the stored tables with --render-only; None uses one
+# per table, up to the number of cores.
+RENDER_WORKERS = None
+
 METHODS = {
-    "batch_top_k_sae": BatchTopKSAEConcepts,
     "ica": ICAConcepts,
     "mp_sae": MpSAEConcepts,
     "neurons_as_concepts": NeuronsAsConcepts,
+    "pca": PCAConcepts,
     "semi_nmf": SemiNMFConcepts,
-    "sparse_pca": SparsePCAConcepts,
     "svd": SVDConcepts,
     "vanilla_sae": VanillaSAEConcepts,
 }
 
 SAES_TRAIN_PARAMETERS = {
-    "criterion": DeadNeuronsReanimationLoss,
     "optimizer_class": torch.optim.Adam,
     "scheduler_class": torch.optim.lr_scheduler.CosineAnnealingLR,
     "scheduler_kwargs": {"T_max": 20, "eta_min": 1e-6},
     "lr": 1e-3,
-    "nb_epochs": 20,
+    "nb_epochs": 30,
     "batch_size": 32 * BATCH_SIZE,
-    "monitoring": 1,
+    "monitoring": 0,
 }
 
-ADDITIONAL_INIT_PARAMETERS = {
-    "batch_top_k_sae": {"top_k": 10 * BATCH_SIZE},
+# The models, datasets and split points of concept_pipeline.MODEL_CONFIGS,
+# with the settings of each model's published general explanations, which
+# the snippets are rendered from:
+# - "init_parameters": keyword arguments of each method besides nb_concepts;
+# - "fit_parameters": keyword arguments of each method's fit;
+# - "unfitted_methods": methods built without nb_concepts and never fitted.
+MODEL_CONFIGS = {
+    "clf:emotion:bert": {
+        **concept_pipeline.MODEL_CONFIGS["clf:emotion:bert"],
+        "init_parameters": {},
+        "fit_parameters": {},
+        "unfitted_methods": (),
+    },
+    "clf:imdb:distilbert": {
+        **concept_pipeline.MODEL_CONFIGS["clf:imdb:distilbert"],
+        "init_parameters": {},
+        "fit_parameters": {},
+        "unfitted_methods": (),
+    },
+    "clf:ag-news:roberta": {
+        **concept_pipeline.MODEL_CONFIGS["clf:ag-news:roberta"],
+        "init_parameters": {},
+        "fit_parameters": {
+            "ica": {"max_iter": 5000},
+            "mp_sae": {"criterion": MSELoss, **SAES_TRAIN_PARAMETERS},
+            "vanilla_sae": {"criterion": DeadNeuronsReanimationLoss, **SAES_TRAIN_PARAMETERS},
+        },
+        # NeuronsAsConcepts has one concept per neuron and nothing to fit.
+        "unfitted_methods": ("neurons_as_concepts",),
+    },
 }
-ADDITIONAL_FIT_PARAMETERS = {
-    "batch_top_k_sae": {**SAES_TRAIN_PARAMETERS},
-    "mp_sae": {**SAES_TRAIN_PARAMETERS},
-    "vanilla_sae": {**SAES_TRAIN_PARAMETERS},
+
+# Train the SAEs from minibatches streamed out of the memory-mapped activation
+# store (see out_of_core_sae.py) instead of a DataLoader over the whole
+# activation matrix, for activation sets larger than RAM. Only useful with
+# ACTIVATION_STORE.
+OUT_OF_CORE_SAE = False
+SAE_METHODS = ("mp_sae", "vanilla_sae")
+SAE_BUFFER_ROWS = 2**18
+
+# Solver for the SVD and PCA concept models (see streaming_decompositions.py):
+# "default" keeps their own fit; "exact" and "randomized" run in memory;
+# "gram" (one pass, exact) and "incremental" (PCA only) read the activations
+# chunk by chunk, for activation sets with millions of rows. On the published
+# activation sets, scikit-learn picks the randomized solver in both models'
+# own fits, so "randomized" gives the same components.
+DECOMPOSITION_SOLVER = "randomized"
+DECOMPOSITION_METHODS = ("pca", "svd")
+
+# Fit ICA by minibatch FastICA with early stopping (see minibatch_ica.py)
+# instead of scikit-learn's FastICA, which passes over every row at each
+# iteration. Progress and convergence are printed while fitting.
+MINIBATCH_ICA = False
+
+# Fit the concept methods concurrently, in worker processes sharing the
+# activations (see fit_scheduler.py), while this process interprets and
+# renders each method as soon as its fit is done. Only on CPU and without
+# OUT_OF_CORE_SAE, since the workers share an in-memory copy of the
+# activations. FIT_WORKERS = None uses one process per method, up to the
+# number of cores; FIT_THREADS = None splits torch's threads between them.
+CONCURRENT_FITS = True
+FIT_WORKERS = None
+FIT_THREADS = None
+# Rough relative fit times: the longest fits are started first, so that an
+# SAE is not left to train alone once the quick linear fits are done.
+FIT_COSTS = {
+    "mp_sae": 20,
+    "vanilla_sae": 20,
+    "semi_nmf": 5,
+    "ica": 2,
+    "pca": 1,
+    "svd": 1,
 }
 
 
+def fit_function(fit_parameters: dict, out_of_core: bool, solver: str):
+    """The fitter and keyword arguments of a `FitJob`."""
+    if out_of_core:
+        fit_kwargs = {"buffer_rows": SAE_BUFFER_ROWS, "seed": SEED, **fit_parameters}
+        return fit_sae_out_of_core, fit_kwargs
+    if solver == "minibatch":
+        return fit_ica, {"seed": SEED}
+    if solver != "default":
+        return fit_decomposition, {"solver": solver}
+    return fit_explainer, fit_parameters
+
+
+def init_parameters_of(method_name: str, config: dict) -> dict:
+    """Keyword arguments of the method's constructor, besides the model."""
+    if method_name in config["unfitted_methods"]:
+        return {}
+    return {"nb_concepts": NB_CONCEPTS, **config["init_parameters"].get(method_name, {})}
+
+
 def render_code_snippet(
     explainer_cls: type,
     model_hf_id: str,
     dataset_hf_id: str,
     classes_names: list[str],
     split_points: int,
-    nb_concepts: int,
+    init_parameters: dict,
+    fit_parameters: dict,
     top_k: int,
+    fitted: bool = True,
 ) -> str:
+    imports = [
+        f"from interpreto.concepts import {explainer_cls.__name__}",
+        *(
+            f"from interpreto.concepts.methods.overcomplete import {value.__name__}"
+            for value in fit_parameters.values()
+            if isinstance(value, type) and value.__module__.startswith("interpreto")
+        ),
+    ]
+    if not fitted:
+        explainer = f"concept_explainer = {explainer_cls.__name__}(model_with_split_points)\n"
+    else:
+        init_arguments = "".join(
+            f", {name}={python_source(value)}" for name, value in init_parameters.items()
+        )
+        fit_arguments = "".join(
+            f"    {name}={python_source(value)},\n" for name, value in fit_parameters.items()
+        )
+        fit_call = (
+            f"concept_explainer.fit(\n    activations,\n{fit_arguments})"
+            if fit_arguments
+            else "concept_explainer.fit(activations)"
+        )
+        explainer = f"""concept_explainer = {explainer_cls.__name__}(model_with_split_points{init_arguments}, device=device)
+{fit_call}
+"""
+    import_lines = "\n".join(imports)
     return f"""import torch
 from datasets import load_dataset
 from transformers import AutoModelForSequenceClassification
 from interpreto import ModelWithSplitPoints, plot_concepts
-from interpreto.concepts import {explainer_cls.__name__}
+{import_lines}
 from interpreto.concepts.interpretations import TopKInputs
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -134,7 +280,7 @@ model_with_split_points = ModelWithSplitPoints(
     batch_size={BATCH_SIZE},
 )
 
-inputs = load_dataset({dataset_hf_id!r})[{DATASET_SPLIT!r}].shuffle(seed=SEED)["text"][:{NUM_SAMPLES}]
+inputs = load_dataset({dataset_hf_id!r})[{DATASET_SPLIT!r}].shuffle(seed={SEED})["text"][:{NUM_SAMPLES}]
 
 granularity = ModelWithSplitPoints.activation_granularities.CLS_TOKEN
 activations = model_with_split_points.get_activations(
@@ -143,9 +289,7 @@ activations = model_with_split_points.get_activations(
     include_predicted_classes=True,
 )
 
-concept_explainer = {explainer_cls.__name__}(model_with_split_points, nb_concepts={nb_concepts}, device=device)
-concept_explainer.fit(activations)
-
+{explainer}
 topk_inputs_method = TopKInputs(
     concept_explainer=concept_explainer,
     k={TOPK_WORDS},
@@ -163,16 +307,19 @@ topk_words = topk_inputs_method.interpret(
     concepts_indices="all",
 )
 
-gradients = concept_explainer.concept_output_gradient(
-    inputs=inputs,
-    targets=None,
-    activation_granularity=granularity,
-    concepts_x_gradients=True,
-    batch_size={GRADIENT_BATCH_SIZE},
-)
-
-mean_gradients = torch.stack(gradients).abs().squeeze().mean(0)
-labels = {{k: list(v.keys()) for k, v in topk_words.items()}}
+# Mean absolute concept gradient per class, accumulated batch by batch.
+gradient_sum = 0
+for start in range(0, len(inputs), {GRADIENT_BATCH_SIZE}):
+    gradients = concept_explainer.concept_output_gradient(
+        inputs=inputs[start : start + {GRADIENT_BATCH_SIZE}],
+        targets=None,
+        activation_granularity=granularity,
+        concepts_x_gradients=True,
+        batch_size={GRADIENT_BATCH_SIZE},
+    )
+    gradient_sum += torch.cat(gradients, dim=1).abs().sum(1)
+mean_gradients = gradient_sum / len(inputs)
+labels = {{k: list(v.keys()) for k, v in topk_words.items() if v}}
 
 plot_concepts(
     classes_names={classes_names!r},
@@ -183,15 +330,89 @@ plot_concepts(
 """
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Generate classification concept HTML files and snippets."
+    )
+    parser.add_argument(
+        "--verify-gradients",
+        action="store_true",
+        help=(
+            "Compare the shared-gradient projection with the per-method concept "
+            "gradients for every linear-decoder method, then exit without writing files."
+        ),
+    )
+    parser.add_argument(
+        "--refit",
+        action="store_true",
+        help="Fit every concept method again instead of loading cached fits.",
+    )
+    parser.add_argument(
+        "--render-only",
+        action="store_true",
+        help="Rebuild the HTML files and snippets from results/ without loading the model.",
+    )
+    return parser.parse_args()
+
+
+def plot_and_snippet_save(output_root, method_name, importances, labels, config):
+    html_path = output_root / f"{method_name}.html"
+    plot_concepts(
+        classes_names=config["classes_names"],
+        concepts_importances=importances,
+        concepts_labels=labels,
+        top_k=TOP_K,
+        save_path=str(html_path),
+    )
+
+    code_path = html_path.with_suffix(".py")
+    code_path.write_text(
+        render_code_snippet(
+            explainer_cls=METHODS[method_name],
+            model_hf_id=config["hf_model_id"],
+            dataset_hf_id=config["hf_dataset_id"],
+            classes_names=config["classes_names"],
+            split_points=config["split_points"],
+            init_parameters=init_parameters_of(method_name, config),
+            fit_parameters=config["fit_parameters"].get(method_name, {}),
+            top_k=TOP_K,
+            fitted=method_name not in config["unfitted_methods"],
+        ),
+        encoding="utf-8",
+    )
+
+
+def render_stored(output_root, method_name, config):
+    """Re-render the HTML file and snippet of a stored results table."""
+    record = read_results(model_id, "concept", "general", method_name).record(DATASET)
+    plot_and_snippet_save(
+        output_root,
+        method_name,
+        torch.tensor(record["importances"]),
+        stored_labels(record["metadata"]["labels"]),
+        config,
+    )
+
+
 def main() -> None:
+    args = parse_args()
     config = MODEL_CONFIGS[model_id]
     classes_names = config["classes_names"]
     split_points = config["split_points"]
+    output_root = OUTPUT_ROOT / model_id / "concept" / "general"
+
+    if args.render_only:
+        jobs = [
+            {"output_root": output_root, "method_name": method_name, "config": config}
+            for method_name in stored_methods(model_id, "concept", "general", METHODS)
+        ]
+        render_in_parallel(render_stored, jobs, RENDER_WORKERS)
+        return
 
     torch.manual_seed(SEED)
     device = "cuda" if torch.cuda.is_available() else "cpu"
 
-    dataset = load_dataset(config["hf_dataset_id"])["test"].shuffle(seed=SEED)["text"]
+    dataset = load_dataset(config["hf_dataset_id"])[DATASET_SPLIT].shuffle(seed=SEED)["text"]
     inputs: list[str] = dataset[:NUM_SAMPLES]  # type: ignore
 
     model_with_split_points = ModelWithSplitPoints(
@@ -203,85 +424,250 @@ def main() -> None:
     )
 
     granularity = ModelWithSplitPoints.activation_granularities.CLS_TOKEN
-    activations = model_with_split_points.get_activations(
-        inputs=inputs,  # type: ignore
-        activation_granularity=granularity,
-        include_predicted_classes=True,
-    )
+    probe_inputs = inputs[:PROBE_SAMPLES]
 
-    output_root = OUTPUT_ROOT / model_id / "concept" / "general"
-    output_root.mkdir(parents=True, exist_ok=True)
-
-    for method_name, explainer_cls in METHODS.items():
-        concept_explainer = explainer_cls(
-            model_with_split_points,
-            nb_concepts=NB_CONCEPTS,
-            device=device,
-            **ADDITIONAL_INIT_PARAMETERS.get(method_name, {}),
-        )
-        concept_explainer.fit(
-            activations, **ADDITIONAL_FIT_PARAMETERS.get(method_name, {})
-        )
-
-        topk_inputs_method = TopKInputs(
-            concept_explainer=concept_explainer,
-            k=TOPK_WORDS,
+    def probe_activations(size: int) -> None:
+        model_with_split_points.batch_size = size
+        model_with_split_points.get_activations(
+            inputs=probe_inputs,  # type: ignore
             activation_granularity=granularity,
-            use_unique_words=True,
-            unique_words_kwargs={
-                "count_min_threshold": max(1, round(len(inputs) * 0.002)),
-                "lemmatize": True,
-                "words_to_ignore": [],
-            },
         )
 
-        topk_words = topk_inputs_method.interpret(
-            inputs=inputs,
-            concepts_indices="all",
-        )
+    model_with_split_points.batch_size = resolve_batch_size(
+        model_id,
+        "activations",
+        run=probe_activations,
+        default=BATCH_SIZE,
+        tune=TUNE_BATCH_SIZE,
+    )
+    gradient_batch_size = None
 
-        gradients = concept_explainer.concept_output_gradient(
-            inputs=inputs,
-            targets=None,
-            activation_granularity=granularity,
-            concepts_x_gradients=True,
-            batch_size=GRADIENT_BATCH_SIZE,
-        )
+    store_fields = dataset_fields(
+        config, model_with_split_points, granularity, DATASET_SPLIT, SEED, len(inputs)
+    )
+    stored_activations = StoredActivations(
+        model_with_split_points,
+        granularity,
+        store=ACTIVATION_STORE,
+        chunk_size=ACTIVATION_CHUNK_SIZE,
+        dtype=ACTIVATION_STORE_DTYPE,
+    )
 
-        mean_gradients = torch.stack(gradients).abs().squeeze().mean(0)
-        labels = {k: list(v.keys()) for k, v in topk_words.items()}
+    activations = stored_activations.get(inputs, store_fields, include_predicted_classes=True)
 
-        html_path = output_root / f"{method_name}.html"
-        plot_concepts(
-            classes_names=classes_names,
-            concepts_importances=mean_gradients,
-            concepts_labels=labels,
-            top_k=TOP_K,
-            save_path=str(html_path),
-        )
+    # Concepts are labelled with the unique words of the dataset. Neither the
+    # words (cached in vocabulary_cache/, see vocabulary_cache.py) nor their
+    # activations depend on the concept method, so they are computed once
+    # here and each method only encodes them.
+    unique_words_kwargs = {
+        "count_min_threshold": max(1, round(len(inputs) * 0.002)),
+        "lemmatize": True,
+        "words_to_ignore": [],
+    }
+    words = unique_words(inputs, **unique_words_kwargs)
+    word_activations = stored_activations.get(
+        words, {**store_fields, "unique_words": unique_words_kwargs}
+    )
+    # When both come from the store, nnsight has not loaded the weights yet,
+    # and the gradient pass does not load them itself.
+    if not model_with_split_points.dispatched:
+        model_with_split_points.dispatch()
+
+    def get_activation_gradients() -> torch.Tensor:
+        def compute(chunk: list[str]) -> dict[str, torch.Tensor]:
+            gradients = activation_output_gradients(
+                model_with_split_points, chunk, granularity, batch_size=gradient_batch_size
+            )
+            return {"output_gradients": gradients}
+
+        # Logit gradients span several orders of magnitude and the small ones
+        # underflow in half precision: they are stored in float32 whatever
+        # ACTIVATION_STORE_DTYPE is.
+        fields = {**store_fields, "output_gradients": True}
+        return stored_activations.load_or_compute(
+            inputs, fields, compute, dtype=torch.float32
+        )["output_gradients"]
+
+    activation_gradients = None
+    comparisons = []
 
-        code_path = html_path.with_suffix(".py")
-        code_path.write_text(
-            render_code_snippet(
-                explainer_cls=explainer_cls,
-                model_hf_id=config["hf_model_id"],
-                dataset_hf_id=config["hf_dataset_id"],
-                classes_names=classes_names,
-                split_points=split_points,
-                nb_concepts=NB_CONCEPTS,
-                top_k=TOP_K,
-            ),
-            encoding="utf-8",
+    output_root.mkdir(parents=True, exist_ok=True)
+
+    # Every explainer is built, and loaded from the cache when possible, up
+    # front; the remaining fits are scheduled together and each method is
+    # interpreted and rendered, in METHODS order, as soon as its fit is done.
+    explainers = {}
+    cache_fields = {}
+    fit_jobs = []
+    for method_name, explainer_cls in METHODS.items():
+        if args.verify_gradients and method_name not in LINEAR_DECODER_METHODS:
+            continue
+        init_parameters = init_parameters_of(method_name, config)
+        fit_parameters = config["fit_parameters"].get(method_name, {})
+        out_of_core = OUT_OF_CORE_SAE and method_name in SAE_METHODS
+        solver = (
+            DECOMPOSITION_SOLVER if method_name in DECOMPOSITION_METHODS else "default"
         )
-        del (
-            concept_explainer,
-            topk_inputs_method,
-            topk_words,
-            gradients,
-            mean_gradients,
-            labels,
+        if MINIBATCH_ICA and method_name == "ica":
+            solver = "minibatch"
+        if method_name in config["unfitted_methods"]:
+            concept_explainer = explainer_cls(model_with_split_points)
+        else:
+            concept_explainer = explainer_cls(
+                model_with_split_points, device=device, **init_parameters
+            )
+        explainers[method_name] = concept_explainer
+        if concept_explainer.is_fitted:
+            continue
+        if EXPLAINER_CACHE:
+            cache_fields[method_name] = explainer_fields(
+                concept_explainer,
+                activations[concept_explainer.split_point],
+                store_fields,
+                init_parameters,
+                {**fit_parameters, "out_of_core": out_of_core, "solver": solver, "seed": SEED},
+            )
+            if not args.refit and load_into(concept_explainer, cache_fields[method_name]):
+                continue
+        fitter, fit_kwargs = fit_function(fit_parameters, out_of_core, solver)
+        fit_jobs.append(
+            FitJob(
+                method_name,
+                concept_explainer,
+                fitter,
+                fit_kwargs,
+                cost=FIT_COSTS.get(method_name, 1.0),
+                seed=SEED,
+            )
         )
 
+    split_point = model_with_split_points.split_points[0]
+    concurrent = CONCURRENT_FITS and device == "cpu" and not OUT_OF_CORE_SAE
+    workers = (FIT_WORKERS or default_workers(len(fit_jobs))) if concurrent else 1
+    with shared_activations_pool(activations[split_point], workers, FIT_THREADS) as pool:
+        schedule = FitSchedule(fit_jobs, activations[split_point], pool)
+        for method_name in list(explainers):
+            concept_explainer = explainers.pop(method_name)
+            shared = method_name in LINEAR_DECODER_METHODS and (
+                SHARED_OUTPUT_GRADIENTS or args.verify_gradients
+            )
+            if method_name in schedule:
+                concept_explainer = schedule.result(method_name)
+                if EXPLAINER_CACHE:
+                    save_concept_model(cache_fields[method_name], concept_explainer.concept_model)
+            # Semi-NMF encodes from random codes: the outputs should not depend
+            # on whether the fit above ran or was loaded.
+            torch.manual_seed(SEED)
+
+            # TopKInputs' labels, without its (words, concepts) matrix (see
+            # streaming_topk.py). One CLS_TOKEN row per word.
+            topk_words = topk_inputs(
+                concept_explainer,
+                word_activations[concept_explainer.split_point],
+                words,
+                k=TOPK_WORDS,
+            )
+
+            if gradient_batch_size is None:
+                # Gradient cost is dominated by the model, so the first fitted
+                # explainer is representative of all methods.
+                gradient_batch_size = resolve_batch_size(
+                    model_id,
+                    "concept_output_gradient",
+                    run=lambda size: concept_explainer.concept_output_gradient(
+                        inputs=probe_inputs,
+                        targets=None,
+                        activation_granularity=granularity,
+                        concepts_x_gradients=True,
+                        batch_size=size,
+                    ),
+                    default=GRADIENT_BATCH_SIZE,
+                    tune=TUNE_BATCH_SIZE,
+                )
+
+            def per_method_gradients() -> list[torch.Tensor]:
+                return concept_explainer.concept_output_gradient(
+                    inputs=inputs,
+                    targets=None,
+                    activation_granularity=granularity,
+                    concepts_x_gradients=True,
+                    batch_size=gradient_batch_size,
+                )
+
+            if shared and activation_gradients is None:
+                activation_gradients = get_activation_gradients()
+
+            if args.verify_gradients:
+                # (rows, classes, concepts); CLS_TOKEN gives one row per input.
+                gradients = project_concept_gradients(
+                    concept_explainer,
+                    activation_gradients,
+                    activations[concept_explainer.split_point],
+                )
+                comparisons.append(
+                    compare_concept_gradients(method_name, gradients, per_method_gradients)
+                )
+                continue
+
+            if STREAMING_IMPORTANCES:
+                if shared:
+                    gradients = projected_gradient_chunks(
+                        concept_explainer,
+                        activation_gradients,
+                        activations[concept_explainer.split_point],
+                        chunk_size=gradient_batch_size,
+                    )
+                else:
+                    gradients = per_method_gradient_chunks(
+                        concept_explainer, inputs, granularity, batch_size=gradient_batch_size
+                    )
+                mean_gradients = concept_importances(gradients).mean
+            elif shared:
+                gradients = project_concept_gradients(
+                    concept_explainer,
+                    activation_gradients,
+                    activations[concept_explainer.split_point],
+                )
+                mean_gradients = gradients.abs().mean(0)
+            else:
+                gradients = per_method_gradients()
+                mean_gradients = torch.stack(gradients).abs().squeeze().mean(0)
+            labels = {k: list(v.keys()) for k, v in topk_words.items() if v}
+
+            plot_and_snippet_save(output_root, method_name, mean_gradients, labels, config)
+            if WRITE_RESULTS:
+                write_results(
+                    model_id,
+                    "concept",
+                    "general",
+                    method_name,
+                    [
+                        {
+                            "sample": DATASET,
+                            "importances": mean_gradients,
+                            "metadata": {"labels": topk_words},
+                        }
+                    ],
+                    {
+                        "hf_model_id": config["hf_model_id"],
+                        "classes_names": classes_names,
+                        "split_points": split_points,
+                        "nb_concepts": NB_CONCEPTS,
+                    },
+                )
+            del (
+                concept_explainer,
+                topk_words,
+                gradients,
+                mean_gradients,
+                labels,
+            )
+
+        schedule.print_summary()
+
+    if args.verify_gradients:
+        print_gradient_comparisons(comparisons)
+
 
 if __name__ == "__main__":
     main()
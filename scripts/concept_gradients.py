@@ -0,0 +1,235 @@
+"""Concept gradients for linear dictionaries from one shared activation gradient.
+
+When a concept method decodes with `decode(c) = c @ D (+ bias)`, the chain
+rule gives d output / d c = (d output / d A) @ D.T. The gradient with respect
+to the split-point activations A is computed once per dataset with a forward
+hook on the split-point module (it does not depend on the concept method),
+and each method then only needs one matrix product with its dictionary.
+
+The per-method path evaluates d output / d A at the reconstruction
+decode(encode(A)) rather than at A, so the two agree exactly only when the
+reconstruction is exact or the rest of the model is linear in A. Use
+`compare_concept_gradients` to measure the gap on a given model.
+"""
+
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+
+import torch
+from interpreto import ModelWithSplitPoints
+
+from running_stats import RunningAbsMean
+
+
+ActivationGranularity = ModelWithSplitPoints.activation_granularities
+
+
+def activation_output_gradients(
+    model_with_split_points,
+    inputs: list[str],
+    activation_granularity,
+    batch_size: int,
+) -> torch.Tensor:
+    """Gradients of every class logit with respect to the split-point CLS
+    activations, as a `(rows, classes, d)` tensor aligned with the rows of
+    `get_activations`."""
+    if activation_granularity is not ActivationGranularity.CLS_TOKEN:
+        raise ValueError(
+            f"Shared output gradients only support the CLS_TOKEN granularity, "
+            f"got {activation_granularity}."
+        )
+    if not model_with_split_points.dispatched:
+        model_with_split_points.dispatch()
+    # Plain autograd on the underlying transformers model: nothing is encoded
+    # or decoded, so the gradient is taken at the unmodified activations.
+    # ModelWithSplitPoints has no public accessor for it: `_model` is the
+    # module nnsight wraps, holding the real weights once dispatched.
+    model = model_with_split_points._model
+    # The CLS row is read at position 0: pad on the right. The tokenizer is
+    # shared with the rest of the run, so its padding side is restored below.
+    tokenizer = model_with_split_points.tokenizer
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "right"
+    split_module = model.get_submodule(model_with_split_points.split_points[0])
+
+    captured = {}
+
+    def keep_hidden_states(module, args, output):
+        hidden = output[0] if isinstance(output, tuple) else output
+        if not hidden.requires_grad:
+            # Frozen weights: start the graph at the split point.
+            hidden.requires_grad_()
+        captured["hidden"] = hidden
+        return output
+
+    handle = split_module.register_forward_hook(keep_hidden_states)
+    gradients = []
+    try:
+        with torch.enable_grad():
+            for start in range(0, len(inputs), batch_size):
+                encoded = tokenizer(
+                    inputs[start : start + batch_size],
+                    return_tensors="pt",
+                    padding=True,
+                    truncation=True,
+                ).to(model.device)
+                logits = model(**encoded).logits
+                n_classes = logits.shape[-1]
+                # A sample's logits only depend on its own activations, so one
+                # backward of the batch sum per class gives every row.
+                per_class = [
+                    torch.autograd.grad(
+                        logits[:, target].sum(),
+                        captured["hidden"],
+                        retain_graph=target < n_classes - 1,
+                    )[0][:, 0].cpu()
+                    for target in range(n_classes)
+                ]
+                gradients.append(torch.stack(per_class, dim=1))
+    finally:
+        handle.remove()
+        tokenizer.padding_side = padding_side
+    return torch.cat(gradients)
+
+
+def project_concept_gradients(
+    concept_explainer,
+    activation_gradients: torch.Tensor,
+    latent_activations: torch.Tensor,
+    concepts_x_gradients: bool = True,
+    normalization: bool = True,
+) -> torch.Tensor:
+    """`(rows, targets, concepts)` gradients of a linear-decoder method.
+
+    `latent_activations` are the split-point activations the gradients were
+    computed on; they are only encoded when `concepts_x_gradients` is set.
+    With `normalization`, the absolute gradients of each row and target sum to
+    1, as in `concept_output_gradient` (one granularity element per row).
+    """
+    dictionary = concept_explainer.get_dictionary().detach().float().cpu()  # (c, d)
+    gradients = activation_gradients.float() @ dictionary.T
+    if concepts_x_gradients:
+        with torch.no_grad():
+            concepts = concept_explainer.encode_activations(latent_activations.float()).float().cpu()
+        gradients *= concepts.unsqueeze(1)
+    if normalization:
+        gradients /= gradients.abs().sum(dim=-1, keepdim=True)
+    return gradients
+
+
+def gradient_rows(gradients: list[torch.Tensor]) -> torch.Tensor:
+    """`concept_output_gradient` output, n * (targets, g, concepts), as one
+    `(n * g, targets, concepts)` tensor of rows."""
+    return torch.cat(gradients, dim=1).transpose(0, 1).float()
+
+
+def per_method_gradient_chunks(
+    concept_explainer,
+    inputs: list[str],
+    activation_granularity,
+    batch_size: int,
+    targets: list[int] | None = None,
+) -> Iterator[torch.Tensor]:
+    """`concept_output_gradient` rows, one slice of `batch_size` inputs at a time."""
+    for start in range(0, len(inputs), batch_size):
+        gradients = concept_explainer.concept_output_gradient(
+            inputs=inputs[start : start + batch_size],
+            targets=targets,
+            activation_granularity=activation_granularity,
+            concepts_x_gradients=True,
+            batch_size=batch_size,
+        )
+        yield gradient_rows(gradients)
+
+
+def projected_gradient_chunks(
+    concept_explainer,
+    activation_gradients: torch.Tensor,
+    latent_activations: torch.Tensor,
+    chunk_size: int,
+) -> Iterator[torch.Tensor]:
+    """`project_concept_gradients` on successive row slices, so memory-mapped
+    activation gradients are never read in full."""
+    for start in range(0, activation_gradients.shape[0], chunk_size):
+        rows = slice(start, start + chunk_size)
+        yield project_concept_gradients(
+            concept_explainer, activation_gradients[rows], latent_activations[rows]
+        )
+
+
+def concept_importances(
+    gradient_chunks: Iterable[torch.Tensor], track_variance: bool = False
+) -> RunningAbsMean:
+    """Reduce `(rows, targets, concepts)` gradient chunks to the mean absolute
+    gradient per target and concept, holding one chunk at a time."""
+    importances = RunningAbsMean(track_variance=track_variance)
+    for gradients in gradient_chunks:
+        importances.update(gradients)
+    return importances
+
+
+@dataclass
+class GradientComparison:
+    method_name: str
+    max_abs_difference: float = float("nan")
+    relative_difference: float = float("nan")
+    cosine_similarity: float = float("nan")
+    topk_overlap: float = float("nan")
+    # Set when the per-method path cannot run, e.g. SparsePCA decodes through
+    # scikit-learn and has no differentiable decoder.
+    error: str | None = None
+
+
+def compare_concept_gradients(
+    method_name: str,
+    projected: torch.Tensor,
+    per_method: Callable[[], list[torch.Tensor]],
+    topk: int = 10,
+) -> GradientComparison:
+    """Compare projected gradients with `concept_output_gradient`.
+
+    Besides the raw differences, reports two scale-free agreements: the
+    worst per-class cosine similarity of the gradients, and the overlap of
+    the `topk` most important concepts per class in the plotted
+    `abs().mean(0)` importances.
+    """
+    try:
+        reference_gradients = per_method()
+    except ValueError as error:
+        return GradientComparison(method_name, error=str(error))
+    reference = gradient_rows(reference_gradients)
+    difference = (projected - reference).abs()
+    relative = difference.norm() / reference.norm().clamp_min(1e-12)
+    # (rows, classes, concepts) -> one flattened vector per class.
+    cosine = torch.nn.functional.cosine_similarity(
+        projected.transpose(0, 1).flatten(1), reference.transpose(0, 1).flatten(1), dim=-1
+    )
+
+    projected_importance = projected.abs().mean(0)
+    reference_importance = reference.abs().mean(0)
+    k = min(topk, projected.shape[-1])
+    overlaps = [
+        len(set(a.topk(k).indices.tolist()) & set(b.topk(k).indices.tolist())) / k
+        for a, b in zip(projected_importance, reference_importance, strict=True)
+    ]
+    return GradientComparison(
+        method_name,
+        difference.max().item(),
+        relative.item(),
+        cosine.min().item(),
+        min(overlaps),
+    )
+
+
+def print_gradient_comparisons(comparisons: list[GradientComparison]) -> None:
+    for comparison in comparisons:
+        if comparison.error is not None:
+            print(f"{comparison.method_name}: no per-method reference ({comparison.error})")
+            continue
+        print(
+            f"{comparison.method_name}: max abs difference "
+            f"{comparison.max_abs_difference:.2e}, relative "
+            f"{comparison.relative_difference:.2e}, cosine "
+            f"{comparison.cosine_similarity:.4f}, top-k overlap "
+            f"{comparison.topk_overlap:.2f}"
+        )
@@ -0,0 +1,111 @@
+"""Model configurations and activation loading shared by the classification
+concept pipelines (classification_concepts.py and
+classification_class_wise_concepts.py).
+
+`StoredActivations` computes the split-point activations of a list of texts
+chunk by chunk, or memory-maps them from activation_store/ when an earlier
+run stored them (see activation_store.py).
+"""
+
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import torch
+
+from activation_store import load_or_compute_activations
+
+
+MODEL_CONFIGS = {
+    "clf:emotion:bert": {
+        "hf_model_id": "nateraw/bert-base-uncased-emotion",
+        "hf_dataset_id": "dair-ai/emotion",
+        "classes_names": [
+            "sadness",
+            "joy",
+            "love",
+            "anger",
+            "fear",
+            "surprise",
+        ],
+        "split_points": 11,
+    },
+    "clf:imdb:distilbert": {
+        "hf_model_id": "lvwerra/distilbert-imdb",
+        "hf_dataset_id": "stanfordnlp/imdb",
+        "classes_names": [
+            "negative",
+            "positive",
+        ],
+        "split_points": 5,
+    },
+    "clf:ag-news:roberta": {
+        "hf_model_id": "arman1o1/roberta_ag_news_model",
+        "hf_dataset_id": "fancyzhx/ag_news",
+        "classes_names": [
+            "World",
+            "Sports",
+            "Business",
+            "Sci/Tech",
+        ],
+        "split_points": 11,
+    },
+}
+
+
+def dataset_fields(
+    config: dict, model_with_split_points, granularity, split: str, seed: int, count: int
+) -> dict:
+    """Activation store key of the first `count` inputs of the shuffled
+    dataset split."""
+    return {
+        "model": config["hf_model_id"],
+        "split_points": model_with_split_points.split_points,
+        "granularity": granularity.name,
+        "dataset": config["hf_dataset_id"],
+        "split": split,
+        "seed": seed,
+        "count": count,
+    }
+
+
+@dataclass
+class StoredActivations:
+    """Split-point activations of `model_with_split_points` at `granularity`,
+    kept in the activation store when `store` is set."""
+
+    model_with_split_points: object
+    granularity: object
+    store: bool = True
+    chunk_size: int = 250
+    dtype: torch.dtype = torch.float32
+
+    def load_or_compute(
+        self,
+        texts: list,
+        fields: dict,
+        compute: Callable[[list], dict[str, torch.Tensor]],
+        dtype: torch.dtype | None = None,
+    ) -> dict[str, torch.Tensor]:
+        """`compute(texts)`, or its stored entry under `fields`, stored in
+        `dtype` (by default the store's)."""
+        if not self.store:
+            return compute(texts)
+        return load_or_compute_activations(
+            fields=fields,
+            inputs=texts,
+            compute=compute,
+            chunk_size=self.chunk_size,
+            dtype=self.dtype if dtype is None else dtype,
+        )
+
+    def get(
+        self, texts: list[str], fields: dict, include_predicted_classes: bool = False
+    ) -> dict[str, torch.Tensor]:
+        def compute(chunk: list[str]) -> dict[str, torch.Tensor]:
+            return self.model_with_split_points.get_activations(
+                inputs=chunk,  # type: ignore
+                activation_granularity=self.granularity,
+                include_predicted_classes=include_predicted_classes,
+            )
+
+        return self.load_or_compute(texts, fields, compute)
@@ -0,0 +1,114 @@
+"""Disk cache of fitted concept models, reused across runs.
+
+Each entry is a directory under explainer_cache/ named after a hash of what
+determines the fit: the activations it was fitted on, the concept method,
+its init and fit parameters, the split point and the interpreto version.
+The concept model is pickled with torch.save and meta.json is written last,
+so an interrupted save is simply refitted.
+
+The activations are fingerprinted by their store key fields plus their
+shape, dtype and a hash of evenly spaced rows, so that a changed store entry
+or in-memory tensor does not silently reuse a stale fit.
+"""
+
+import hashlib
+import json
+import shutil
+from collections.abc import Callable
+from importlib.metadata import version
+from pathlib import Path
+
+import torch
+
+from activation_store import activation_key
+
+
+ROOT = Path(__file__).resolve().parents[1]
+CACHE_ROOT = ROOT / "explainer_cache"
+
+# Rows hashed by activations_fingerprint.
+FINGERPRINT_ROWS = 1024
+
+
+def activations_fingerprint(activations: torch.Tensor) -> str:
+    step = max(1, activations.shape[0] // FINGERPRINT_ROWS)
+    sample = activations[::step][:FINGERPRINT_ROWS].contiguous()
+    digest = hashlib.sha256(f"{tuple(activations.shape)}|{activations.dtype}".encode())
+    digest.update(sample.flatten().view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def explainer_fields(
+    concept_explainer,
+    activations: torch.Tensor,
+    activation_fields: dict,
+    init_kwargs: dict,
+    fit_kwargs: dict,
+) -> dict:
+    explainer_cls = type(concept_explainer)
+    return {
+        "activations": activation_fields,
+        "activations_fingerprint": activations_fingerprint(activations),
+        "method": f"{explainer_cls.__module__}.{explainer_cls.__qualname__}",
+        "split_point": concept_explainer.split_point,
+        "init": init_kwargs,
+        "fit": fit_kwargs,
+        "interpreto": version("interpreto"),
+    }
+
+
+def _entry_dir(fields: dict, root: Path) -> Path:
+    return Path(root) / activation_key(**fields)
+
+
+def load_concept_model(fields: dict, root: Path = CACHE_ROOT):
+    entry = _entry_dir(fields, root)
+    if not (entry / "meta.json").exists():
+        return None
+    # Our own pickles: the sklearn-backed concept models are not plain tensors.
+    return torch.load(entry / "concept_model.pt", map_location="cpu", weights_only=False)
+
+
+def save_concept_model(fields: dict, concept_model, root: Path = CACHE_ROOT) -> None:
+    entry = _entry_dir(fields, root)
+    if entry.exists():
+        shutil.rmtree(entry)
+    entry.mkdir(parents=True)
+    torch.save(concept_model, entry / "concept_model.pt")
+    (entry / "meta.json").write_text(
+        json.dumps({"fields": fields}, indent=2, sort_keys=True, default=str), encoding="utf-8"
+    )
+
+
+def load_into(concept_explainer, fields: dict, root: Path = CACHE_ROOT) -> bool:
+    """Load the concept model cached for `fields` into `concept_explainer`.
+    Returns whether there was one."""
+    concept_model = load_concept_model(fields, root)
+    if concept_model is None:
+        return False
+    device = next(concept_explainer.concept_model.parameters(), torch.empty(0)).device
+    concept_explainer._concept_model = concept_model.to(device)
+    print(f"Loaded fitted {type(concept_explainer).__name__} from {_entry_dir(fields, root)}")
+    return True
+
+
+def fit_or_load(
+    concept_explainer,
+    fields: dict,
+    fit: Callable[[], object],
+    refit: bool = False,
+    root: Path = CACHE_ROOT,
+) -> bool:
+    """Load the concept model cached for `fields` into `concept_explainer`,
+    or call `fit()` and cache the result. Returns whether it was loaded.
+
+    Explainers that are fitted on construction (NeuronsAsConcepts) are left
+    alone.
+    """
+    if concept_explainer.is_fitted:
+        return False
+    if not refit and load_into(concept_explainer, fields, root):
+        return True
+    fit()
+    save_concept_model(fields, concept_explainer.concept_model, root)
+    return False
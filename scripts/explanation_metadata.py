@@ -0,0 +1,24 @@
+"""Read and write the JSON metadata stored next to each explanation HTML file."""
+
+import json
+from pathlib import Path
+
+
+def metadata_path(html_path: Path) -> Path:
+    return Path(html_path).with_suffix(".json")
+
+
+def read_metadata(html_path: Path) -> dict:
+    path = metadata_path(html_path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_metadata(html_path: Path, **entries) -> None:
+    """Merge `entries` into the metadata file of `html_path`."""
+    metadata = read_metadata(html_path)
+    metadata.update(entries)
+    metadata_path(html_path).write_text(
+        json.dumps(metadata, indent=2, sort_keys=True), encoding="utf-8"
+    )
@@ -0,0 +1,190 @@
+"""Fit concept explainers concurrently on one activation matrix.
+
+The activations are copied once into shared memory and mapped by every
+worker process, instead of being pickled with each job. Each job sends an
+explainer without its `model_with_split_points` (fitting only needs the
+activations) and gets the fitted explainer back.
+
+Jobs are submitted longest first, by their estimated cost: the pool hands
+them to workers as they free up, so long SAE fits start right away and the
+quick linear fits fill in around them (longest-processing-time scheduling).
+Results are collected by name, in whatever order the caller asks for them,
+so outputs are written in the same order as with serial fits.
+"""
+
+import copy
+import importlib
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+import torch.multiprocessing
+from threadpoolctl import threadpool_limits
+
+
+def fit_explainer(explainer, activations: torch.Tensor, **fit_kwargs) -> None:
+    # The in-memory fits need float32: half-precision activations are upcast
+    # here, for the duration of the fit only.
+    explainer.fit(activations.float(), **fit_kwargs)
+
+
+@dataclass
+class FitJob:
+    name: str
+    explainer: object
+    # Module-level function called as fitter(explainer, activations, **fit_kwargs),
+    # so that it can be sent to a worker process.
+    fitter: Callable = fit_explainer
+    fit_kwargs: dict | None = None
+    # Relative fit time, only used to order the jobs.
+    cost: float = 1.0
+    seed: int = 0
+
+
+def seeded_fit(
+    explainer, fitter: Callable, activations: torch.Tensor, fit_kwargs: dict, seed: int
+):
+    # Seeded per job, so serial and concurrent fits start from the same state.
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    start = time.perf_counter()
+    fitter(explainer, activations, **fit_kwargs)
+    return explainer, time.perf_counter() - start
+
+
+_worker_activations: torch.Tensor | None = None
+
+
+def worker_activations() -> torch.Tensor:
+    """The shared activations, in a process started by `shared_activations_pool`."""
+    return _worker_activations  # type: ignore
+
+
+def _init_worker(activations: torch.Tensor, threads: int) -> None:
+    global _worker_activations
+    _worker_activations = activations
+    # Split the thread budget between workers instead of oversubscribing it.
+    torch.set_num_threads(threads)
+    threadpool_limits(threads)
+    # Paid at start-up rather than when unpickling the first explainer.
+    importlib.import_module("interpreto.concepts")
+
+
+def _ready() -> None:
+    pass
+
+
+def _fit_in_worker(explainer, fitter: Callable, fit_kwargs: dict, seed: int):
+    return seeded_fit(explainer, fitter, _worker_activations, fit_kwargs, seed)  # type: ignore
+
+
+@contextmanager
+def shared_activations_pool(
+    activations: torch.Tensor, workers: int, thread_budget: int | None = None
+):
+    """Worker processes sharing `activations` (moved to shared memory if it
+    is not there already) and `thread_budget` threads between them, or None
+    if `workers <= 1`."""
+    if workers <= 1:
+        yield None
+        return
+    if not activations.is_shared():
+        activations = torch.empty_like(activations).share_memory_().copy_(activations)
+    threads = max(1, (thread_budget or torch.get_num_threads()) // workers)
+    context = torch.multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(activations, threads),
+    ) as pool:
+        # Start every worker now, so that fit timings exclude the start-up.
+        start = time.perf_counter()
+        for future in [pool.submit(_ready) for _ in range(workers)]:
+            future.result()
+        print(
+            f"Started {workers} fitting processes ({threads} threads each) "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+        yield pool
+
+
+def without_model(explainer):
+    # A shallow copy, so that the caller's explainer keeps its model while the
+    # copy is pickled in the pool's background thread.
+    detached = copy.copy(explainer)
+    detached.model_with_split_points = None
+    return detached
+
+
+def default_workers(n_jobs: int) -> int:
+    return max(1, min(n_jobs, os.cpu_count() or 1))
+
+
+class FitSchedule:
+    """Fits `jobs` on `activations`, concurrently in `pool` if given.
+
+    Without a pool, each job is fitted serially when its result is first
+    asked for.
+    """
+
+    def __init__(
+        self,
+        jobs: list[FitJob],
+        activations: torch.Tensor,
+        pool: ProcessPoolExecutor | None = None,
+    ):
+        self.jobs = {job.name: job for job in jobs}
+        self.activations = activations
+        self.seconds: dict[str, float] = {}
+        self._futures = {}
+        self._concurrent = pool is not None
+        self._start = time.perf_counter()
+        self._done = self._start
+        if pool is None:
+            return
+        for job in sorted(jobs, key=lambda job: job.cost, reverse=True):
+            future = pool.submit(
+                _fit_in_worker,
+                without_model(job.explainer),
+                job.fitter,
+                job.fit_kwargs or {},
+                job.seed,
+            )
+            future.add_done_callback(self._record_done)
+            self._futures[job.name] = future
+
+    def _record_done(self, _future) -> None:
+        self._done = max(self._done, time.perf_counter())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.jobs
+
+    def result(self, name: str):
+        """The fitted explainer of job `name`, which is then dropped from the
+        schedule."""
+        job = self.jobs.pop(name)
+        future = self._futures.pop(name, None)
+        if future is not None:
+            explainer, seconds = future.result()
+            explainer.model_with_split_points = job.explainer.model_with_split_points
+        else:
+            explainer, seconds = seeded_fit(
+                job.explainer, job.fitter, self.activations, job.fit_kwargs or {}, job.seed
+            )
+        self.seconds[name] = seconds
+        print(f"{name}: fitted in {seconds:.1f}s")
+        return explainer
+
+    def print_summary(self) -> None:
+        if not self.seconds:
+            return
+        summary = f"Fitted {len(self.seconds)} explainers: {sum(self.seconds.values()):.1f}s of fitting"
+        if self._concurrent:
+            summary += f", all done {self._done - self._start:.1f}s after the first started"
+        print(summary)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """Generate generation attribution HTML files and minimal .py snippets."""
 
+import argparse
 import os
+import sys
+import time
 from pathlib import Path
 
 import torch
@@ -21,6 +24,23 @@ from interpreto import (
     plot_attributions,
 )
 
+from activation_checkpointing import (
+    checkpointing_tradeoff,
+    disable_activation_checkpointing,
+    enable_activation_checkpointing,
+    print_checkpointing_report,
+)
+from adaptive_quadrature import explain_adaptive, print_quadrature_report
+from anytime_sampling import explain_anytime, print_stability_report
+from batch_tuning import resolve_batch_size, shortest_input
+from causal_lm_scoring import enable_padded_batching, verify_padded_batching
+from explanation_metadata import write_metadata
+from memory_usage import PeakRSSMonitor, format_bytes
+from model_loading import load_causal_lm, print_memory_report
+from render_only import render_in_parallel, stored_attribution, stored_methods
+from results_store import attribution_record, read_results, write_results
+from snippets import generation_attribution_snippet
+
 # ----------------------------
 # Configuration (edit these)
 # ----------------------------
@@ -48,15 +68,53 @@ SAMPLES = [
     },
 ]
 SEED = 0
-BATCH_SIZE = 1
+
+# Models loaded in bf16 from memory-mapped safetensors shards (see
+# model_loading.py), so that 7-8B models fit on a 32 GB CPU host. Set
+# OFFLOAD_FOLDER to also page layers in from disk, keeping at most
+# MAX_CPU_MEMORY (e.g. "12GiB") of them resident.
+LOW_MEMORY_MODELS = ("gen:llama3.1-8b", "gen:mistral7b-instruct")
+OFFLOAD_FOLDER = None
+MAX_CPU_MEMORY = None
+
+# Fallback when no tuned batch size is cached for this host (see batch_tuning.py).
+BATCH_SIZE = 8
+TUNE_BATCH_SIZE = True
+# Pack perturbations of different samples into the same left-padded forward
+# pass, with per-row position ids (see causal_lm_scoring.py). Without it,
+# keep BATCH_SIZE = 1: interpreto pads mixed samples without position ids.
+PADDED_BATCHING = True
+# Token-masking methods (Occlusion, Lime, KernelShap, Sobol) reuse the KV cache
+# of the unperturbed prefix and only run the suffix after the first mask.
+PREFIX_SHARING = True
+# Recompute each decoder layer's activations during backward instead of
+# keeping them (see activation_checkpointing.py). Memory no longer grows with
+# the number of layers, which makes long documents fit, for about one extra
+# forward pass per gradient. Run with --checkpointing-report to measure both.
+ACTIVATION_CHECKPOINTING = False
+CHECKPOINTING_METHODS = (
+    "gradient_shap",
+    "integrated_gradients",
+    "saliency",
+    "smoothgrad",
+    "squared_grad",
+    "vargrad",
+)
 
 OUTPUT_ROOT = Path("explanations")
 
+# Also keep the raw attributions, tokens and targets of every method in
+# results/ (see results_store.py), for metrics and re-rendering.
+WRITE_RESULTS = True
+# Processes re-rendering the stored tables with --render-only; None uses one
+# per table, up to the number of cores.
+RENDER_WORKERS = None
+
 METHODS = {
-    # "kernel_shap": KernelShap,
+    "kernel_shap": KernelShap,
     "lime": Lime,
     "occlusion": Occlusion,
-    # "sobol": Sobol,
+    "sobol": Sobol,
     "gradient_shap": GradientShap,
     "integrated_gradients": IntegratedGradients,
     "saliency": Saliency,
@@ -70,74 +128,275 @@ ADDITIONAL_PARAMETERS = {
     "sobol": {"n_token_perturbations": 4},
 }
 
+# CPU seconds allowed per method for all SAMPLES. The measured CPU and wall
+# time are printed and, with WRITE_RESULTS, stored in results/ rather than next
+# to the HTML, since they depend on the host. Exceeding the budget only warns.
+CPU_TIME_BUDGET = 900
+
+# Adaptive Gauss-Legendre quadrature for path-integral methods: steps are added
+# per sample until the completeness gap falls under QUADRATURE_TOLERANCE. The
+# chosen steps and the remaining errors are written to <method>.json next to
+# the HTML.
+ADAPTIVE_QUADRATURE = False
+ADAPTIVE_METHODS = ("gradient_shap", "integrated_gradients")
+QUADRATURE_TOLERANCE = 0.05
+QUADRATURE_MAX_STEPS = 128
+QUADRATURE_ORDER = 4
+
+# Anytime mode for sampling-based methods: perturbations are drawn in rounds
+# until the attribution ranking is stable or the time budget (seconds) is spent.
+# The achieved stability is written to <method>.json next to the HTML.
+ANYTIME_SAMPLING = False
+ANYTIME_METHODS = ("kernel_shap", "lime", "sobol")
+STABILITY_TOPK = 5
+STABILITY_MIN_OVERLAP = 0.8
+STABILITY_MIN_CORRELATION = 0.9
+STABILITY_PATIENCE = 2
+ANYTIME_MAX_ROUNDS = 10
+ANYTIME_TIME_BUDGET = 900
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Generate generation attribution HTML files and snippets."
+    )
+    parser.add_argument(
+        "--verify-batching",
+        action="store_true",
+        help=(
+            "Check that padded multi-sample batching matches the unbatched "
+            "path for every method, then exit without writing files."
+        ),
+    )
+    parser.add_argument(
+        "--checkpointing-report",
+        action="store_true",
+        help=(
+            "Compare memory and time of the gradient methods with and without "
+            "activation checkpointing, then exit without writing files."
+        ),
+    )
+    parser.add_argument(
+        "--render-only",
+        action="store_true",
+        help="Rebuild the HTML files and snippets from results/ without loading the model.",
+    )
+    return parser.parse_args()
+
+
+def build_explainer(model, tokenizer, method_name: str, batch_size: int):
+    explainer = METHODS[method_name](
+        model,
+        tokenizer,
+        batch_size=batch_size,
+        **ADDITIONAL_PARAMETERS.get(method_name, {}),
+    )
+    if PADDED_BATCHING:
+        enable_padded_batching(explainer, prefix_sharing=PREFIX_SHARING)
+    return explainer
+
+
+def plot_and_snippet_save(output_root, i, attribution, method_name, ipt, tgt, hf_model_id):
+    sample_dir = output_root / f"sample-{i:03d}"
+    sample_dir.mkdir(parents=True, exist_ok=True)
+    html_path = sample_dir / f"{method_name}.html"
+
+    plot_attributions(attribution, save_path=str(html_path))
+
+    code_path = html_path.with_suffix(".py")
+    code_path.write_text(
+        generation_attribution_snippet(
+            explainer_name=METHODS[method_name].__name__,
+            sample_text=ipt,
+            target_text=tgt,
+            model_hf_id=hf_model_id,
+        ),
+        encoding="utf-8",
+    )
+    return html_path
+
+
+def render_stored(output_root, method_name, hf_model_id):
+    """Re-render the HTML files and snippets of a stored results table."""
+    table = read_results(model_id, "attribution", "general", method_name)
+    for i in table.samples:
+        record = table.record(i)
+        plot_and_snippet_save(
+            output_root,
+            i,
+            stored_attribution(record),
+            method_name,
+            record["metadata"]["input"],
+            record["metadata"]["target"],
+            hf_model_id,
+        )
+
 
 def main() -> None:
+    args = parse_args()
     print(f"\n{model_id=}")
     hf_model_id = HF_MODEL_IDS[model_id]
+    output_root = OUTPUT_ROOT / model_id / "attribution" / "general"
+
+    if args.render_only:
+        jobs = [
+            {"output_root": output_root, "method_name": method_name, "hf_model_id": hf_model_id}
+            for method_name in stored_methods(model_id, "attribution", "general", METHODS)
+        ]
+        render_in_parallel(render_stored, jobs, RENDER_WORKERS)
+        sys.exit(0)
+
     torch.manual_seed(SEED)
 
     batch_inputs = [sample["input"] for sample in SAMPLES]
     batch_targets = [sample["target"] for sample in SAMPLES]
 
     tokenizer = AutoTokenizer.from_pretrained(hf_model_id, use_fast=True)
-    model = AutoModelForCausalLM.from_pretrained(
-        hf_model_id, token=os.environ.get("HF_TOKEN")
-    )
+    if model_id in LOW_MEMORY_MODELS:
+        model, peak_rss = load_causal_lm(
+            hf_model_id,
+            offload_folder=OFFLOAD_FOLDER,
+            max_cpu_memory=MAX_CPU_MEMORY,
+            token=os.environ.get("HF_TOKEN"),
+        )
+        print_memory_report(f"Loaded {hf_model_id}", peak_rss)
+    else:
+        model = AutoModelForCausalLM.from_pretrained(
+            hf_model_id, token=os.environ.get("HF_TOKEN")
+        )
     model.eval()
 
-    output_root = OUTPUT_ROOT / model_id / "attribution" / "general"
-    output_root.mkdir(parents=True, exist_ok=True)
-
-    for method_name, explainer_cls in METHODS.items():
-        print(f"\n{method_name=}")
-        explainer = explainer_cls(
+    if args.verify_batching:
+        ok = verify_padded_batching(
             model,
             tokenizer,
-            batch_size=BATCH_SIZE,
-            **ADDITIONAL_PARAMETERS.get(method_name, {}),
+            explainers={
+                name: (cls, ADDITIONAL_PARAMETERS.get(name, {}))
+                for name, cls in METHODS.items()
+            },
+            inputs=batch_inputs,
+            targets=batch_targets,
+            batch_size=max(BATCH_SIZE, 2),
+            prefix_sharing=PREFIX_SHARING,
+            seed=SEED,
         )
-        attributions = explainer(model_inputs=batch_inputs, targets=batch_targets)
+        sys.exit(0 if ok else 1)
 
-        for i, (ipt, tgt, attribution) in enumerate(
-            zip(batch_inputs, batch_targets, attributions)
-        ):
-            sample_dir = output_root / f"sample-{i:03d}"
-            sample_dir.mkdir(parents=True, exist_ok=True)
-            html_path = sample_dir / f"{method_name}.html"
-
-            plot_attributions(attribution, save_path=str(html_path))
-
-            code_path = html_path.with_suffix(".py")
-            code_path.write_text(
-                render_code_snippet(
-                    explainer_cls=explainer_cls,
-                    sample_text=ipt,
-                    target_text=tgt,
-                    model_hf_id=hf_model_id,
-                ),
-                encoding="utf-8",
+    if args.checkpointing_report:
+        tradeoffs = []
+        for method_name in CHECKPOINTING_METHODS:
+            explainer = build_explainer(model, tokenizer, method_name, BATCH_SIZE)
+            tradeoffs.append(
+                checkpointing_tradeoff(
+                    model,
+                    method_name,
+                    run=lambda: explainer(model_inputs=batch_inputs, targets=batch_targets),
+                    seed=SEED,
+                )
             )
+        print_checkpointing_report(tradeoffs)
+        sys.exit(0)
 
+    output_root.mkdir(parents=True, exist_ok=True)
+    # The batch size probes explain the shortest sample only.
+    probe = shortest_input(batch_inputs)
 
-def render_code_snippet(
-    explainer_cls: type,
-    sample_text: str,
-    target_text: str,
-    model_hf_id: str,
-) -> str:
-    return f"""from transformers import AutoTokenizer, AutoModelForCausalLM
-from interpreto import {explainer_cls.__name__}, plot_attributions
+    for method_name in METHODS:
+        print(f"\n{method_name=}")
+        checkpointed = ACTIVATION_CHECKPOINTING and method_name in CHECKPOINTING_METHODS
+        if checkpointed:
+            enable_activation_checkpointing(model)
+        else:
+            disable_activation_checkpointing(model)
+        # Checkpointing changes the memory per sample, so it is tuned separately.
+        batch_size = resolve_batch_size(
+            model_id,
+            f"{method_name}+checkpointing" if checkpointed else method_name,
+            run=lambda size: build_explainer(model, tokenizer, method_name, size)(
+                model_inputs=[batch_inputs[probe]], targets=[batch_targets[probe]]
+            ),
+            default=BATCH_SIZE,
+            tune=TUNE_BATCH_SIZE,
+        )
+        explainer = build_explainer(model, tokenizer, method_name, batch_size)
+        stability = [None] * len(batch_inputs)
+        reports = [None] * len(batch_inputs)
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        with PeakRSSMonitor() as memory:
+            if ADAPTIVE_QUADRATURE and method_name in ADAPTIVE_METHODS:
+                attributions, reports = explain_adaptive(
+                    explainer,
+                    batch_inputs,
+                    batch_targets,
+                    tolerance=QUADRATURE_TOLERANCE,
+                    max_steps=QUADRATURE_MAX_STEPS,
+                    order=QUADRATURE_ORDER,
+                )
+                print_quadrature_report(method_name, reports)
+            elif ANYTIME_SAMPLING and method_name in ANYTIME_METHODS:
+                attributions, stability = explain_anytime(
+                    explainer,
+                    batch_inputs,
+                    batch_targets,
+                    topk=STABILITY_TOPK,
+                    min_overlap=STABILITY_MIN_OVERLAP,
+                    min_correlation=STABILITY_MIN_CORRELATION,
+                    patience=STABILITY_PATIENCE,
+                    max_rounds=ANYTIME_MAX_ROUNDS,
+                    time_budget=ANYTIME_TIME_BUDGET,
+                )
+                print_stability_report(method_name, stability)
+            else:
+                attributions = explainer(model_inputs=batch_inputs, targets=batch_targets)
 
-tokenizer = AutoTokenizer.from_pretrained({model_hf_id!r}, use_fast=True)
-model = AutoModelForCausalLM.from_pretrained({model_hf_id!r})
+        timing = {
+            "cpu_seconds": round(time.process_time() - cpu_start, 2),
+            "wall_seconds": round(time.perf_counter() - wall_start, 2),
+            "cpu_budget_seconds": CPU_TIME_BUDGET,
+            "batch_size": batch_size,
+            "samples": len(batch_inputs),
+            "peak_rss_gib": round(memory.peak / 2**30, 2),
+            "activation_checkpointing": checkpointed,
+        }
+        print(
+            f"{method_name}: {timing['cpu_seconds']:.1f}s CPU, "
+            f"{timing['wall_seconds']:.1f}s wall for {len(batch_inputs)} samples, "
+            f"peak RSS {format_bytes(memory.peak)}"
+        )
+        if timing["cpu_seconds"] > CPU_TIME_BUDGET:
+            print(f"WARNING: {method_name} exceeded the {CPU_TIME_BUDGET}s CPU budget")
 
-explainer = {explainer_cls.__name__}(model, tokenizer)
-attributions = explainer(
-    model_inputs={sample_text!r},
-    targets={target_text!r}
-)
-plot_attributions(attributions[0])
-"""
+        records = []
+        for i, (ipt, tgt, attribution, sample_stability, report) in enumerate(
+            zip(batch_inputs, batch_targets, attributions, stability, reports)
+        ):
+            html_path = plot_and_snippet_save(
+                output_root, i, attribution, method_name, ipt, tgt, hf_model_id
+            )
+            if sample_stability is not None:
+                write_metadata(html_path, stability=sample_stability.to_dict())
+            if report is not None:
+                write_metadata(html_path, quadrature=report.to_dict())
+            records.append(
+                attribution_record(
+                    i,
+                    attribution,
+                    input=ipt,
+                    target=tgt,
+                    stability=None if sample_stability is None else sample_stability.to_dict(),
+                    quadrature=None if report is None else report.to_dict(),
+                )
+            )
+
+        if WRITE_RESULTS:
+            write_results(
+                model_id,
+                "attribution",
+                "general",
+                method_name,
+                records,
+                {"hf_model_id": hf_model_id, "timing": timing},
+            )
 
 
 if __name__ == "__main__":
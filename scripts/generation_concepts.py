@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+"""Generate local generation concept HTML files and minimal .py snippets.
+
+The concept methods are fitted on token activations of Wikipedia articles.
+Those are streamed through the model in token-budgeted batches and only a
+sample of tokens per article is kept, in an activation_store/ entry (see
+token_streaming.py). The fits read that entry without loading it: SAEs from
+shuffled blocks (out_of_core_sae.py), PCA and SVD in one Gram pass
+(streaming_decompositions.py) and ICA by minibatches (minibatch_ica.py).
+Each fitted method is then rendered on every sample sentence.
+"""
+
+import argparse
+from pathlib import Path
+
+import torch
+from datasets import load_dataset
+from transformers import AutoModelForCausalLM
+
+from interpreto import ModelWithSplitPoints, plot_concepts
+from interpreto.concepts import (
+    BatchTopKSAEConcepts,
+    ICAConcepts,
+    MpSAEConcepts,
+    NeuronsAsConcepts,
+    PCAConcepts,
+    SemiNMFConcepts,
+    SVDConcepts,
+    VanillaSAEConcepts,
+)
+from interpreto.concepts.methods.overcomplete import DeadNeuronsReanimationLoss, MSELoss
+
+from activation_store import load_or_compute_activations
+from explainer_cache import explainer_fields, fit_or_load
+from fit_scheduler import fit_explainer
+from minibatch_ica import fit_ica
+from out_of_core_sae import fit_sae_out_of_core
+from render_only import render_in_parallel, stored_labels, stored_methods
+from results_store import read_results, write_results
+from snippets import python_source
+from streaming_decompositions import fit_decomposition
+from streaming_topk import topk_inputs
+from vocabulary_cache import split_words
+from token_streaming import stream_token_activations, truncate
+
+
+# ----------------------------
+# Configuration (edit these)
+# ----------------------------
+model_id = "gen:qwen3-0.6b"
+
+SAES_TRAIN_PARAMETERS = {
+    "criterion": DeadNeuronsReanimationLoss,
+    "optimizer_class": torch.optim.Adam,
+    "scheduler_class": torch.optim.lr_scheduler.CosineAnnealingLR,
+    "scheduler_kwargs": {"T_max": 20, "eta_min": 1e-6},
+    "lr": 1e-3,
+    "nb_epochs": 20,
+    "batch_size": 2048,
+    "monitoring": 0,
+}
+
+# Each model has the methods and settings of its published pages, which the
+# snippets are rendered from:
+# - "methods": the METHODS rendered for the model;
+# - "init_parameters" and "fit_parameters": per method, the keyword
+#   arguments added to (or overriding) nb_concepts=NB_CONCEPTS and device,
+#   and those of the fit (none for the default fit).
+MODEL_CONFIGS = {
+    "gen:gpt2": {
+        "hf_model_id": "gpt2",
+        "split_points": 8,
+        "batch_size": 8,
+        "methods": ("batch_top_k_sae", "mp_sae", "neurons_as_concepts", "vanilla_sae"),
+        "init_parameters": {},
+        "fit_parameters": {},
+    },
+    "gen:qwen3-0.6b": {
+        "hf_model_id": "Qwen/Qwen3-0.6B",
+        "split_points": 5,
+        "batch_size": 1,
+        "methods": (
+            "batch_top_k_sae",
+            "ica",
+            "mp_sae",
+            "neurons_as_concepts",
+            "pca",
+            "semi_nmf",
+            "svd",
+            "vanilla_sae",
+        ),
+        "init_parameters": {
+            "batch_top_k_sae": {"top_k": 10 * SAES_TRAIN_PARAMETERS["batch_size"]},
+            # ICA, PCA and SVD find at most as many components as the split
+            # point has dimensions.
+            "ica": {"nb_concepts": 1024},
+            "pca": {"nb_concepts": 1024},
+            "svd": {"nb_concepts": 1024},
+        },
+        "fit_parameters": {
+            "batch_top_k_sae": {**SAES_TRAIN_PARAMETERS},
+            "ica": {"max_iter": 5000},
+            "mp_sae": {**SAES_TRAIN_PARAMETERS, "criterion": MSELoss},
+            "vanilla_sae": {**SAES_TRAIN_PARAMETERS},
+        },
+    },
+}
+
+DATASET_ID = "wikimedia/wikipedia"
+DATASET_CONFIG = "20231101.en"
+DATASET_SPLIT = "train"
+NUM_DOCUMENTS = 10000
+# Concepts are labelled with the words of the first LABEL_DOCUMENTS articles.
+LABEL_DOCUMENTS = 500
+SEED = 0
+
+SAMPLES = [
+    "Alice and Bob enter the bar, then Alice offers a drink to Bob.",
+    "Interpreto ships interpretable concept visualizations for language models.",
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit.",
+]
+
+NB_CONCEPTS = 5000
+TOP_K = 10
+TOPK_WORDS = 5
+
+# Articles are cut after MAX_DOCUMENT_TOKENS tokens and packed into forward
+# passes of at most TOKEN_BUDGET padded tokens. TOKENS_PER_DOCUMENT token
+# activations are kept per article, drawn at random or evenly spaced
+# (TOKEN_SAMPLING = "random" or "stride"), which bounds the stored rows to
+# NUM_DOCUMENTS * TOKENS_PER_DOCUMENT.
+MAX_DOCUMENT_TOKENS = 512
+TOKEN_BUDGET = 8192
+TOKENS_PER_DOCUMENT = 64
+TOKEN_SAMPLING = "random"
+# float16 or bfloat16 halve the stored activations; fits and encoders upcast
+# them to float32 a chunk at a time (semi-NMF, fitted in memory, for the
+# duration of its fit). See storage_precision.py --report.
+ACTIVATION_STORE_DTYPE = torch.float32
+
+# Fitted concept models are cached in explainer_cache/ (see
+# explainer_cache.py); pass --refit to fit them again anyway.
+EXPLAINER_CACHE = True
+
+OUTPUT_ROOT = Path("explanations")
+
+# Also keep each sample's tokens, (tokens, concepts) activations and
+# importances, and the top-k words of every concept, in results/ (see
+# results_store.py).
+WRITE_RESULTS = True
+# Processes re-rendering the stored tables with --render-only; None uses one
+# per table, up to the number of cores.
+RENDER_WORKERS = None
+
+METHODS = {
+    "batch_top_k_sae": BatchTopKSAEConcepts,
+    "ica": ICAConcepts,
+    "mp_sae": MpSAEConcepts,
+    "neurons_as_concepts": NeuronsAsConcepts,
+    "pca": PCAConcepts,
+    "semi_nmf": SemiNMFConcepts,
+    "svd": SVDConcepts,
+    "vanilla_sae": VanillaSAEConcepts,
+}
+# Fitted on construction: no nb_concepts and no fit.
+UNFITTED_METHODS = ("neurons_as_concepts",)
+
+SAE_METHODS = ("batch_top_k_sae", "mp_sae", "vanilla_sae")
+SAE_BUFFER_ROWS = 2**18
+
+# How the pipeline fits each method on the stored rows. The snippets show the
+# plain `fit` with the model's "fit_parameters". Semi-NMF has no streaming fit
+# and loads the rows in memory.
+OUT_OF_CORE_SAE = True
+DECOMPOSITION_SOLVER = "gram"
+DECOMPOSITION_METHODS = ("pca", "svd")
+MINIBATCH_ICA = True
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Generate local generation concept HTML files and snippets."
+    )
+    parser.add_argument(
+        "--refit",
+        action="store_true",
+        help="Fit every concept method again instead of loading cached fits.",
+    )
+    parser.add_argument(
+        "--render-only",
+        action="store_true",
+        help="Rebuild the HTML files and snippets from results/ without loading the model.",
+    )
+    return parser.parse_args()
+
+
+def fit_function(method_name: str, fit_parameters: dict):
+    """The fitter, called as fitter(explainer, activations, **kwargs), and its
+    keyword arguments."""
+    if OUT_OF_CORE_SAE and method_name in SAE_METHODS:
+        fit_kwargs = {"buffer_rows": SAE_BUFFER_ROWS, "seed": SEED, **fit_parameters}
+        return fit_sae_out_of_core, fit_kwargs
+    if MINIBATCH_ICA and method_name == "ica":
+        return fit_ica, {"seed": SEED}
+    if DECOMPOSITION_SOLVER != "default" and method_name in DECOMPOSITION_METHODS:
+        return fit_decomposition, {"solver": DECOMPOSITION_SOLVER}
+    return fit_explainer, fit_parameters
+
+
+def plot_and_snippet_save(
+    output_root,
+    i,
+    method_name,
+    sample,
+    concepts_activations,
+    local_importances,
+    labels,
+    init_parameters,
+    config,
+):
+    sample_dir = output_root / f"sample-{i:03d}"
+    sample_dir.mkdir(parents=True, exist_ok=True)
+    html_path = sample_dir / f"{method_name}.html"
+    plot_concepts(
+        concepts_activations=concepts_activations,
+        concepts_importances=local_importances,
+        concepts_labels=labels,
+        sample=sample["tokens"],
+        top_k=TOP_K,
+        save_path=str(html_path),
+    )
+    html_path.with_suffix(".py").write_text(
+        render_code_snippet(
+            method_name=method_name,
+            explainer_cls=METHODS[method_name],
+            model_hf_id=config["hf_model_id"],
+            split_points=config["split_points"],
+            batch_size=config["batch_size"],
+            init_parameters=init_parameters,
+            fit_parameters=config["fit_parameters"].get(method_name, {}),
+            sample=sample["text"],
+        ),
+        encoding="utf-8",
+    )
+
+
+def render_stored(output_root, method_name, config):
+    """Re-render the HTML files and snippets of a stored results table."""
+    table = read_results(model_id, "concept", "local", method_name)
+    labels = stored_labels(table.metadata["labels"])
+    for i in table.samples:
+        record = table.record(i)
+        plot_and_snippet_save(
+            output_root,
+            i,
+            method_name,
+            {"text": record["metadata"]["input"], "tokens": record["tokens"]},
+            torch.tensor(record["concepts_activations"]),
+            torch.tensor(record["importances"]),
+            labels,
+            table.metadata["init_parameters"],
+            config,
+        )
+
+
+def main() -> None:
+    args = parse_args()
+    print(f"\n{model_id=}")
+    config = MODEL_CONFIGS[model_id]
+    output_root = OUTPUT_ROOT / model_id / "concept" / "local"
+
+    if args.render_only:
+        jobs = [
+            {"output_root": output_root, "method_name": method_name, "config": config}
+            for method_name in stored_methods(model_id, "concept", "local", config["methods"])
+        ]
+        render_in_parallel(render_stored, jobs, RENDER_WORKERS)
+        return
+
+    torch.manual_seed(SEED)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    model_with_split_points = ModelWithSplitPoints(
+        config["hf_model_id"],
+        automodel=AutoModelForCausalLM,  # type: ignore
+        split_points=config["split_points"],
+        device_map=device,
+        batch_size=config["batch_size"],
+    )
+    tokenizer = model_with_split_points.tokenizer
+    split_point = model_with_split_points.split_points[0]
+    TOKEN = ModelWithSplitPoints.activation_granularities.TOKEN
+    WORD = ModelWithSplitPoints.activation_granularities.WORD
+
+    # The same articles as the snippets, read one at a time.
+    dataset = load_dataset(DATASET_ID, DATASET_CONFIG)[DATASET_SPLIT].shuffle(seed=SEED)
+    documents = dataset.select(range(NUM_DOCUMENTS))
+    dataset_fields = {
+        "model": config["hf_model_id"],
+        "split_points": model_with_split_points.split_points,
+        "granularity": TOKEN.name,
+        "dataset": [DATASET_ID, DATASET_CONFIG],
+        "split": DATASET_SPLIT,
+        "seed": SEED,
+        "count": NUM_DOCUMENTS,
+        "max_document_tokens": MAX_DOCUMENT_TOKENS,
+    }
+    activations = stream_token_activations(
+        model_with_split_points,
+        (row["text"] for row in documents),
+        {
+            **dataset_fields,
+            "tokens_per_document": TOKENS_PER_DOCUMENT,
+            "sampling": TOKEN_SAMPLING,
+        },
+        token_budget=TOKEN_BUDGET,
+        max_tokens=MAX_DOCUMENT_TOKENS,
+        tokens_per_document=TOKENS_PER_DOCUMENT,
+        sampling=TOKEN_SAMPLING,
+        seed=SEED,
+        dtype=ACTIVATION_STORE_DTYPE,
+    )
+    print(f"{activations[split_point].shape[0]:,} token activations")
+
+    # Word activations of the labelling articles, truncated as above, in
+    # forward passes of about TOKEN_BUDGET tokens.
+    label_texts = [
+        truncate(tokenizer, text, MAX_DOCUMENT_TOKENS)[0]
+        for text in documents.select(range(LABEL_DOCUMENTS))["text"]
+    ]
+
+    def word_activations_of(chunk: list[str]) -> dict[str, torch.Tensor]:
+        return model_with_split_points.get_activations(
+            inputs=chunk,  # type: ignore
+            activation_granularity=WORD,
+        )
+
+    default_batch_size = model_with_split_points.batch_size
+    model_with_split_points.batch_size = max(1, TOKEN_BUDGET // MAX_DOCUMENT_TOKENS)
+    word_activations = load_or_compute_activations(
+        fields={**dataset_fields, "granularity": WORD.name, "count": LABEL_DOCUMENTS},
+        inputs=label_texts,
+        compute=word_activations_of,
+        chunk_size=model_with_split_points.batch_size,
+        dtype=ACTIVATION_STORE_DTYPE,
+    )
+    model_with_split_points.batch_size = default_batch_size
+    # One word per row of word_activations (cached, see vocabulary_cache.py).
+    label_words = split_words(model_with_split_points, label_texts, WORD)
+    # When both come from the store, nnsight has not loaded the weights yet,
+    # and the gradient pass does not load them itself.
+    if not model_with_split_points.dispatched:
+        model_with_split_points.dispatch()
+
+    samples = []
+    for sample in SAMPLES:
+        sample_token_ids = tokenizer([sample], return_tensors="pt")
+        samples.append(
+            {
+                "text": sample,
+                "tokens": TOKEN.value.get_decomposition(
+                    sample_token_ids, tokenizer=tokenizer, return_text=True
+                )[0],
+                "activations": model_with_split_points.get_split_activations(
+                    model_with_split_points.get_activations([sample], TOKEN)
+                ),
+            }
+        )
+
+    for method_name in config["methods"]:
+        explainer_cls = METHODS[method_name]
+        print(f"\n{method_name=}")
+        if method_name in UNFITTED_METHODS:
+            init_parameters = {}
+            concept_explainer = explainer_cls(model_with_split_points)
+        else:
+            init_parameters = {
+                "nb_concepts": NB_CONCEPTS,
+                **config["init_parameters"].get(method_name, {}),
+            }
+            concept_explainer = explainer_cls(
+                model_with_split_points, device=device, **init_parameters
+            )
+        fit_parameters = config["fit_parameters"].get(method_name, {})
+        fitter, fit_kwargs = fit_function(method_name, fit_parameters)
+
+        def fit() -> None:
+            fitter(concept_explainer, activations[split_point], **fit_kwargs)
+
+        if EXPLAINER_CACHE:
+            fields = explainer_fields(
+                concept_explainer,
+                activations[split_point],
+                dataset_fields,
+                init_parameters,
+                {**fit_kwargs, "fitter": fitter.__name__, "seed": SEED},
+            )
+            fit_or_load(concept_explainer, fields, fit, refit=args.refit)
+        elif not concept_explainer.is_fitted:
+            fit()
+        # Semi-NMF encodes from random codes: the outputs should not depend
+        # on whether the fit above ran or was loaded.
+        torch.manual_seed(SEED)
+
+        # TopKInputs' labels, without its (words, concepts) matrix and its
+        # topk over k times the count of the most frequent word candidates
+        # per concept (see streaming_topk.py).
+        topk_words = topk_inputs(
+            concept_explainer, word_activations[split_point], label_words, k=TOPK_WORDS
+        )
+        labels = {k: list(v.keys()) for k, v in topk_words.items() if v}
+
+        records = []
+        for i, sample in enumerate(samples):
+            local_importances = concept_explainer.concept_output_gradient(
+                inputs=[sample["text"]],
+                activation_granularity=TOKEN,
+                concepts_x_gradients=False,
+                normalization=False,
+            )[0]
+            local_importances = local_importances.abs().sum(dim=1)
+            concepts_activations = concept_explainer.encode_activations(sample["activations"])
+
+            plot_and_snippet_save(
+                output_root,
+                i,
+                method_name,
+                sample,
+                concepts_activations,
+                local_importances,
+                labels,
+                init_parameters,
+                config,
+            )
+            records.append(
+                {
+                    "sample": i,
+                    "tokens": list(sample["tokens"]),
+                    "concepts_activations": concepts_activations,
+                    "importances": local_importances,
+                    "metadata": {"input": sample["text"]},
+                }
+            )
+        if WRITE_RESULTS:
+            write_results(
+                model_id,
+                "concept",
+                "local",
+                method_name,
+                records,
+                {
+                    "hf_model_id": config["hf_model_id"],
+                    "split_points": config["split_points"],
+                    "init_parameters": init_parameters,
+                    "labels": topk_words,
+                },
+            )
+        del concept_explainer, topk_words, labels, records
+
+
+def render_code_snippet(
+    method_name: str,
+    explainer_cls: type,
+    model_hf_id: str,
+    split_points: int,
+    batch_size: int,
+    init_parameters: dict,
+    fit_parameters: dict,
+    sample: str,
+) -> str:
+    loss_imports = "".join(
+        f"from interpreto.concepts.methods.overcomplete import {value.__name__}\n"
+        for value in fit_parameters.values()
+        if isinstance(value, type) and value.__module__.startswith("interpreto")
+    )
+    if method_name in UNFITTED_METHODS:
+        explainer = f"""concept_explainer = {explainer_cls.__name__}(
+    mwsp,
+)
+"""
+    else:
+        extra_init = "".join(
+            f"    {name}={python_source(value)},\n"
+            for name, value in init_parameters.items()
+            if name != "nb_concepts"
+        )
+        fit_arguments = "".join(
+            f"    {name}={python_source(value)},\n" for name, value in fit_parameters.items()
+        )
+        fit_call = (
+            f"concept_explainer.fit(\n    activations,\n{fit_arguments})"
+            if fit_arguments
+            else "concept_explainer.fit(activations)"
+        )
+        explainer = f"""concept_explainer = {explainer_cls.__name__}(
+    mwsp,
+    nb_concepts={init_parameters["nb_concepts"]},
+    device=device,
+{extra_init})
+
+{fit_call}
+"""
+    return f"""import torch
+from datasets import load_dataset
+from transformers import AutoModelForCausalLM
+from interpreto import ModelWithSplitPoints, plot_concepts
+from interpreto.concepts import {explainer_cls.__name__}
+from interpreto.concepts.interpretations import TopKInputs
+{loss_imports}
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+mwsp = ModelWithSplitPoints(
+    {model_hf_id!r},
+    automodel=AutoModelForCausalLM,
+    split_points={split_points!r},
+    device_map=device,
+    batch_size={batch_size},
+)
+
+dataset = load_dataset({DATASET_ID!r}, {DATASET_CONFIG!r}).shuffle(seed={SEED})
+inputs = dataset["{DATASET_SPLIT}"]["text"][:{NUM_DOCUMENTS}]
+
+TOKEN = ModelWithSplitPoints.activation_granularities.TOKEN
+activations_dict = mwsp.get_activations(
+    inputs=inputs,
+    activation_granularity=TOKEN,
+)
+activations = mwsp.get_split_activations(activations_dict)
+
+{explainer}
+WORD = ModelWithSplitPoints.activation_granularities.WORD
+topk_inputs_method = TopKInputs(
+    concept_explainer=concept_explainer,
+    activation_granularity=WORD,
+    k={TOPK_WORDS},
+)
+topk_words = topk_inputs_method.interpret(
+    inputs=inputs[:{LABEL_DOCUMENTS}],
+    concepts_indices="all",
+)
+labels = {{k: list(v.keys()) for k, v in topk_words.items() if v}}
+
+sample = {sample!r}
+sample_token_ids = mwsp.tokenizer([sample], return_tensors="pt")
+sample_tokens = TOKEN.value.get_decomposition(
+    sample_token_ids,
+    tokenizer=mwsp.tokenizer,
+    return_text=True,
+)[0]
+
+local_importances = concept_explainer.concept_output_gradient(
+    inputs=[sample],
+    activation_granularity=TOKEN,
+    concepts_x_gradients=False,
+    normalization=False,
+)[0]
+local_importances = local_importances.abs().sum(dim=1)
+
+local_activations = mwsp.get_split_activations(mwsp.get_activations([sample], TOKEN))
+concepts_activations = concept_explainer.encode_activations(local_activations)
+
+plot_concepts(
+    concepts_activations=concepts_activations,
+    concepts_importances=local_importances,
+    concepts_labels=labels,
+    sample=sample_tokens,
+    top_k={TOP_K},
+)
+"""
+
+
+if __name__ == "__main__":
+    main()
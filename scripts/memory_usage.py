@@ -0,0 +1,104 @@
+"""Resident memory measurements used to size batches and report model footprints."""
+
+import ctypes
+import ctypes.util
+import gc
+import resource
+import threading
+from pathlib import Path
+
+
+def _read_kib(path: str, field: str) -> int | None:
+    try:
+        for line in Path(path).read_text().splitlines():
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss() -> int:
+    """Resident set size of this process, in bytes."""
+    rss = _read_kib("/proc/self/status", "VmRSS")
+    if rss is None:
+        # ru_maxrss is the peak rather than the current value, but it is the
+        # best portable fallback when /proc is unavailable.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return rss
+
+
+def current_anonymous_rss() -> int:
+    """Resident memory not backed by files, in bytes.
+
+    Pages of memory-mapped files (e.g. activation_store/ entries) count in
+    the RSS but can be evicted by the kernel at any time; this excludes them.
+    Falls back to the full RSS when /proc is unavailable.
+    """
+    rss = _read_kib("/proc/self/status", "RssAnon")
+    return current_rss() if rss is None else rss
+
+
+def available_memory() -> int | None:
+    """Memory the kernel reports as available for new allocations, in bytes."""
+    return _read_kib("/proc/meminfo", "MemAvailable")
+
+
+def total_memory() -> int | None:
+    return _read_kib("/proc/meminfo", "MemTotal")
+
+
+def release_free_memory() -> None:
+    """Collect garbage and hand freed heap pages back to the OS.
+
+    glibc keeps freed blocks for reuse, so without this an earlier
+    computation would hide the footprint of the next one from RSS.
+    """
+    gc.collect()
+    libc = ctypes.util.find_library("c")
+    if libc is not None:
+        malloc_trim = getattr(ctypes.CDLL(libc), "malloc_trim", None)
+        if malloc_trim is not None:
+            malloc_trim(0)
+
+
+def format_bytes(value: int | float) -> str:
+    return f"{value / 2**30:.2f} GiB"
+
+
+class PeakRSSMonitor:
+    """Sample the process RSS in a background thread and keep the maximum.
+
+    >>> with PeakRSSMonitor() as monitor:
+    ...     run()
+    >>> monitor.peak
+    """
+
+    def __init__(self, interval: float = 0.01, anonymous: bool = False):
+        self.interval = interval
+        self._read = current_anonymous_rss if anonymous else current_rss
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._read())
+
+    def __enter__(self) -> "PeakRSSMonitor":
+        self.start = self.peak = self._read()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.peak = max(self.peak, self._read())
+
+    @property
+    def increase(self) -> int:
+        return self.peak - self.start
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Low-memory loading of large causal language models on CPU hosts.
+
+Weights are read from memory-mapped safetensors shards straight into bf16
+parameters, so a 7-8B model needs about 16 GB instead of the 32+ GB of fp32
+weights. With an offload folder, accelerate keeps only `max_cpu_memory` worth
+of layers resident and pages the others in from disk around each layer's
+forward (and therefore backward) call.
+
+Run `python scripts/model_loading.py --self-check` to save a tiny random
+checkpoint of each supported architecture and load it back in every mode.
+"""
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+import torch
+import transformers
+from packaging import version
+from transformers import AutoModelForCausalLM
+
+from memory_usage import PeakRSSMonitor, format_bytes
+
+
+TRANSFORMERS_VERSION = version.parse(transformers.__version__)
+
+
+def _loading_kwargs(dtype: torch.dtype) -> dict:
+    # `torch_dtype` became `dtype` in 4.56, and transformers 5 always loads
+    # with low CPU memory usage and rejects the flag.
+    kwargs = {"use_safetensors": True}
+    if TRANSFORMERS_VERSION >= version.parse("4.56"):
+        kwargs["dtype"] = dtype
+    else:
+        kwargs["torch_dtype"] = dtype
+    if TRANSFORMERS_VERSION.major < 5:
+        kwargs["low_cpu_mem_usage"] = True
+    return kwargs
+
+
+def load_causal_lm(
+    hf_model_id: str,
+    dtype: torch.dtype = torch.bfloat16,
+    offload_folder: Path | None = None,
+    max_cpu_memory: str | None = None,
+    token: str | None = None,
+):
+    """Load a causal LM in `dtype` from memory-mapped safetensors shards.
+
+    If `offload_folder` is given, layers that do not fit in `max_cpu_memory`
+    (e.g. "12GiB") are offloaded to that folder and loaded on demand.
+    Returns the model and the peak RSS reached while loading, in bytes.
+    """
+    kwargs = _loading_kwargs(dtype)
+    if offload_folder is not None:
+        Path(offload_folder).mkdir(parents=True, exist_ok=True)
+        kwargs["device_map"] = "auto"
+        kwargs["offload_folder"] = str(offload_folder)
+        if max_cpu_memory is not None:
+            kwargs["max_memory"] = {"cpu": max_cpu_memory}
+
+    with PeakRSSMonitor() as monitor:
+        model = AutoModelForCausalLM.from_pretrained(hf_model_id, token=token, **kwargs)
+    model.eval()
+    return model, monitor.peak
+
+
+def print_memory_report(label: str, peak_rss: int) -> None:
+    print(f"{label}: peak RSS {format_bytes(peak_rss)}")
+
+
+# ----------------------------
+# Self-check
+# ----------------------------
+TINY_CONFIGS = {
+    "llama": transformers.LlamaConfig,
+    "mistral": transformers.MistralConfig,
+}
+
+
+def _tiny_checkpoint(architecture: str, folder: Path) -> torch.nn.Module:
+    config = TINY_CONFIGS[architecture](
+        vocab_size=512,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=4,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+    )
+    torch.manual_seed(0)
+    model = AutoModelForCausalLM.from_config(config).to(torch.bfloat16).eval()
+    # Several small shards, as for the real multi-shard checkpoints.
+    model.save_pretrained(folder, safe_serialization=True, max_shard_size="200KB")
+    return model
+
+
+def _logits_and_gradient(model, input_ids: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    embeddings = model.get_input_embeddings()(input_ids).detach().requires_grad_(True)
+    logits = model(inputs_embeds=embeddings).logits
+    logits[0, -1].max().backward()
+    return logits.detach().float(), embeddings.grad.float()
+
+
+def _close(actual: torch.Tensor, expected: torch.Tensor, tolerance: float = 0.02) -> bool:
+    # The weights round-trip exactly, but the reference was cast with .to(),
+    # which also rounds buffers such as rotary frequencies to bf16, so the
+    # outputs only agree to bf16 precision.
+    return (actual - expected).abs().max() <= tolerance * expected.abs().max()
+
+
+def self_check() -> bool:
+    ok = True
+    input_ids = torch.randint(0, 512, (1, 24), generator=torch.Generator().manual_seed(0))
+    for architecture in TINY_CONFIGS:
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = Path(tmp) / architecture
+            reference = _tiny_checkpoint(architecture, checkpoint)
+            expected_logits, expected_gradient = _logits_and_gradient(reference, input_ids)
+            n_shards = len(list(checkpoint.glob("*.safetensors")))
+
+            modes = {
+                "bf16": {},
+                "bf16 + disk offload": {
+                    "offload_folder": Path(tmp) / "offload",
+                    "max_cpu_memory": "100KB",
+                },
+            }
+            for mode, options in modes.items():
+                model, peak_rss = load_causal_lm(str(checkpoint), **options)
+                logits, gradient = _logits_and_gradient(model, input_ids)
+                matches = (
+                    model.dtype == torch.bfloat16
+                    and _close(logits, expected_logits)
+                    and _close(gradient, expected_gradient)
+                )
+                ok &= matches
+                print(
+                    f"{architecture} ({n_shards} shards), {mode}: "
+                    f"peak RSS {format_bytes(peak_rss)}, "
+                    f"{'ok' if matches else 'MISMATCH'}"
+                )
+                del model
+    return ok
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--self-check",
+        action="store_true",
+        help="Round-trip tiny Llama and Mistral checkpoints through every loading mode.",
+    )
+    parser.add_argument("--model", help="Hugging Face model id to load and report on.")
+    parser.add_argument("--offload-folder", type=Path, default=None)
+    parser.add_argument("--max-cpu-memory", default=None)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if args.self_check:
+        return 0 if self_check() else 1
+    if args.model is None:
+        print("Nothing to do: pass --self-check or --model.", file=sys.stderr)
+        return 1
+    _, peak_rss = load_causal_lm(
+        args.model, offload_folder=args.offload_folder, max_cpu_memory=args.max_cpu_memory
+    )
+    print_memory_report(f"Loaded {args.model}", peak_rss)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
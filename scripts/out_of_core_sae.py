@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Train SAE concept explainers on memory-mapped activations.
+
+`SAEExplainer.fit` wraps its activations in a shuffled `DataLoader`, which
+reads single rows at random positions: on activations memory-mapped from
+activation_store/ and larger than RAM, every minibatch becomes hundreds of
+random page faults. Here an epoch instead visits contiguous blocks of rows in
+random order. A background thread copies `buffer_rows` rows worth of blocks
+into memory, shuffles the rows of that buffer and hands it over through a
+bounded queue, so reading the next buffer overlaps with training on the
+current one. At most `prefetch + 2` buffers are in memory at any time.
+
+Run `python scripts/out_of_core_sae.py --self-check` to check that every row
+is visited once per epoch and that an SAE trained this way matches the
+in-memory fit.
+"""
+
+import argparse
+import queue
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import torch
+from tokenizers import Tokenizer, models
+from transformers import BertConfig, BertForSequenceClassification, PreTrainedTokenizerFast
+
+from interpreto import ModelWithSplitPoints
+from interpreto._vendor.overcomplete import sae as oc_sae
+from interpreto.concepts import VanillaSAEConcepts
+from interpreto.concepts.methods.overcomplete import MSELoss
+
+from activation_store import read_activations, write_activations
+from memory_usage import PeakRSSMonitor, format_bytes
+
+
+# Each buffer is filled from this many random blocks of contiguous rows.
+BLOCKS_PER_BUFFER = 64
+
+
+class ShuffledBlockLoader:
+    """Minibatches of `activations` in shuffled order, one epoch per iteration.
+
+    `activations` is a `(rows, d)` tensor, typically a memory map returned by
+    `read_activations`. Rows are shuffled within each buffer of `buffer_rows`
+    rows, and the buffers are made of random blocks, so consecutive
+    minibatches mix rows from all over the file while the reads stay
+    sequential.
+    """
+
+    def __init__(
+        self,
+        activations: torch.Tensor,
+        batch_size: int,
+        buffer_rows: int = 2**18,
+        prefetch: int = 2,
+        seed: int = 0,
+    ):
+        if buffer_rows < batch_size:
+            raise ValueError(
+                f"buffer_rows ({buffer_rows}) must hold at least one batch ({batch_size})."
+            )
+        self.activations = activations
+        self.batch_size = batch_size
+        self.buffer_rows = buffer_rows
+        self.block_rows = max(1, buffer_rows // BLOCKS_PER_BUFFER)
+        self.prefetch = prefetch
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self) -> int:
+        return -(-self.activations.shape[0] // self.batch_size)
+
+    def _buffers(self, generator: torch.Generator):
+        n_rows = self.activations.shape[0]
+        starts = torch.arange(0, n_rows, self.block_rows)
+        starts = starts[torch.randperm(len(starts), generator=generator)].tolist()
+        blocks_per_buffer = max(1, self.buffer_rows // self.block_rows)
+        for i in range(0, len(starts), blocks_per_buffer):
+            blocks = [
+                self.activations[start : start + self.block_rows]
+                for start in starts[i : i + blocks_per_buffer]
+            ]
+            # torch.cat copies out of the memory map without holding the GIL.
+            buffer = torch.cat(blocks).float()
+            yield buffer[torch.randperm(buffer.shape[0], generator=generator)]
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        buffers: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def fill() -> None:
+            try:
+                for buffer in self._buffers(generator):
+                    while not stop.is_set():
+                        try:
+                            buffers.put(buffer, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+                buffers.put(None)
+            except BaseException as error:  # re-raised in the training thread
+                buffers.put(error)
+
+        thread = threading.Thread(target=fill, name="sae-prefetch", daemon=True)
+        thread.start()
+        try:
+            while (buffer := buffers.get()) is not None:
+                if isinstance(buffer, BaseException):
+                    raise buffer
+                for start in range(0, buffer.shape[0], self.batch_size):
+                    yield buffer[start : start + self.batch_size]
+        finally:
+            # The training loop stopped early or failed: unblock the thread.
+            stop.set()
+            thread.join()
+
+
+def fit_sae_out_of_core(
+    concept_explainer,
+    activations: torch.Tensor,
+    *,
+    batch_size: int = 1024,
+    criterion=MSELoss,
+    optimizer_class: type[torch.optim.Optimizer] = torch.optim.Adam,
+    optimizer_kwargs: dict | None = None,
+    scheduler_class=None,
+    scheduler_kwargs: dict | None = None,
+    lr: float = 1e-3,
+    nb_epochs: int = 20,
+    clip_grad: float | None = None,
+    monitoring: int | None = None,
+    device: torch.device | str | None = None,
+    buffer_rows: int = 2**18,
+    prefetch: int = 2,
+    seed: int = 0,
+    overwrite: bool = False,
+) -> dict:
+    """`SAEExplainer.fit` with a `ShuffledBlockLoader` instead of a
+    `DataLoader` over the whole tensor. Takes the same training parameters,
+    plus the loader's `buffer_rows`, `prefetch` and `seed`."""
+    split_activations = concept_explainer._prepare_fit(activations, overwrite=overwrite)
+    model = concept_explainer.concept_model
+    dataloader = ShuffledBlockLoader(
+        split_activations, batch_size, buffer_rows=buffer_rows, prefetch=prefetch, seed=seed
+    )
+    optimizer = optimizer_class(model.parameters(), **{**(optimizer_kwargs or {}), "lr": lr})
+    train_params = {
+        "model": model,
+        "dataloader": dataloader,
+        "criterion": criterion(),
+        "optimizer": optimizer,
+        "nb_epochs": nb_epochs,
+        "clip_grad": clip_grad,
+        "monitoring": monitoring,
+        "device": device if device is not None else concept_explainer.device,
+    }
+    if scheduler_class is not None:
+        train_params["scheduler"] = scheduler_class(optimizer, **(scheduler_kwargs or {}))
+    log = oc_sae.train_sae(**train_params)
+    model.fitted = True
+    # As in SAEExplainer.fit: BatchTopK SAEs encode differently in training mode.
+    if hasattr(model, "training"):
+        model.training = False
+    return log
+
+
+# ----------------------------
+# Self-check
+# ----------------------------
+def _r2(concept_explainer, activations: torch.Tensor) -> float:
+    with torch.no_grad():
+        reconstruction = concept_explainer.decode_concepts(
+            concept_explainer.encode_activations(activations)
+        )
+    residual = (activations - reconstruction).pow(2).sum()
+    total = (activations - activations.mean(0)).pow(2).sum()
+    return 1 - (residual / total).item()
+
+
+def stand_in_model(d: int) -> ModelWithSplitPoints:
+    """A one-layer model with `d`-dimensional activations, for fitting concept
+    explainers on given activations: they only read the width of the split
+    point from the model."""
+    config = BertConfig(
+        vocab_size=64,
+        hidden_size=d,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=64,
+    )
+    vocabulary = models.WordLevel({"[UNK]": 0, "[PAD]": 1}, unk_token="[UNK]")
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=Tokenizer(vocabulary), unk_token="[UNK]", pad_token="[PAD]"
+    )
+    return ModelWithSplitPoints(
+        BertForSequenceClassification(config),
+        tokenizer=tokenizer,
+        split_points=[0],
+    )
+
+
+def self_check() -> bool:
+    ok = True
+    n_rows, d, batch_size = 20_000, 32, 256
+    generator = torch.Generator().manual_seed(0)
+    # Low-rank activations plus noise, so that an SAE has something to learn.
+    activations = torch.randn(n_rows, 8, generator=generator) @ torch.randn(8, d, generator=generator)
+    activations += 0.1 * torch.randn(n_rows, d, generator=generator)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fields = {"self_check": "out_of_core_sae"}
+        chunks = (
+            {"activations": activations[i : i + 1000], "row": torch.arange(i, min(i + 1000, n_rows))}
+            for i in range(0, n_rows, 1000)
+        )
+        write_activations(fields, chunks, root=Path(tmp))
+        stored = read_activations(fields, root=Path(tmp))
+
+        # Every row exactly once per epoch, in a different order each epoch.
+        loader = ShuffledBlockLoader(stored["row"].unsqueeze(1), 100, buffer_rows=2000)
+        epochs = [torch.cat(list(loader)).flatten() for _ in range(2)]
+        visited_once = all(torch.equal(e.sort().values, torch.arange(n_rows)) for e in epochs)
+        reshuffled = not torch.equal(epochs[0], epochs[1])
+        ok &= visited_once and reshuffled
+        print(f"every row once per epoch: {visited_once}, reshuffled each epoch: {reshuffled}")
+
+        # An early stop (e.g. an exception in training) must not leave the
+        # prefetch thread blocked on a full queue.
+        for _ in zip(range(3), loader):
+            pass
+        alive = [t for t in threading.enumerate() if t.name == "sae-prefetch"]
+        ok &= not alive
+        print(f"prefetch thread stopped after an early exit: {not alive}")
+
+        model_with_split_points = stand_in_model(d)
+        fit_parameters = {"batch_size": batch_size, "lr": 1e-3, "nb_epochs": 5}
+        results = {}
+        for mode in ("in memory", "out of core"):
+            torch.manual_seed(0)
+            explainer = VanillaSAEConcepts(model_with_split_points, nb_concepts=16)
+            with PeakRSSMonitor() as monitor:
+                start = time.perf_counter()
+                if mode == "in memory":
+                    explainer.fit(activations, **fit_parameters)
+                else:
+                    fit_sae_out_of_core(
+                        explainer, stored["activations"], buffer_rows=4096, **fit_parameters
+                    )
+                seconds = time.perf_counter() - start
+            results[mode] = _r2(explainer, activations)
+            print(
+                f"{mode}: R2 {results[mode]:.3f}, {n_rows * fit_parameters['nb_epochs'] / seconds:,.0f} "
+                f"rows/s, peak RSS increase {format_bytes(monitor.increase)}"
+            )
+        matches = abs(results["in memory"] - results["out of core"]) < 0.05
+        ok &= matches
+        print(f"out-of-core R2 within 0.05 of the in-memory fit: {matches}")
+    return ok
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--self-check",
+        action="store_true",
+        help="Check the loader on a temporary store and compare with the in-memory SAE fit.",
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if args.self_check:
+        return 0 if self_check() else 1
+    print("Nothing to do: pass --self-check, or call fit_sae_out_of_core from a pipeline.")
+    return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
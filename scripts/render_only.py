@@ -0,0 +1,79 @@
+"""Rebuild explanation HTML files and snippets from results/, without models.
+
+The pipelines keep the raw tensors behind every HTML file in results/ (see
+results_store.py). Run one with `--render-only` after changing how
+explanations are plotted (colors, styles, label grouping, snippets): it
+reads its stored tables and renders them again, one job per table in
+parallel worker processes, without loading a model or dataset.
+"""
+
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import torch
+import torch.multiprocessing
+
+from interpreto.attributions.base import AttributionOutput, Granularity, ModelTask
+
+from fit_scheduler import default_workers
+from results_store import RESULTS_ROOT, read_results
+
+
+def stored_methods(
+    model: str, type: str, scope: str, methods, root: Path = RESULTS_ROOT
+) -> list[str]:
+    """The `methods` with a stored (model, type, scope) table."""
+    stored = [
+        method for method in methods if read_results(model, type, scope, method, root) is not None
+    ]
+    missing = [method for method in methods if method not in stored]
+    if missing:
+        print(f"No stored {model} {type} {scope} results for {', '.join(missing)}: skipped")
+    return stored
+
+
+def stored_attribution(record: dict) -> AttributionOutput:
+    """The `AttributionOutput` of a record written by
+    `results_store.attribution_record`, as `plot_attributions` reads it."""
+    metadata = record["metadata"]
+    return AttributionOutput(
+        attributions=torch.tensor(record["attributions"]),
+        elements=record["tokens"] if "tokens" in record else torch.tensor(record["elements"]),
+        model_inputs_to_explain=None,
+        targets=None if record.get("targets") is None else torch.tensor(record["targets"]),
+        model_task=ModelTask[metadata["model_task"]],
+        classes=None if record.get("classes") is None else torch.tensor(record["classes"]),
+        granularity=Granularity[metadata["granularity"]],
+    )
+
+
+def stored_labels(topk_words: dict) -> dict[int, list[str]]:
+    """`{concept: words}` plot labels from stored `topk_inputs` output,
+    whose concept keys JSON turned into strings."""
+    return {int(concept): list(words) for concept, words in topk_words.items() if words}
+
+
+def _call(render: Callable, job: dict) -> None:
+    render(**job)
+
+
+def render_in_parallel(render: Callable, jobs: list[dict], workers: int | None = None) -> None:
+    """`render(**job)` for every job, in `workers` spawned processes (one
+    per job, up to the number of cores, by default). `render` must be a
+    module-level function, importable by the workers."""
+    workers = workers or default_workers(len(jobs))
+    start = time.perf_counter()
+    if workers <= 1:
+        for job in jobs:
+            render(**job)
+    else:
+        context = torch.multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            for future in [pool.submit(_call, render, job) for job in jobs]:
+                future.result()
+    print(
+        f"Rendered {len(jobs)} stored tables in {time.perf_counter() - start:.1f}s "
+        f"with {workers} worker(s)"
+    )
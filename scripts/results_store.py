@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Columnar store of the raw outputs behind the explanation HTML files.
+
+The pipelines render attributions and concept importances to HTML and drop
+the tensors. They also write them here, so that re-rendering, comparing
+methods or computing metrics does not need the model again.
+
+Results are grouped in tables, one per (model, type, scope, method), e.g.
+results/clf:imdb:distilbert/attribution/all-classes/lime/, with one record
+per sample. Dataset-level results (concept/general, concept/class-wise)
+have a single record with sample -1. A table stores each column in its
+own raw file, appended record after record:
+
+- array columns (attributions, importances, concept activations, ...) hold
+  the flattened values of every record, with the offset and shape of each
+  record, so a record of any shape is a reshaped slice;
+- string columns (the tokens) hold the UTF-8 bytes of every string, with
+  the offsets of each string and of each record's strings;
+- per-record metadata (input text, labels, timing, ...) and the table's
+  own (class names, model ids, ...) go to meta.json, written last like in
+  activation_store.py, so an interrupted write leaves no table.
+
+`read_results` memory-maps the files: the arrays of a record are views of
+the page cache, without a copy, and a table can be larger than RAM.
+
+Run `python scripts/results_store.py --list` to print the stored tables, or
+`--self-check` to write and read back a temporary table.
+"""
+
+import argparse
+import json
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import torch
+
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_ROOT = ROOT / "results"
+
+# Sample id of the single record of dataset-level results.
+DATASET = -1
+
+
+def table_dir(model: str, type: str, scope: str, method: str, root: Path = RESULTS_ROOT) -> Path:
+    return Path(root) / model / type / scope / method
+
+
+def _array(value) -> np.ndarray:
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu()
+        value = value.float() if value.is_floating_point() else value.long()
+        return value.numpy()
+    array = np.asarray(value)
+    return array.astype(np.float32 if array.dtype.kind == "f" else np.int64)
+
+
+def attribution_record(sample: int, attribution, **metadata) -> dict:
+    """Record of an interpreto `AttributionOutput`: its tokens (or other
+    elements), attributions, targets and classes. `metadata` is added to
+    its task and granularity."""
+    record = {
+        "sample": sample,
+        "attributions": attribution.attributions,
+        "targets": attribution.targets,
+        "classes": attribution.classes,
+        "metadata": {
+            "model_task": getattr(attribution.model_task, "name", str(attribution.model_task)),
+            "granularity": getattr(attribution.granularity, "name", str(attribution.granularity)),
+            **metadata,
+        },
+    }
+    if isinstance(attribution.elements, torch.Tensor):
+        record["elements"] = attribution.elements
+    else:
+        record["tokens"] = list(attribution.elements)
+    return {name: value for name, value in record.items() if value is not None}
+
+
+def write_results(
+    model: str,
+    type: str,
+    scope: str,
+    method: str,
+    records: list[dict],
+    metadata: dict | None = None,
+    root: Path = RESULTS_ROOT,
+) -> Path:
+    """Replace the table of (model, type, scope, method) by `records`.
+
+    Each record is a dict with its `sample` id, array columns (tensors or
+    arrays of any shape), string columns (lists of str) and an optional
+    `metadata` dict. Floating-point arrays are stored as float32 and integer
+    ones as int64. `metadata` describes the whole table.
+    """
+    final = table_dir(model, type, scope, method, root)
+    directory = final.with_name(final.name + ".partial")
+    if directory.exists():
+        shutil.rmtree(directory)
+    directory.mkdir(parents=True)
+
+    samples = [int(record["sample"]) for record in records]
+    names = list(
+        dict.fromkeys(
+            name for record in records for name in record if name not in ("sample", "metadata")
+        )
+    )
+    columns: dict[str, dict] = {}
+    for name in names:
+        # Records without the column get an empty slice (and a None shape).
+        values = [record.get(name) for record in records]
+        if all(value is None for value in values):
+            continue
+        strings = all(
+            value is None or (isinstance(value, list) and all(isinstance(s, str) for s in value))
+            for value in values
+        )
+        offsets = [0]
+        with open(directory / f"{name}.bin", "wb") as file:
+            if strings:
+                lengths = [0]
+                for value in values:
+                    data = [s.encode("utf-8") for s in value or []]
+                    file.write(b"".join(data))
+                    lengths.extend(len(d) for d in data)
+                    offsets.append(offsets[-1] + len(data))
+                np.cumsum(lengths, dtype=np.int64).tofile(directory / f"{name}.string_offsets")
+                columns[name] = {"kind": "strings"}
+            else:
+                arrays = [None if value is None else _array(value) for value in values]
+                dtypes = {array.dtype.name for array in arrays if array is not None}
+                if len(dtypes) > 1:
+                    raise ValueError(f"Column {name!r} mixes dtypes {sorted(dtypes)}.")
+                for array in arrays:
+                    if array is not None:
+                        file.write(np.ascontiguousarray(array).tobytes())
+                    offsets.append(offsets[-1] + (0 if array is None else array.size))
+                columns[name] = {
+                    "kind": "array",
+                    "dtype": dtypes.pop(),
+                    "shapes": [None if array is None else list(array.shape) for array in arrays],
+                }
+        np.asarray(offsets, dtype=np.int64).tofile(directory / f"{name}.offsets")
+
+    meta = {
+        "model": model,
+        "type": type,
+        "scope": scope,
+        "method": method,
+        "samples": samples,
+        "columns": columns,
+        "records": [record.get("metadata", {}) for record in records],
+        "metadata": metadata or {},
+    }
+    (directory / "meta.json").write_text(json.dumps(meta, indent=2, default=str), encoding="utf-8")
+    if final.exists():
+        shutil.rmtree(final)
+    directory.rename(final)
+    return final
+
+
+def _memmap(path: Path, dtype) -> np.ndarray:
+    # np.memmap refuses empty files.
+    if path.stat().st_size == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+@dataclass
+class ResultsTable:
+    """A table read by `read_results`. Arrays are read-only memory maps."""
+
+    directory: Path
+    meta: dict
+    _maps: dict = field(default_factory=dict, repr=False)
+
+    @property
+    def metadata(self) -> dict:
+        return self.meta["metadata"]
+
+    @property
+    def samples(self) -> list[int]:
+        return self.meta["samples"]
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def column(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        """The flat values of column `name` and the `(records + 1,)` offsets
+        of each record in them (string columns: in their strings)."""
+        if name not in self._maps:
+            column = self.meta["columns"][name]
+            dtype = np.uint8 if column["kind"] == "strings" else column["dtype"]
+            self._maps[name] = (
+                _memmap(self.directory / f"{name}.bin", dtype),
+                _memmap(self.directory / f"{name}.offsets", np.int64),
+            )
+        return self._maps[name]
+
+    def _value(self, name: str, index: int):
+        column = self.meta["columns"][name]
+        values, offsets = self.column(name)
+        start, stop = int(offsets[index]), int(offsets[index + 1])
+        if column["kind"] == "strings":
+            bounds = _memmap(self.directory / f"{name}.string_offsets", np.int64)[start : stop + 1]
+            return [
+                bytes(values[begin:end]).decode("utf-8")
+                for begin, end in zip(bounds[:-1], bounds[1:])
+            ]
+        shape = column["shapes"][index]
+        if shape is None:
+            return None
+        return values[start:stop].reshape(shape)
+
+    def record(self, sample: int = DATASET) -> dict:
+        """Columns and metadata of the record of `sample`."""
+        index = self.samples.index(sample)
+        record = {name: self._value(name, index) for name in self.meta["columns"]}
+        return {"sample": sample, **record, "metadata": self.meta["records"][index]}
+
+
+def read_results(
+    model: str, type: str, scope: str, method: str, root: Path = RESULTS_ROOT
+) -> ResultsTable | None:
+    directory = table_dir(model, type, scope, method, root)
+    meta_path = directory / "meta.json"
+    if not meta_path.exists():
+        return None
+    return ResultsTable(directory, json.loads(meta_path.read_text(encoding="utf-8")))
+
+
+def list_results(root: Path = RESULTS_ROOT) -> list[tuple[str, str, str, str]]:
+    """(model, type, scope, method) of every stored table."""
+    tables = []
+    for meta_path in sorted(Path(root).glob("*/*/*/*/meta.json")):
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        tables.append((meta["model"], meta["type"], meta["scope"], meta["method"]))
+    return tables
+
+
+# ----------------------------
+# Self-check
+# ----------------------------
+def self_check() -> bool:
+    ok = True
+    generator = torch.Generator().manual_seed(0)
+    records = [
+        {
+            "sample": i,
+            "tokens": [f"tok{j}é" for j in range(3 + i)],
+            "attributions": torch.randn(2, 3 + i, generator=generator),
+            "metadata": {"input": f"text {i}"},
+        }
+        for i in range(3)
+    ]
+    records[1]["targets"] = torch.tensor([0, 1])
+    with tempfile.TemporaryDirectory() as tmp:
+        key = ("model", "attribution", "all-classes", "lime")
+        write_results(*key, records, {"classes": ["a", "b"]}, root=Path(tmp))
+        table = read_results(*key, root=Path(tmp))
+        same = all(
+            table.record(r["sample"])["tokens"] == r["tokens"]
+            and np.array_equal(table.record(r["sample"])["attributions"], r["attributions"].numpy())
+            and table.record(r["sample"])["metadata"] == r["metadata"]
+            for r in records
+        )
+        ragged = (
+            table.record(1)["targets"].tolist() == [0, 1]
+            and table.record(0)["targets"] is None
+            and table.record(2)["targets"] is None
+        )
+        values, _ = table.column("attributions")
+        zero_copy = np.shares_memory(table.record(2)["attributions"], values) and isinstance(
+            values, np.memmap
+        )
+        listed = list_results(Path(tmp)) == [key]
+        ok &= same and ragged and zero_copy and listed and table.metadata == {"classes": ["a", "b"]}
+        print(
+            f"round trip: {same}, missing columns: {ragged}, "
+            f"memory-mapped views: {zero_copy}, listed: {listed}"
+        )
+    return ok
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--list", action="store_true", help="Print the stored tables.")
+    parser.add_argument(
+        "--self-check",
+        action="store_true",
+        help="Write and read back a table in a temporary directory.",
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if args.self_check:
+        return 0 if self_check() else 1
+    if args.list:
+        for model, type, scope, method in list_results():
+            table = read_results(model, type, scope, method)
+            columns = ", ".join(table.meta["columns"])
+            print(f"{model} {type} {scope} {method}: {len(table)} records ({columns})")
+        return 0
+    print("Nothing to do: pass --list or --self-check.")
+    return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,60 @@
+"""Constant-memory reductions over batches of rows.
+
+Concept importances are the mean absolute gradient over a dataset. Stacking
+every per-input gradient before reducing makes memory grow with the dataset
+(and with the number of tokens for token-level granularities); the
+accumulators here only keep one row's worth of state.
+"""
+
+import torch
+
+
+class RunningAbsMean:
+    """Mean (and optionally variance) of `|x|` over the first dimension.
+
+    Batches are merged with Chan et al.'s parallel form of Welford's update,
+    in float64, so the result matches `x.abs().mean(0)` on the concatenated
+    rows to float32 precision whatever the batch boundaries.
+    """
+
+    def __init__(self, track_variance: bool = False):
+        self.track_variance = track_variance
+        self.count = 0
+        self._mean: torch.Tensor | None = None
+        self._m2: torch.Tensor | None = None
+
+    def update(self, batch: torch.Tensor) -> None:
+        if batch.shape[0] == 0:
+            return
+        values = batch.detach().abs().to(torch.float64)
+        n_batch = values.shape[0]
+        batch_mean = values.mean(0)
+        if self._mean is None:
+            self.count = n_batch
+            self._mean = batch_mean
+            if self.track_variance:
+                self._m2 = ((values - batch_mean) ** 2).sum(0)
+            return
+
+        total = self.count + n_batch
+        delta = batch_mean - self._mean
+        self._mean += delta * (n_batch / total)
+        if self.track_variance:
+            batch_m2 = ((values - batch_mean) ** 2).sum(0)
+            self._m2 += batch_m2 + delta**2 * (self.count * n_batch / total)
+        self.count = total
+
+    @property
+    def mean(self) -> torch.Tensor:
+        if self._mean is None:
+            raise ValueError("No rows were accumulated.")
+        return self._mean.float()
+
+    @property
+    def variance(self) -> torch.Tensor:
+        """Population variance of `|x|`, as `x.abs().var(0, correction=0)`."""
+        if not self.track_variance:
+            raise ValueError("Variance was not tracked: pass track_variance=True.")
+        if self._m2 is None:
+            raise ValueError("No rows were accumulated.")
+        return (self._m2 / self.count).float()
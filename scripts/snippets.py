@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Code snippets of the attribution explanations, and a command rebuilding them.
+
+Every attribution HTML file has a minimal .py snippet next to it, rendered
+from the templates below by classification_attributions.py and
+generation_attributions.py. Running this script rewrites the snippets of
+every existing attribution HTML file under explanations/ from the current
+templates and configuration, without torch, models or recomputation:
+
+    python scripts/snippets.py            # rewrite every attribution snippet
+    python scripts/snippets.py --check    # only report what would change
+
+The configuration (model ids, class names, granularity, methods) is read from
+the "Configuration" blocks of the two pipelines with ast, without importing
+them. Sample texts and generation targets come from the raw results (see
+results_store.py) when they are stored, else from the existing snippet.
+
+A snippet whose parameters (explainer, granularity, model, classes, inputs,
+targets) disagree with the stored results metadata or with the existing
+snippet is reported and left as is: the HTML next to it was computed with
+the old parameters, so either the configuration drifted, or the explanation
+must be computed again. Pass --force to rewrite those too.
+"""
+
+import argparse
+import ast
+import importlib
+import json
+from pathlib import Path
+
+
+SCRIPTS = Path(__file__).resolve().parent
+ROOT = SCRIPTS.parent
+EXPLANATIONS_ROOT = ROOT / "explanations"
+# results_store.RESULTS_ROOT, not imported: results_store needs torch.
+RESULTS_ROOT = ROOT / "results"
+
+CLASSIFICATION_SCOPES = ("all-classes", "single-class")
+# Granularity of every attribution method when the snippet does not set one.
+DEFAULT_GRANULARITY = "WORD"
+GENERATION_SCOPES = ("general",)
+
+
+# ----------------------------
+# Templates
+# ----------------------------
+def python_source(value) -> str:
+    """Python source for a parameter value in the snippets (the concept
+    pipelines' fit and init parameters included)."""
+    if not isinstance(value, type):
+        return repr(value)
+    if value.__module__.startswith("interpreto"):
+        return value.__name__  # imported by name in the snippet
+    # Shortest public path, e.g. torch.optim.Adam rather than torch.optim.adam.Adam.
+    parts = value.__module__.split(".")
+    for end in range(1, len(parts) + 1):
+        module = importlib.import_module(".".join(parts[:end]))
+        if getattr(module, value.__name__, None) is value:
+            return f"{module.__name__}.{value.__name__}"
+    return f"{value.__module__}.{value.__name__}"
+
+
+def classification_attribution_snippet(
+    explainer_name: str,
+    sample_text: str,
+    model_hf_id: str,
+    classes_names: list[str],
+    scope: str,
+    granularity: str | None = None,
+) -> str:
+    if scope == "all-classes":
+        targets = "torch.arange(len(classes_names))"
+    else:
+        targets = "None"
+    if granularity is None:
+        imports = f"{explainer_name}, plot_attributions"
+        explainer = f"{explainer_name}(model, tokenizer)"
+    else:
+        imports = f"{explainer_name}, Granularity, plot_attributions"
+        explainer = f"{explainer_name}(model, tokenizer, granularity=Granularity.{granularity})"
+
+    return f"""import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from interpreto import {imports}
+
+model_id = {model_hf_id!r}
+classes_names = {classes_names!r}
+
+tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True)
+model = AutoModelForSequenceClassification.from_pretrained(model_id)
+explainer = {explainer}
+
+attributions = explainer(
+    model_inputs={sample_text!r},
+    targets={targets}
+)
+plot_attributions(attributions[0], classes_names=classes_names)
+"""
+
+
+def generation_attribution_snippet(
+    explainer_name: str,
+    sample_text: str,
+    target_text: str,
+    model_hf_id: str,
+) -> str:
+    return f"""from transformers import AutoTokenizer, AutoModelForCausalLM
+from interpreto import {explainer_name}, plot_attributions
+
+tokenizer = AutoTokenizer.from_pretrained({model_hf_id!r}, use_fast=True)
+model = AutoModelForCausalLM.from_pretrained({model_hf_id!r})
+
+explainer = {explainer_name}(model, tokenizer)
+attributions = explainer(
+    model_inputs={sample_text!r},
+    targets={target_text!r}
+)
+plot_attributions(attributions[0])
+"""
+
+
+# ----------------------------
+# Configuration and snippet parsing
+# ----------------------------
+def _constant(node: ast.expr):
+    # Classes (the METHODS values) are returned by name.
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Dict):
+        return {_constant(k): _constant(v) for k, v in zip(node.keys, node.values, strict=True)}
+    return ast.literal_eval(node)
+
+
+def pipeline_config(script: str, names: tuple[str, ...]) -> dict:
+    """The module-level constants `names` of scripts/`script`, read from its
+    source, so that neither the pipeline nor torch is imported."""
+    tree = ast.parse((SCRIPTS / script).read_text(encoding="utf-8"))
+    config = {}
+    for node in tree.body:
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id in names
+        ):
+            config[node.targets[0].id] = _constant(node.value)
+    return config
+
+
+def snippet_parameters(source: str) -> dict:
+    """The explainer, granularity, model id, class names, inputs and targets
+    of an attribution snippet."""
+    parameters = {"granularity": DEFAULT_GRANULARITY}
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            name, value = node.targets[0].id, node.value
+            if name in ("model_id", "classes_names"):
+                parameters[name] = ast.literal_eval(value)
+            elif name == "explainer" and isinstance(value, ast.Call):
+                parameters["explainer"] = ast.unparse(value.func)
+                for keyword in value.keywords:
+                    if keyword.arg == "granularity":
+                        parameters["granularity"] = ast.unparse(keyword.value).split(".")[-1]
+            elif name == "attributions" and isinstance(value, ast.Call):
+                for keyword in value.keywords:
+                    if keyword.arg in ("model_inputs", "targets"):
+                        parameters[keyword.arg] = (
+                            keyword.value.value
+                            if isinstance(keyword.value, ast.Constant)
+                            else ast.unparse(keyword.value)
+                        )
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "from_pretrained"
+            and node.args
+            and isinstance(node.args[0], ast.Constant)
+        ):
+            parameters.setdefault("model_id", node.args[0].value)
+    return parameters
+
+
+def _stored_record(
+    model_id: str, scope: str, method_name: str, sample: int
+) -> tuple[dict, dict] | None:
+    """Table and record metadata of a stored attribution, if any."""
+    meta_path = RESULTS_ROOT / model_id / "attribution" / scope / method_name / "meta.json"
+    if not meta_path.exists():
+        return None
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    if sample not in meta["samples"]:
+        return None
+    return meta["metadata"], meta["records"][meta["samples"].index(sample)]
+
+
+def _stored_parameters(table: dict, record: dict) -> dict:
+    """`snippet_parameters` keys recorded by the pipelines in results/."""
+    parameters = {"model_id": table["hf_model_id"], "model_inputs": record["input"]}
+    if "classes_names" in table:
+        parameters["classes_names"] = table["classes_names"]
+    if "target" in record:
+        parameters["targets"] = record["target"]
+    if "granularity" in record:
+        parameters["granularity"] = record["granularity"]
+    return parameters
+
+
+def _disagreements(expected: dict, found: dict) -> list[str]:
+    return [
+        f"{name}: {found[name]!r} instead of {expected[name]!r}"
+        for name in expected
+        if name in found and found[name] != expected[name]
+    ]
+
+
+# ----------------------------
+# Regeneration
+# ----------------------------
+def regenerate(check: bool = False, force: bool = False, models: list[str] | None = None) -> int:
+    """Rewrite (or with `check`, count) the stale attribution snippets;
+    returns the number of snippets with mismatched parameters."""
+    classification = pipeline_config("classification_attributions.py", ("MODEL_CONFIGS", "METHODS"))
+    generation = pipeline_config("generation_attributions.py", ("HF_MODEL_IDS", "METHODS"))
+
+    counts = {"snippets": 0, "stale": 0, "mismatched": 0, "skipped": 0}
+    for html_path in sorted(EXPLANATIONS_ROOT.glob("*/attribution/*/sample-*/*.html")):
+        model_id, scope = html_path.parents[3].name, html_path.parents[1].name
+        method_name, sample = html_path.stem, int(html_path.parent.name.split("-")[1])
+        code_path = html_path.with_suffix(".py")
+        relative = code_path.relative_to(EXPLANATIONS_ROOT)
+        if models and model_id not in models:
+            continue
+        config, methods = None, {}
+        if scope in CLASSIFICATION_SCOPES:
+            config = classification["MODEL_CONFIGS"].get(model_id)
+            methods = classification["METHODS"]
+        elif scope in GENERATION_SCOPES:
+            config = generation["HF_MODEL_IDS"].get(model_id)
+            methods = generation["METHODS"]
+        if config is None or method_name not in methods:
+            print(f"{relative}: no configuration for {model_id} {scope} {method_name}, skipped")
+            counts["skipped"] += 1
+            continue
+
+        published = (
+            snippet_parameters(code_path.read_text(encoding="utf-8"))
+            if code_path.exists()
+            else {}
+        )
+        stored = _stored_record(model_id, scope, method_name, sample)
+        stored_parameters = _stored_parameters(*stored) if stored is not None else {}
+        sample_text = stored_parameters.get("model_inputs", published.get("model_inputs"))
+        if sample_text is None:
+            print(f"{relative}: no stored or published sample text, skipped")
+            counts["skipped"] += 1
+            continue
+
+        if scope in CLASSIFICATION_SCOPES:
+            snippet = classification_attribution_snippet(
+                explainer_name=methods[method_name],
+                sample_text=sample_text,
+                model_hf_id=config["hf_model_id"],
+                classes_names=config["classes_names"],
+                scope=scope,
+                granularity=config.get("granularity"),
+            )
+        else:
+            target_text = stored_parameters.get("targets", published.get("targets"))
+            snippet = generation_attribution_snippet(
+                explainer_name=methods[method_name],
+                sample_text=sample_text,
+                target_text=target_text,
+                model_hf_id=config,
+            )
+        counts["snippets"] += 1
+
+        expected = snippet_parameters(snippet)
+        disagreements = [
+            f"results metadata {line}" for line in _disagreements(expected, stored_parameters)
+        ] + [f"published snippet {line}" for line in _disagreements(expected, published)]
+        if disagreements:
+            counts["mismatched"] += 1
+            print(f"{relative}:")
+            for line in disagreements:
+                print(f"    {line}")
+            if not force:
+                continue
+
+        if published and code_path.read_text(encoding="utf-8") == snippet:
+            continue
+        counts["stale"] += 1
+        if not check:
+            code_path.write_text(snippet, encoding="utf-8")
+
+    action = "to rewrite" if check else "rewritten"
+    print(
+        f"{counts['snippets']} snippets: {counts['stale']} {action}, "
+        f"{counts['mismatched']} with mismatched parameters"
+        f"{'' if force else ' (left as is)'}, {counts['skipped']} skipped"
+    )
+    return counts["mismatched"]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Report stale and mismatched snippets without writing; exit 1 on a mismatch.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Also rewrite the snippets whose parameters disagree with the stored ones.",
+    )
+    parser.add_argument(
+        "--models", nargs="+", help="Only these model ids (e.g. clf:imdb:distilbert)."
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    mismatched = regenerate(check=args.check, force=args.force, models=args.models)
+    return 1 if args.check and mismatched else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
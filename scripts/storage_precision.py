@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Compare concept fits on float32, float16 and bfloat16 stored activations.
+
+The concept pipelines can keep their activation_store/ entries in half
+precision (ACTIVATION_STORE_DTYPE), which halves the disk and page cache
+footprint of the activations. Fits and encoders read them through float32
+copies of one chunk at a time. `--report` stores the same activations in each
+dtype and, for a few concept methods, fits one model per dtype and reports:
+
+- the size of the stored activations, and their relative rounding error;
+- fit time and peak anonymous memory (the memory-mapped activations are
+  file-backed and not counted, the float32 copies are);
+- how close each half-precision fit is to the float32 one: the mean, over
+  the float32 concepts, of the best absolute cosine similarity with a
+  concept of the other dictionary, and the same matching on the concept
+  activations of the first EVAL_ROWS rows (absolute correlation).
+
+It runs on synthetic activations by default, or on an existing store entry
+with `--entry KEY` (the directory name under activation_store/).
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from interpreto.concepts import ICAConcepts, PCAConcepts, SemiNMFConcepts, VanillaSAEConcepts
+
+from activation_store import (
+    CHUNK_ROWS,
+    STORE_ROOT,
+    float32_chunks,
+    read_activations,
+    write_activations,
+)
+from fit_scheduler import fit_explainer
+from memory_usage import PeakRSSMonitor, format_bytes, release_free_memory
+from minibatch_ica import fit_ica
+from out_of_core_sae import fit_sae_out_of_core, stand_in_model
+from streaming_decompositions import fit_decomposition
+
+
+DTYPES = (torch.float32, torch.float16, torch.bfloat16)
+
+# name: (explainer class, fitter, fit kwargs). Semi-NMF is fitted in memory,
+# so it shows the cost of upcasting a whole half-precision matrix.
+METHODS = {
+    "pca (gram)": (PCAConcepts, fit_decomposition, {"solver": "gram"}),
+    "ica (minibatch)": (ICAConcepts, fit_ica, {"log_every": 0}),
+    "semi_nmf (in memory)": (SemiNMFConcepts, fit_explainer, {}),
+    "vanilla_sae (out of core)": (
+        VanillaSAEConcepts,
+        fit_sae_out_of_core,
+        {"batch_size": 1024, "nb_epochs": 2, "buffer_rows": 2**16},
+    ),
+}
+
+EVAL_ROWS = 8192
+SEED = 0
+
+
+def _synthetic_activations(n_rows: int, d: int, rank: int, seed: int = SEED):
+    generator = torch.Generator().manual_seed(seed)
+    basis = torch.randn(rank, d, generator=generator)
+    offset = torch.randn(d, generator=generator)
+    # A few outlier dimensions, as in transformer residual streams, whose
+    # magnitude sets the rounding error of the others in half precision.
+    offset[:4] *= 50
+    for start in range(0, n_rows, CHUNK_ROWS):
+        rows = min(CHUNK_ROWS, n_rows - start)
+        codes = torch.distributions.Laplace(0.0, 1.0).sample((rows, rank))
+        noise = 0.05 * torch.randn(rows, d, generator=generator)
+        yield {"activations": codes @ basis + offset + noise}
+
+
+def _stored_entry(key: str, tensor_name: str | None) -> torch.Tensor:
+    meta = json.loads((STORE_ROOT / key / "meta.json").read_text(encoding="utf-8"))
+    activations = read_activations(meta["fields"])
+    if activations is None:
+        raise SystemExit(f"No activation_store/ entry {key!r}.")
+    if tensor_name is None:
+        tensor_name = next(
+            name
+            for name, tensor in activations.items()
+            if tensor.is_floating_point() and tensor.dim() == 2
+        )
+    print(f"Entry {key}, tensor {tensor_name!r}")
+    return activations[tensor_name]
+
+
+def _best_match(reference: torch.Tensor, other: torch.Tensor) -> float:
+    """Mean over the rows of `reference` of their best absolute cosine
+    similarity with a row of `other`."""
+    reference = torch.nn.functional.normalize(reference.double(), dim=1)
+    other = torch.nn.functional.normalize(other.double(), dim=1)
+    return (reference @ other.T).abs().max(1).values.mean().item()
+
+
+def _relative_error(reference: torch.Tensor, stored: torch.Tensor) -> float:
+    error = total = 0.0
+    for a, b in zip(float32_chunks(reference), float32_chunks(stored), strict=True):
+        error += (a.double() - b.double()).pow(2).sum().item()
+        total += a.double().pow(2).sum().item()
+    return (error / total) ** 0.5
+
+
+def report(activations: torch.Tensor, nb_concepts: int) -> None:
+    n_rows, d = activations.shape
+    model_with_split_points = stand_in_model(d)
+    eval_rows = activations[:EVAL_ROWS].float()
+    with tempfile.TemporaryDirectory() as tmp:
+        stored = {}
+        for dtype in DTYPES:
+            fields = {"report": "storage_precision", "rows": n_rows, "d": d}
+            chunks = ({"activations": chunk} for chunk in float32_chunks(activations))
+            write_activations(fields, chunks, dtype=dtype, root=Path(tmp) / str(dtype))
+            stored[dtype] = read_activations(fields, root=Path(tmp) / str(dtype))["activations"]
+            print(
+                f"{dtype}: {format_bytes(stored[dtype].numel() * stored[dtype].element_size())} "
+                f"stored, relative rounding error {_relative_error(activations, stored[dtype]):.1e}"
+            )
+
+        for method_name, (explainer_cls, fitter, fit_kwargs) in METHODS.items():
+            print(f"\n{method_name}, {nb_concepts} concepts on {n_rows:,} x {d}")
+            reference = None
+            for dtype in DTYPES:
+                torch.manual_seed(SEED)
+                np.random.seed(SEED)
+                explainer = explainer_cls(model_with_split_points, nb_concepts=nb_concepts)
+                release_free_memory()
+                with PeakRSSMonitor(anonymous=True) as monitor:
+                    start = time.perf_counter()
+                    fitter(explainer, stored[dtype], **fit_kwargs)
+                    seconds = time.perf_counter() - start
+                torch.manual_seed(SEED)
+                with torch.no_grad():
+                    fitted = (
+                        explainer.get_dictionary().detach().float().cpu(),
+                        explainer.encode_activations(eval_rows).float().cpu(),
+                    )
+                line = f"  {dtype}: {seconds:.1f}s, peak anonymous memory {format_bytes(monitor.increase)}"
+                if reference is None:
+                    reference = fitted
+                else:
+                    line += (
+                        f", dictionary match {_best_match(reference[0], fitted[0]):.4f}, "
+                        f"activation match {_best_match(reference[1].T, fitted[1].T):.4f}"
+                    )
+                print(line)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Fit each method on float32, float16 and bfloat16 copies of the activations.",
+    )
+    parser.add_argument("--entry", help="activation_store/ entry to use instead of synthetic activations.")
+    parser.add_argument("--tensor", help="Tensor of the entry (default: its first activation matrix).")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--concepts", type=int, default=32)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if not args.report:
+        print("Nothing to do: pass --report.")
+        return 1
+    torch.manual_seed(SEED)
+    if args.entry is not None:
+        activations = _stored_entry(args.entry, args.tensor)
+        report(activations, args.concepts)
+        return 0
+    with tempfile.TemporaryDirectory() as tmp:
+        fields = {"report": "storage_precision", "rows": args.rows, "d": args.dim}
+        write_activations(
+            fields, _synthetic_activations(args.rows, args.dim, rank=4 * args.concepts), root=Path(tmp)
+        )
+        activations = read_activations(fields, root=Path(tmp))["activations"]
+        report(activations, args.concepts)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Alternative solvers for the SVD and PCA concept models.
+
+`SVDConcepts` and `PCAConcepts` hand the whole activation matrix to
+scikit-learn, which copies (and for PCA, centers) it in memory. With
+token-level activations over thousands of documents the matrix has millions
+of rows. The solvers here fill the same `SVDWrapper` / `PCAWrapper`
+parameters:
+
+- "exact": scikit-learn's full (PCA) or ARPACK (SVD) solver, in memory;
+- "randomized": scikit-learn's randomized solver, in memory (the default
+  of TruncatedSVD);
+- "incremental": IncrementalPCA, fed `chunk_rows` rows at a time (PCA only);
+- "gram": one pass over the rows accumulating `X^T X` (and the row sum for
+  PCA) in float64, then an eigendecomposition of that d x d matrix. Exact up
+  to floating point, and memory does not depend on the number of rows.
+
+The streaming solvers slice the activations, so a memory map from
+activation_store/ is read chunk by chunk and never loaded in full.
+
+Run `python scripts/streaming_decompositions.py --benchmark` to compare
+time, peak memory and explained variance of every solver. Memory is the
+increase of anonymous memory: the pages of the memory-mapped activations are
+file-backed and can be evicted.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from sklearn.decomposition import PCA, IncrementalPCA, TruncatedSVD
+
+from interpreto.concepts.methods.sklearn_wrappers import PCAWrapper, SVDWrapper
+
+from activation_store import read_activations, write_activations
+from memory_usage import PeakRSSMonitor, format_bytes, release_free_memory
+
+
+SOLVERS = {
+    SVDWrapper: ("exact", "randomized", "gram"),
+    PCAWrapper: ("exact", "randomized", "incremental", "gram"),
+}
+
+CHUNK_ROWS = 8192
+
+
+def _chunks(activations: torch.Tensor, chunk_rows: int):
+    for start in range(0, activations.shape[0], chunk_rows):
+        yield activations[start : start + chunk_rows].double()
+
+
+def _gram_components(
+    activations: torch.Tensor, nb_concepts: int, centered: bool, chunk_rows: int
+) -> tuple[np.ndarray, np.ndarray | None]:
+    d = activations.shape[1]
+    gram = torch.zeros(d, d, dtype=torch.float64)
+    total = torch.zeros(d, dtype=torch.float64)
+    for chunk in _chunks(activations, chunk_rows):
+        gram += chunk.T @ chunk
+        total += chunk.sum(0)
+    mean = None
+    if centered:
+        mean = total / activations.shape[0]
+        gram -= activations.shape[0] * torch.outer(mean, mean)
+    _, eigenvectors = torch.linalg.eigh(gram)  # ascending eigenvalues
+    components = eigenvectors[:, -nb_concepts:].flip(1).T
+    # Deterministic signs, as scikit-learn's svd_flip: largest entry positive.
+    signs = torch.sign(components.gather(1, components.abs().argmax(1, keepdim=True)))
+    components = components * signs
+    return components.numpy(), None if mean is None else mean.numpy()
+
+
+def fit_concept_model(
+    concept_model,
+    activations: torch.Tensor,
+    solver: str,
+    chunk_rows: int = CHUNK_ROWS,
+) -> None:
+    """Fit an `SVDWrapper` or `PCAWrapper` on `(rows, d)` activations."""
+    allowed = SOLVERS.get(type(concept_model))
+    if allowed is None or solver not in allowed:
+        raise ValueError(
+            f"Solver {solver!r} is not available for {type(concept_model).__name__}; "
+            f"choose from {allowed}."
+        )
+    nb_concepts = concept_model.nb_concepts
+    random_state = concept_model.random_state
+    is_pca = isinstance(concept_model, PCAWrapper)
+
+    mean = None
+    if solver == "gram":
+        components, mean = _gram_components(activations, nb_concepts, is_pca, chunk_rows)
+    elif solver == "incremental":
+        decomposition = IncrementalPCA(n_components=nb_concepts)
+        for chunk in _chunks(activations, chunk_rows):
+            decomposition.partial_fit(chunk.numpy())
+        components, mean = decomposition.components_, decomposition.mean_
+    else:
+        data = activations.detach().cpu().float().numpy()
+        if is_pca:
+            svd_solver = "full" if solver == "exact" else "randomized"
+            decomposition = PCA(nb_concepts, svd_solver=svd_solver, random_state=random_state)
+        else:
+            algorithm = "arpack" if solver == "exact" else "randomized"
+            decomposition = TruncatedSVD(nb_concepts, algorithm=algorithm, random_state=random_state)
+        decomposition.fit(data)
+        components = decomposition.components_
+        mean = getattr(decomposition, "mean_", None)
+
+    device = concept_model.components.device
+    # ARPACK returns its components with a negative stride.
+    components = np.ascontiguousarray(components)
+    concept_model.components.data = torch.as_tensor(components, dtype=torch.float32, device=device)
+    if is_pca:
+        concept_model.mean.data = torch.as_tensor(mean, dtype=torch.float32, device=device)
+    concept_model.fitted = True
+
+
+def fit_decomposition(
+    concept_explainer,
+    activations: torch.Tensor,
+    solver: str,
+    chunk_rows: int = CHUNK_ROWS,
+    overwrite: bool = False,
+) -> None:
+    """`concept_explainer.fit(activations)` for SVDConcepts and PCAConcepts,
+    with one of the `SOLVERS`."""
+    split_activations = concept_explainer._prepare_fit(activations, overwrite=overwrite)
+    fit_concept_model(concept_explainer.concept_model, split_activations, solver, chunk_rows)
+
+
+def explained_variance(
+    concept_model, activations: torch.Tensor, chunk_rows: int = CHUNK_ROWS
+) -> float:
+    """Fraction of the (centered, for PCA) sum of squares captured by the
+    orthonormal components, computed chunk by chunk."""
+    components = concept_model.components.detach().double().cpu()
+    mean = (
+        concept_model.mean.detach().double().cpu()
+        if isinstance(concept_model, PCAWrapper)
+        else torch.zeros(components.shape[1], dtype=torch.float64)
+    )
+    captured = total = 0.0
+    for chunk in _chunks(activations, chunk_rows):
+        centered = chunk - mean
+        captured += (centered @ components.T).pow(2).sum().item()
+        total += centered.pow(2).sum().item()
+    return captured / total
+
+
+# ----------------------------
+# Benchmark
+# ----------------------------
+def _synthetic_activations(n_rows: int, d: int, rank: int, seed: int = 0):
+    generator = torch.Generator().manual_seed(seed)
+    basis = torch.randn(rank, d, generator=generator)
+    # Decaying spectrum plus an offset and noise, like transformer activations.
+    scales = torch.logspace(1, -1, rank)
+    offset = torch.randn(d, generator=generator)
+    for start in range(0, n_rows, CHUNK_ROWS):
+        rows = min(CHUNK_ROWS, n_rows - start)
+        codes = torch.randn(rows, rank, generator=generator) * scales
+        noise = 0.05 * torch.randn(rows, d, generator=generator)
+        yield {"activations": codes @ basis + offset + noise}
+
+
+def benchmark(n_rows: int, d: int, nb_concepts: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        fields = {"benchmark": "streaming_decompositions", "rows": n_rows, "d": d}
+        write_activations(fields, _synthetic_activations(n_rows, d, rank=4 * nb_concepts), root=Path(tmp))
+        activations = read_activations(fields, root=Path(tmp))["activations"]
+        print(
+            f"{n_rows:,} x {d} float32 activations "
+            f"({format_bytes(activations.numel() * 4)}, memory-mapped), {nb_concepts} concepts"
+        )
+        for wrapper_cls, solvers in SOLVERS.items():
+            for solver in solvers:
+                concept_model = wrapper_cls(nb_concepts=nb_concepts, input_size=d)
+                release_free_memory()
+                with PeakRSSMonitor(anonymous=True) as monitor:
+                    start = time.perf_counter()
+                    fit_concept_model(concept_model, activations, solver)
+                    seconds = time.perf_counter() - start
+                print(
+                    f"{wrapper_cls.__name__} {solver}: {seconds:.1f}s, peak anonymous memory "
+                    f"{format_bytes(monitor.increase)}, explained variance "
+                    f"{explained_variance(concept_model, activations):.4f}"
+                )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Compare every solver on synthetic memory-mapped activations.",
+    )
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--concepts", type=int, default=30)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if not args.benchmark:
+        print("Nothing to do: pass --benchmark, or call fit_decomposition from a pipeline.")
+        return 1
+    benchmark(args.rows, args.dim, args.concepts)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
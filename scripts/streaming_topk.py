@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""Top-k concept labels in memory independent of the corpus size.
+
+`TopKInputs.interpret` encodes every granular input (word, token, ...) into
+one `(inputs, concepts)` matrix, then runs `torch.topk` over it with
+`k * (occurrences of the most frequent input)` candidates per concept, so
+that `k` distinct inputs survive deduplication. With thousands of concepts
+and word-level inputs, where "the" alone occurs thousands of times, both
+are far larger than the labels.
+
+`StreamingTopK` instead keeps, for every concept, the `k` best distinct
+inputs seen so far. Each chunk of concept activations is reduced to the
+maximum activation of each distinct input in the chunk
+(`scatter_reduce`), the `k` best of those are merged with the running ones,
+and an input present in both keeps its larger activation. Memory is
+`O(concepts * k)` plus one chunk. The labels are those of `TopKInputs`:
+each concept's `k` most activating distinct inputs with their best
+activation, stopping at the first zero activation, and None when there is
+none. Only the order of exact ties can differ.
+
+Run `python scripts/streaming_topk.py --self-check` to compare with
+`TopKInputs` on random activations.
+"""
+
+import argparse
+import time
+from collections.abc import Iterable
+
+import torch
+
+from activation_store import float32_chunks
+from memory_usage import PeakRSSMonitor, format_bytes, release_free_memory
+
+
+class StreamingTopK:
+    """The `k` largest activations of distinct inputs, for each of
+    `nb_concepts` concepts, over successive chunks."""
+
+    def __init__(self, nb_concepts: int, k: int):
+        self.k = k
+        # (k, concepts), sorted in decreasing order; unfilled slots are -inf.
+        self.values = torch.full((k, nb_concepts), float("-inf"))
+        self.ids = torch.full((k, nb_concepts), -1, dtype=torch.long)
+        # earlier[j, i]: slot i comes before slot j.
+        self._earlier = torch.ones(2 * k, 2 * k, dtype=torch.bool).tril(-1)
+
+    def update(self, concepts_activations: torch.Tensor, input_ids: torch.Tensor) -> None:
+        """Add `(rows, concepts)` activations of the inputs `input_ids` `(rows,)`."""
+        concepts_activations = concepts_activations.float()
+        nb_concepts = concepts_activations.shape[1]
+        unique_ids, inverse = input_ids.unique(return_inverse=True)
+        # Best activation of each distinct input of the chunk, per concept.
+        best = torch.full((len(unique_ids), nb_concepts), float("-inf")).scatter_reduce(
+            0, inverse[:, None].expand(-1, nb_concepts), concepts_activations, "amax"
+        )
+        top_values, top_rows = best.topk(min(self.k, len(unique_ids)), dim=0)
+        values = torch.cat([self.values, top_values])
+        ids = torch.cat([self.ids, unique_ids[top_rows]])
+
+        order = values.argsort(dim=0, descending=True, stable=True)
+        values, ids = values.gather(0, order), ids.gather(0, order)
+        # An input in both keeps its first, i.e. larger, activation.
+        earlier = self._earlier[: len(ids), : len(ids), None]
+        duplicate = ((ids[:, None, :] == ids[None, :, :]) & earlier).any(1) & (ids >= 0)
+        values = values.masked_fill(duplicate, float("-inf"))
+
+        order = values.argsort(dim=0, descending=True, stable=True)[: self.k]
+        self.values, self.ids = values.gather(0, order), ids.gather(0, order)
+
+    def labels(
+        self, inputs: list[str], concepts_indices: Iterable[int]
+    ) -> dict[int, dict[str, float] | None]:
+        """`TopKInputs.interpret` output: `{concept: {input: activation}}`,
+        where `self.ids` index `inputs`."""
+        interpretation: dict[int, dict[str, float] | None] = {}
+        values, ids = self.values.T.tolist(), self.ids.T.tolist()
+        for concept in concepts_indices:
+            words = {}
+            for value, input_id in zip(values[concept], ids[concept], strict=True):
+                if input_id < 0 or value == 0:
+                    break
+                words[inputs[input_id]] = value
+            interpretation[concept] = words or None
+        return interpretation
+
+
+def granular_inputs(model_with_split_points, inputs: list[str], granularity) -> list[str]:
+    """The granular inputs (words, tokens, ...) matching the rows of
+    `get_activations(inputs, granularity)`, as `TopKInputs` splits them."""
+    granularity_name = getattr(granularity, "name", granularity)
+    if granularity_name in ("SAMPLE", "CLS_TOKEN"):
+        return list(inputs)
+    tokenizer = model_with_split_points.tokenizer
+    tokens = tokenizer(
+        inputs, return_tensors="pt", padding=True, truncation=True, return_offsets_mapping=True
+    )
+    texts = granularity.value.get_decomposition(tokens, tokenizer=tokenizer, return_text=True)
+    return [text for sample_texts in texts for text in sample_texts]
+
+
+def topk_inputs(
+    concept_explainer,
+    latent_activations: torch.Tensor,
+    inputs: list[str],
+    k: int,
+    concepts_indices: list[int] | str = "all",
+    chunk_rows: int = 1024,
+) -> dict[int, dict[str, float] | None]:
+    """`TopKInputs(concept_explainer, k=k).interpret(...)` on the granular
+    `inputs` and their `(rows, d)` latent activations, encoded `chunk_rows`
+    rows at a time (upcast to float32) and reduced by a `StreamingTopK`.
+
+    `chunk_rows` defaults to TopKInputs' own encoding batches, which matters
+    for semi-NMF, whose encoding depends on the batch.
+    """
+    if len(inputs) != latent_activations.shape[0]:
+        raise ValueError(
+            f"{len(inputs)} granular inputs but {latent_activations.shape[0]} activation rows."
+        )
+    # Distinct inputs share an id, so that each is labelled once per concept.
+    ids: dict[str, int] = {}
+    input_ids = torch.tensor([ids.setdefault(text, len(ids)) for text in inputs])
+    distinct_inputs = list(ids)
+
+    nb_concepts = concept_explainer.concept_model.nb_concepts
+    streaming = StreamingTopK(nb_concepts, k)
+    start = 0
+    with torch.no_grad():
+        for chunk in float32_chunks(latent_activations, chunk_rows):
+            concepts_activations = concept_explainer.encode_activations(chunk).cpu()
+            streaming.update(concepts_activations, input_ids[start : start + chunk.shape[0]])
+            start += chunk.shape[0]
+    if concepts_indices == "all":
+        concepts_indices = list(range(nb_concepts))
+    return streaming.labels(distinct_inputs, concepts_indices)
+
+
+# ----------------------------
+# Self-check
+# ----------------------------
+def self_check() -> bool:
+    # Imported here: only the check needs interpreto's TopKInputs.
+    from interpreto.concepts import NeuronsAsConcepts
+    from interpreto.concepts.interpretations import TopKInputs
+
+    from out_of_core_sae import stand_in_model
+
+    ok = True
+    generator = torch.Generator().manual_seed(0)
+    n_rows, nb_concepts, vocabulary, k = 20_000, 64, 3000, 5
+    # Zipf-like word frequencies, so that a few words occur thousands of times.
+    frequencies = 1 / torch.arange(1, vocabulary + 1).float()
+    word_ids = torch.multinomial(frequencies, n_rows, replacement=True, generator=generator)
+    inputs = [f"word{i}" for i in word_ids.tolist()]
+    # Continuous activations (no ties), half of them clipped to zero like an SAE's.
+    activations = torch.randn(n_rows, nb_concepts, generator=generator).clamp_min(0.5) - 0.5
+    activations[:, : nb_concepts // 8] -= 1  # concepts never above zero
+
+    # NeuronsAsConcepts encodes activations as they are: concepts = activations.
+    explainer = NeuronsAsConcepts(stand_in_model(nb_concepts))
+    cls_token = explainer.model_with_split_points.activation_granularities.CLS_TOKEN
+    release_free_memory()
+    with PeakRSSMonitor(anonymous=True) as monitor:
+        start = time.perf_counter()
+        reference = TopKInputs(
+            concept_explainer=explainer, activation_granularity=cls_token, k=k
+        ).interpret(inputs=inputs, concepts_indices="all", concepts_activations=activations)
+        seconds = time.perf_counter() - start
+    print(f"TopKInputs: {seconds:.2f}s, peak anonymous memory {format_bytes(monitor.increase)}")
+    release_free_memory()
+    with PeakRSSMonitor(anonymous=True) as monitor:
+        start = time.perf_counter()
+        streamed = topk_inputs(explainer, activations, inputs, k, chunk_rows=1000)
+        seconds = time.perf_counter() - start
+    print(f"streaming: {seconds:.2f}s, peak anonymous memory {format_bytes(monitor.increase)}")
+
+    same_words = all(
+        (reference[c] is None and streamed[c] is None)
+        or (
+            reference[c] is not None
+            and streamed[c] is not None
+            and list(reference[c]) == list(streamed[c])
+        )
+        for c in range(nb_concepts)
+    )
+    same_values = all(
+        abs(a - b) < 1e-6
+        for c in range(nb_concepts)
+        if reference[c] is not None and streamed[c] is not None
+        for a, b in zip(reference[c].values(), streamed[c].values())
+    )
+    ok &= same_words and same_values
+    print(f"same labels as TopKInputs: {same_words}, same activations: {same_values}")
+    return ok
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--self-check",
+        action="store_true",
+        help="Compare with TopKInputs on random activations.",
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if args.self_check:
+        return 0 if self_check() else 1
+    print("Nothing to do: pass --self-check, or call topk_inputs from a pipeline.")
+    return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
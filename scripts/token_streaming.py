@@ -0,0 +1,148 @@
+"""Token-level activations of long documents, streamed into the activation store.
+
+`get_activations` at TOKEN granularity on thousands of full documents keeps
+every token activation of every document in memory. Here instead:
+
+- each document is truncated to `max_tokens` tokens;
+- documents are packed, in order, into batches of at most `token_budget`
+  padded tokens, and each batch is one forward pass;
+- `tokens_per_document` token rows are kept from each document, drawn
+  uniformly at random ("random") or evenly spaced ("stride");
+- the kept rows are appended to an activation_store/ entry with the index of
+  their document and their position in it.
+
+The entry therefore holds at most `tokens_per_document` rows per document,
+however long the documents are, and only one batch of activations is ever in
+memory. Since a batch holds the whole of each document, the uniform draw is
+exactly what reservoir sampling over its token stream would keep.
+"""
+
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import torch
+
+from activation_store import STORE_ROOT, activation_key, read_activations, write_activations
+
+
+SAMPLING = ("random", "stride")
+
+
+def truncate(tokenizer, text: str, max_tokens: int) -> tuple[str, int]:
+    """`text` cut after its first `max_tokens` tokens, and its token count."""
+    encoding = tokenizer(
+        text,
+        truncation=True,
+        max_length=max_tokens,
+        return_offsets_mapping=True,
+        add_special_tokens=False,
+    )
+    offsets = encoding["offset_mapping"]
+    end = max((stop for _, stop in offsets), default=0)
+    return text[:end], len(offsets)
+
+
+def token_budget_batches(
+    tokenizer, documents: Iterable[str], token_budget: int, max_tokens: int
+) -> Iterator[list[str]]:
+    """Truncated `documents`, grouped so that each group padded to its
+    longest document has at most `token_budget` tokens."""
+    batch: list[str] = []
+    longest = 0
+    for text in documents:
+        text, n_tokens = truncate(tokenizer, text, max_tokens)
+        if batch and (len(batch) + 1) * max(longest, n_tokens) > token_budget:
+            yield batch
+            batch, longest = [], 0
+        batch.append(text)
+        longest = max(longest, n_tokens)
+    if batch:
+        yield batch
+
+
+def sample_positions(
+    n_tokens: int, k: int, sampling: str, generator: torch.Generator
+) -> torch.Tensor:
+    """Sorted positions of at most `k` of `n_tokens` tokens."""
+    if n_tokens <= k:
+        return torch.arange(n_tokens)
+    if sampling == "random":
+        return torch.randperm(n_tokens, generator=generator)[:k].sort().values
+    if sampling == "stride":
+        return torch.linspace(0, n_tokens - 1, k).round().long().unique()
+    raise ValueError(f"Unknown token sampling {sampling!r}; choose from {SAMPLING}.")
+
+
+def stream_token_activations(
+    model_with_split_points,
+    documents: Iterable[str],
+    fields: dict,
+    *,
+    token_budget: int,
+    max_tokens: int,
+    tokens_per_document: int,
+    sampling: str = "random",
+    seed: int = 0,
+    dtype: torch.dtype = torch.float32,
+    root: Path = STORE_ROOT,
+    log_every: int = 50,
+) -> dict[str, torch.Tensor]:
+    """Return the stored token activations for `fields`, streaming
+    `documents` through the model if needed.
+
+    Besides one `(rows, d)` tensor per split point, the entry has the
+    `document` index and token `position` of every row.
+    """
+    activations = read_activations(fields, root, dtype=dtype)
+    if activations is not None:
+        print(f"Loaded activations from {Path(root) / activation_key(**fields)}")
+        return activations
+    if sampling not in SAMPLING:
+        raise ValueError(f"Unknown token sampling {sampling!r}; choose from {SAMPLING}.")
+
+    token = model_with_split_points.activation_granularities.TOKEN
+    tokenizer = model_with_split_points.tokenizer
+    generator = torch.Generator().manual_seed(seed)
+    default_batch_size = model_with_split_points.batch_size
+
+    def chunks():
+        n_documents = n_tokens = n_rows = 0
+        start = time.perf_counter()
+        batches = token_budget_batches(tokenizer, documents, token_budget, max_tokens)
+        for i, batch in enumerate(batches, start=1):
+            # One forward pass per token-budgeted batch.
+            model_with_split_points.batch_size = len(batch)
+            batch_activations = model_with_split_points.get_activations(
+                inputs=batch,
+                activation_granularity=token,
+                flatten_activations=False,
+            )
+            split_points = model_with_split_points.split_points
+            chunk: dict[str, list[torch.Tensor]] = {
+                name: [] for name in [*split_points, "document", "position"]
+            }
+            for j, document_rows in enumerate(batch_activations[split_points[0]]):
+                positions = sample_positions(
+                    document_rows.shape[0], tokens_per_document, sampling, generator
+                )
+                for split_point in split_points:
+                    chunk[split_point].append(batch_activations[split_point][j][positions])
+                chunk["document"].append(torch.full_like(positions, n_documents + j))
+                chunk["position"].append(positions)
+                n_tokens += document_rows.shape[0]
+            n_documents += len(batch)
+            n_rows += sum(len(positions) for positions in chunk["position"])
+            if log_every and i % log_every == 0:
+                print(
+                    f"{n_documents:,} documents, {n_tokens:,} tokens, {n_rows:,} rows kept, "
+                    f"{n_tokens / (time.perf_counter() - start):,.0f} tokens/s"
+                )
+            yield {name: torch.cat(tensors) for name, tensors in chunk.items()}
+
+    try:
+        write_activations(fields, chunks(), dtype=dtype, root=root)
+    finally:
+        model_with_split_points.batch_size = default_batch_size
+    print(f"Stored activations in {Path(root) / activation_key(**fields)}")
+    return read_activations(fields, root)  # type: ignore
@@ -0,0 +1,91 @@
+"""Disk cache of the words that label concepts.
+
+Concepts are labelled with the most activating of a list of words:
+- in the classification pipelines, the unique words of the dataset (or of a
+  class), from `extract_ngrams`: NLTK tokenization, WordNet lemmatization
+  and counting of every word;
+- in the generation pipeline, every word of the labelling texts, split as
+  `TopKInputs` splits them: a tokenization with offsets mapped back to
+  words (see streaming_topk.granular_inputs).
+
+Neither depends on the concept method, and both only have to match the
+stored word activations. Each list is computed once and kept as JSON under
+vocabulary_cache/, named after a hash of the texts, the extraction
+parameters (and tokenizer and granularity for the split words) and the
+interpreto and nltk versions. The file is renamed into place once written,
+so an interrupted run leaves no entry.
+"""
+
+import hashlib
+import json
+from collections.abc import Callable
+from importlib.metadata import version
+from pathlib import Path
+
+from interpreto.concepts.interpretations import extract_ngrams
+
+from activation_store import activation_key
+from streaming_topk import granular_inputs
+
+
+ROOT = Path(__file__).resolve().parents[1]
+VOCABULARY_ROOT = ROOT / "vocabulary_cache"
+
+
+def texts_fingerprint(texts: list[str]) -> str:
+    digest = hashlib.sha256(str(len(texts)).encode())
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def _cached(fields: dict, compute: Callable[[], list[str]], root: Path) -> list[str]:
+    path = Path(root) / f"{activation_key(**fields)}.json"
+    if path.exists():
+        print(f"Loaded words from {path}")
+        return json.loads(path.read_text(encoding="utf-8"))["words"]
+    words = compute()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_suffix(".partial")
+    partial.write_text(
+        json.dumps({"fields": fields, "words": words}, default=str), encoding="utf-8"
+    )
+    partial.replace(path)
+    print(f"Stored {len(words):,} words in {path}")
+    return words
+
+
+def unique_words(
+    inputs: list[str], root: Path = VOCABULARY_ROOT, **unique_words_kwargs
+) -> list[str]:
+    """`extract_ngrams(inputs, n=1, **unique_words_kwargs)`, cached."""
+    fields = {
+        "texts": texts_fingerprint(inputs),
+        "unique_words": unique_words_kwargs,
+        "interpreto": version("interpreto"),
+        "nltk": version("nltk"),
+    }
+    return _cached(
+        fields,
+        lambda: list(extract_ngrams(inputs=inputs, n=1, **unique_words_kwargs)),
+        root,
+    )
+
+
+def split_words(
+    model_with_split_points, inputs: list[str], granularity, root: Path = VOCABULARY_ROOT
+) -> list[str]:
+    """`streaming_topk.granular_inputs(model_with_split_points, inputs,
+    granularity)`, cached."""
+    tokenizer = model_with_split_points.tokenizer
+    fields = {
+        "texts": texts_fingerprint(inputs),
+        "tokenizer": tokenizer.name_or_path,
+        "vocabulary": len(tokenizer),
+        "granularity": getattr(granularity, "name", str(granularity)),
+        "interpreto": version("interpreto"),
+    }
+    return _cached(
+        fields, lambda: granular_inputs(model_with_split_points, inputs, granularity), root
+    )
@@ -0,0 +1,95 @@
+"""Shared fixtures: tiny randomly initialised models that run on CPU in
+seconds, and the `scripts/` directory on the import path."""
+
+import sys
+from pathlib import Path
+
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from transformers import (
+    GPT2Config,
+    GPT2LMHeadModel,
+    LlamaConfig,
+    LlamaForCausalLM,
+    PreTrainedTokenizerFast,
+)
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+WORDS = "the a movie was good bad great terrible i liked it not very plot acting and but".split()
+
+
+def _word_tokenizer(padding_side: str) -> PreTrainedTokenizerFast:
+    special = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    vocab = {word: i for i, word in enumerate(special + WORDS)}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        pad_token="[PAD]",
+        unk_token="[UNK]",
+        cls_token="[CLS]",
+        sep_token="[SEP]",
+        mask_token="[MASK]",
+        bos_token="[CLS]",
+        eos_token="[SEP]",
+    )
+    tokenizer.padding_side = padding_side
+    return tokenizer
+
+
+@pytest.fixture(scope="session")
+def tokenizer():
+    """Left-padding tokenizer for the causal LMs."""
+    return _word_tokenizer("left")
+
+
+@pytest.fixture(scope="session")
+def classification_tokenizer():
+    """BERT-style tokenizer wrapping every input in [CLS] ... [SEP]."""
+    tokenizer = _word_tokenizer("right")
+    tokenizer.backend_tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]",
+        special_tokens=[("[CLS]", tokenizer.cls_token_id), ("[SEP]", tokenizer.sep_token_id)],
+    )
+    return tokenizer
+
+
+def _llama(tokenizer):
+    return LlamaForCausalLM(
+        LlamaConfig(
+            vocab_size=len(tokenizer),
+            hidden_size=16,
+            num_hidden_layers=2,
+            num_attention_heads=2,
+            num_key_value_heads=2,
+            intermediate_size=32,
+            pad_token_id=tokenizer.pad_token_id,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+    )
+
+
+def _gpt2(tokenizer):
+    return GPT2LMHeadModel(
+        GPT2Config(
+            vocab_size=len(tokenizer),
+            n_embd=16,
+            n_layer=2,
+            n_head=2,
+            n_positions=64,
+            pad_token_id=tokenizer.pad_token_id,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+    )
+
+
+# Rotary embeddings (Llama) only see relative positions, so left padding
+# without position ids only shows up with absolute ones (GPT-2).
+@pytest.fixture(scope="session", params=[_llama, _gpt2], ids=["llama", "gpt2"])
+def causal_lm(request, tokenizer):
+    torch.manual_seed(0)
+    return request.param(tokenizer).eval()
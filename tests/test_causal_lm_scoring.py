@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import torch
+from interpreto import (
+    GradientShap,
+    IntegratedGradients,
+    KernelShap,
+    Lime,
+    Occlusion,
+    Saliency,
+    SmoothGrad,
+)
+
+from causal_lm_scoring import disable_padded_batching, enable_padded_batching
+
+# Samples of different lengths, so that batches mix left-padded rows, and a
+# duplicated sample.
+INPUTS = ["the movie was", "i liked it not very", "a", "the movie was"]
+TARGETS = [
+    "the movie was good and",
+    "i liked it not very much bad",
+    "a plot",
+    "the movie was good and",
+]
+
+EXPLAINERS = [Occlusion, Lime, KernelShap, Saliency, IntegratedGradients, GradientShap, SmoothGrad]
+
+
+def attributions(explainer_cls, model, tokenizer, batch_size, padded, prefix_sharing=False):
+    torch.manual_seed(0)
+    np.random.seed(0)
+    explainer = explainer_cls(model, tokenizer, batch_size=batch_size)
+    if padded:
+        enable_padded_batching(explainer, prefix_sharing=prefix_sharing)
+    return [output.attributions for output in explainer(model_inputs=INPUTS, targets=TARGETS)]
+
+
+@pytest.mark.parametrize("prefix_sharing", [False, True])
+@pytest.mark.parametrize("explainer_cls", EXPLAINERS, ids=lambda cls: cls.__name__)
+def test_padded_batching_matches_per_sample_scores(
+    causal_lm, tokenizer, explainer_cls, prefix_sharing
+):
+    reference = attributions(explainer_cls, causal_lm, tokenizer, 1, padded=False)
+    batched = attributions(
+        explainer_cls, causal_lm, tokenizer, 7, padded=True, prefix_sharing=prefix_sharing
+    )
+    for ref, bat in zip(reference, batched, strict=True):
+        assert ref.shape == bat.shape
+        assert torch.equal(ref.isnan(), bat.isnan())
+        torch.testing.assert_close(bat.nan_to_num(), ref.nan_to_num(), atol=1e-5, rtol=1e-4)
+
+
+def test_duplicate_samples_get_the_same_attributions(causal_lm, tokenizer):
+    batched = attributions(Occlusion, causal_lm, tokenizer, 7, padded=True)
+    torch.testing.assert_close(batched[0], batched[3], equal_nan=True)
+
+
+def test_patch_only_shadows_the_instance(causal_lm, tokenizer):
+    patched = enable_padded_batching(Occlusion(causal_lm, tokenizer, batch_size=2))
+    other = Occlusion(causal_lm, tokenizer, batch_size=2)
+    assert "get_scores" in vars(patched)
+    assert "get_scores" not in vars(other)
+
+    disable_padded_batching(patched)
+    assert "get_scores" not in vars(patched)
+    assert patched.get_scores.__func__ is Occlusion.get_scores
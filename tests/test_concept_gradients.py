@@ -0,0 +1,141 @@
+import pytest
+import torch
+from interpreto import ModelWithSplitPoints
+from interpreto.concepts import NeuronsAsConcepts, SVDConcepts
+from transformers import AutoModelForSequenceClassification, BertConfig, BertForSequenceClassification
+
+from concept_gradients import (
+    activation_output_gradients,
+    compare_concept_gradients,
+    per_method_gradient_chunks,
+    project_concept_gradients,
+    projected_gradient_chunks,
+)
+
+# More inputs than hidden units, so that a full-rank basis can be fitted.
+INPUTS = [
+    f"{subject} {verb} {adjective}"
+    for subject in ("the movie", "the plot", "the acting", "it")
+    for verb in ("was", "was not very")
+    for adjective in ("good", "bad", "great terrible")
+]
+HIDDEN_SIZE = 16
+BATCH_SIZE = 4
+CLS_TOKEN = ModelWithSplitPoints.activation_granularities.CLS_TOKEN
+
+
+@pytest.fixture(scope="module")
+def model_with_split_points(tmp_path_factory, classification_tokenizer):
+    folder = tmp_path_factory.mktemp("bert")
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=len(classification_tokenizer),
+        hidden_size=HIDDEN_SIZE,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=32,
+        num_labels=3,
+    )
+    BertForSequenceClassification(config).eval().save_pretrained(folder)
+    classification_tokenizer.save_pretrained(folder)
+    return ModelWithSplitPoints(
+        str(folder),
+        automodel=AutoModelForSequenceClassification,
+        split_points=1,
+        batch_size=BATCH_SIZE,
+    )
+
+
+@pytest.fixture(scope="module")
+def latent_activations(model_with_split_points):
+    activations = model_with_split_points.get_activations(
+        INPUTS, activation_granularity=CLS_TOKEN
+    )
+    return activations[model_with_split_points.split_points[0]]
+
+
+@pytest.fixture(scope="module")
+def svd(model_with_split_points, latent_activations):
+    # A full-rank basis reconstructs the activations exactly, so the per-method
+    # gradients are taken at the same point as the shared ones.
+    concept_explainer = SVDConcepts(model_with_split_points, nb_concepts=HIDDEN_SIZE)
+    concept_explainer.fit({model_with_split_points.split_points[0]: latent_activations})
+    reconstruction = concept_explainer.decode_concepts(
+        concept_explainer.encode_activations(latent_activations)
+    )
+    torch.testing.assert_close(reconstruction, latent_activations, atol=1e-4, rtol=1e-4)
+    return concept_explainer
+
+
+@pytest.fixture(scope="module")
+def output_gradients(model_with_split_points):
+    return activation_output_gradients(model_with_split_points, INPUTS, CLS_TOKEN, BATCH_SIZE)
+
+
+def test_activation_gradients_match_neurons_as_concepts(model_with_split_points, output_gradients):
+    neurons = NeuronsAsConcepts(model_with_split_points)
+    reference = torch.cat(
+        neurons.concept_output_gradient(
+            inputs=INPUTS,
+            targets=None,
+            activation_granularity=CLS_TOKEN,
+            concepts_x_gradients=False,
+            normalization=False,
+            batch_size=BATCH_SIZE,
+        ),
+        dim=1,
+    ).transpose(0, 1)
+    assert output_gradients.shape == (len(INPUTS), 3, HIDDEN_SIZE)
+    torch.testing.assert_close(output_gradients, reference.float(), atol=1e-5, rtol=1e-4)
+
+
+def test_tokenizer_padding_side_is_restored(model_with_split_points):
+    tokenizer = model_with_split_points.tokenizer
+    padding_side = tokenizer.padding_side
+    activation_output_gradients(model_with_split_points, INPUTS[:2], CLS_TOKEN, BATCH_SIZE)
+    assert tokenizer.padding_side == padding_side
+
+
+@pytest.mark.parametrize("normalization", [False, True])
+@pytest.mark.parametrize("concepts_x_gradients", [False, True])
+def test_projected_gradients_match_per_method_gradients(
+    svd, latent_activations, output_gradients, concepts_x_gradients, normalization
+):
+    projected = project_concept_gradients(
+        svd,
+        output_gradients,
+        latent_activations,
+        concepts_x_gradients=concepts_x_gradients,
+        normalization=normalization,
+    )
+    reference = torch.cat(
+        svd.concept_output_gradient(
+            inputs=INPUTS,
+            targets=None,
+            activation_granularity=CLS_TOKEN,
+            concepts_x_gradients=concepts_x_gradients,
+            normalization=normalization,
+            batch_size=BATCH_SIZE,
+        ),
+        dim=1,
+    ).transpose(0, 1)
+    torch.testing.assert_close(projected, reference.float(), atol=1e-4, rtol=1e-3)
+
+
+def test_chunked_comparison_agrees(svd, latent_activations, output_gradients):
+    projected = torch.cat(
+        list(projected_gradient_chunks(svd, output_gradients, latent_activations, chunk_size=4))
+    )
+    comparison = compare_concept_gradients(
+        "svd",
+        projected,
+        lambda: [
+            chunk.transpose(0, 1)
+            for chunk in per_method_gradient_chunks(svd, INPUTS, CLS_TOKEN, BATCH_SIZE)
+        ],
+        topk=5,
+    )
+    assert comparison.error is None
+    assert comparison.relative_difference < 1e-3
+    assert comparison.cosine_similarity > 0.9999
+    assert comparison.topk_overlap == 1.0
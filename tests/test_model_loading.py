@@ -0,0 +1,71 @@
+import pytest
+import torch
+from transformers import AutoModelForCausalLM, LlamaConfig
+
+from model_loading import load_causal_lm
+
+# bf16 keeps 8 bits of mantissa, so the logits only agree to a few percent.
+TOLERANCE = 0.03
+
+
+@pytest.fixture(scope="module")
+def checkpoint(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("llama")
+    config = LlamaConfig(
+        vocab_size=512,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=4,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+    )
+    torch.manual_seed(0)
+    model = AutoModelForCausalLM.from_config(config).eval()
+    # Several float32 shards, as for the real multi-shard checkpoints.
+    model.save_pretrained(folder, safe_serialization=True, max_shard_size="200KB")
+    assert len(list(folder.glob("*.safetensors"))) > 1
+    return folder
+
+
+@pytest.fixture(scope="module")
+def input_ids():
+    return torch.randint(0, 512, (2, 24), generator=torch.Generator().manual_seed(0))
+
+
+@pytest.fixture(scope="module")
+def float32_logits(checkpoint, input_ids):
+    model = AutoModelForCausalLM.from_pretrained(checkpoint, dtype=torch.float32).eval()
+    with torch.no_grad():
+        return model(input_ids=input_ids).logits
+
+
+def assert_matches_float32(model, input_ids, float32_logits):
+    with torch.no_grad():
+        logits = model(input_ids=input_ids).logits.float()
+    difference = (logits - float32_logits).abs().max()
+    assert difference <= TOLERANCE * float32_logits.abs().max()
+
+
+def test_bf16_load(checkpoint, input_ids, float32_logits):
+    model, peak_rss = load_causal_lm(str(checkpoint))
+    assert peak_rss > 0
+    assert not model.training
+    assert model.dtype == torch.bfloat16
+    assert {parameter.dtype for parameter in model.parameters()} == {torch.bfloat16}
+    assert getattr(model, "hf_device_map", None) is None
+    assert_matches_float32(model, input_ids, float32_logits)
+
+
+def test_bf16_load_with_disk_offload(checkpoint, tmp_path, input_ids, float32_logits):
+    offload_folder = tmp_path / "offload"
+    model, _ = load_causal_lm(
+        str(checkpoint), offload_folder=offload_folder, max_cpu_memory="100KB"
+    )
+    assert model.dtype == torch.bfloat16
+    devices = set(model.hf_device_map.values())
+    assert "disk" in devices
+    assert devices <= {"cpu", "disk"}
+    # Offloaded weights stay on the meta device between forward calls.
+    assert any(parameter.device.type == "meta" for parameter in model.parameters())
+    assert_matches_float32(model, input_ids, float32_logits)